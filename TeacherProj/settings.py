@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'myapp.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,10 +83,37 @@ WSGI_APPLICATION = 'TeacherProj.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv("SQLITE_PATH", BASE_DIR / 'db.sqlite3'),
+        # ! Keep connections open between requests / worker polls
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# ! SQLite pragmas applied to every new connection (see myapp.db): WAL
+# ! lets gunicorn workers read while a send worker writes, and blocked
+# ! writers wait up to SQLITE_BUSY_TIMEOUT_MS instead of failing
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 20000))
+
+# ! Queue EmailLog flushes and job claims behind a lock file next to the
+# ! database, so concurrent writers take turns instead of colliding
+SQLITE_SERIALIZE_WRITES = os.getenv("SQLITE_SERIALIZE_WRITES", "1").lower() in ("1", "true")
+
+# ! File-based by default so the web process and send workers share one
+# ! cache (dashboard stats are invalidated from both); point at Redis or
+# ! Memcached in larger deployments
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv("DJANGO_CACHE_DIR", BASE_DIR / 'django_cache'),
+    }
+}
+
+# ! Dashboard summary cache lifetime, so the 24h / 7d windows keep moving
+DASHBOARD_STATS_TTL = int(os.getenv("DASHBOARD_STATS_TTL", 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -153,5 +181,76 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # ! For demo
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+# ! Messages sent per pooled SMTP session before the connection is recycled
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 100))
+
+# ! Delivery engine: "pooled" (one connection via EMAIL_BACKEND) or
+# ! "async" (EMAIL_CONCURRENCY parallel SMTP sessions to EMAIL_HOST)
+EMAIL_DELIVERY_ENGINE = os.getenv("EMAIL_DELIVERY_ENGINE", "pooled")
+EMAIL_CONCURRENCY = int(os.getenv("EMAIL_CONCURRENCY", 8))
+
+# ! Send rate per SMTP relay account (EMAIL_HOST, EMAIL_PORT and
+# ! EMAIL_HOST_USER), per worker process. Transient SMTP replies
+# ! (421/45x) halve the rate down to the minimum and are retried with
+# ! exponential backoff; successes ramp it back up to the maximum
+EMAIL_RATE_PER_MINUTE = int(os.getenv("EMAIL_RATE_PER_MINUTE", 600))
+EMAIL_RATE_BURST = int(os.getenv("EMAIL_RATE_BURST", 20))
+EMAIL_RATE_MIN_PER_MINUTE = int(os.getenv("EMAIL_RATE_MIN_PER_MINUTE", 10))
+EMAIL_TRANSIENT_RETRIES = int(os.getenv("EMAIL_TRANSIENT_RETRIES", 5))
+EMAIL_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE", 2))
+
+# ! EmailLog rows are buffered and bulk-inserted every N rows or T seconds
+EMAIL_LOG_FLUSH_ROWS = int(os.getenv("EMAIL_LOG_FLUSH_ROWS", 500))
+EMAIL_LOG_FLUSH_SECONDS = float(os.getenv("EMAIL_LOG_FLUSH_SECONDS", 2))
+
+# ! A running send job with no progress for this long is assumed to have
+# ! lost its worker and is resumed by the next free worker
+SEND_JOB_STALE_SECONDS = int(os.getenv("SEND_JOB_STALE_SECONDS", 600))
+# ! How often a running job's heartbeat is refreshed; well below the above
+SEND_JOB_HEARTBEAT_SECONDS = int(os.getenv("SEND_JOB_HEARTBEAT_SECONDS", 60))
+
+# ! Rows per bulk_create batch when importing a member roster
+MEMBER_IMPORT_BATCH_SIZE = int(os.getenv("MEMBER_IMPORT_BATCH_SIZE", 500))
+
+# ! Failed deliveries are retried automatically with exponential backoff:
+# ! EMAIL_RETRY_BACKOFF seconds, doubled after every attempt
+EMAIL_RETRY_MAX_ATTEMPTS = int(os.getenv("EMAIL_RETRY_MAX_ATTEMPTS", 5))
+EMAIL_RETRY_BACKOFF = int(os.getenv("EMAIL_RETRY_BACKOFF", 300))
+
+# ! Rendered attachment cache (PDF / single-sheet Excel bytes)
+ATTACHMENT_CACHE_DIR = BASE_DIR / "attachment_cache"
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# ! Rows per PDF table chunk; bounds render memory on very large sheets
+PDF_CHUNK_ROWS = int(os.getenv("PDF_CHUNK_ROWS", 500))
+
+# ! Worker processes used to render PDF attachments in parallel (1 = inline)
+PDF_RENDER_PROCESSES = int(os.getenv("PDF_RENDER_PROCESSES", os.cpu_count() or 1))
+
+# ! Prometheus metrics: every process (gunicorn workers, send_worker, PDF
+# ! render pool) writes its samples here and /metrics sums them. Empty the
+# ! directory on each deploy, before the processes start. gunicorn.conf.py
+# ! marks exited gunicorn workers dead; tests use a temporary directory
+METRICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", str(BASE_DIR / "metrics"))
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = METRICS_DIR
+
+TEST_RUNNER = "myapp.test_runner.TestRunner"
+
+# ! Bearer token for scraping /metrics without a login (empty = disabled)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# ! Opt-in profiling (cProfile + tracemalloc). PROFILING_ENABLED lets
+# ! superusers and managers profile a request with ?profile=1 or queue a
+# ! profiled send; PROFILE_SEND_JOBS profiles every send job and
+# ! PROFILE_VIEWS every request to the listed URL names (comma-separated)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true")
+PROFILE_SEND_JOBS = os.getenv("PROFILE_SEND_JOBS", "").lower() in ("1", "true")
+PROFILE_VIEWS = [name for name in os.getenv("PROFILE_VIEWS", "").split(",") if name]
+PROFILE_ALLOCATIONS = os.getenv("PROFILE_ALLOCATIONS", "1").lower() in ("1", "true")
+
+# ! Where profiles are written, and how many of the newest are kept
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(BASE_DIR / "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))
+
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'home'
@@ -0,0 +1,18 @@
+import os
+
+# Must match METRICS_DIR in TeacherProj/settings.py. Set here too, since
+# the master process never loads the Django settings
+metrics_dir = os.getenv(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")
+)
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+bind = "0.0.0.0:8000"
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live-gauge files from the /metrics sum
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid, metrics_dir)
@@ -1,9 +1,25 @@
-from django.contrib import admin
+import os
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-
-from .models import Department, Profile, Member, ExcelFile, EmailLog
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import Department, Profile, Member, ExcelFile, EmailLog, SendJob, SendTask
+from .jobs import resume_jobs
+from .member_import import MemberImportError, import_members
+from .profiling import (
+    PROFILE_EXTENSION, SUMMARY_EXTENSION, list_profiles, profile_path
+)
 from .utils import process_pdf_and_send_emails, process_sheet_and_send_emails
+from .workbooks import store_workbook_blob, try_record_sheet_manifest
 
 
 # ----------------------------
@@ -54,6 +70,7 @@ class DepartmentAdmin(admin.ModelAdmin):
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'role', 'department')
     list_filter = ('role', 'department')
+    list_select_related = ('user', 'department')
 
     def has_module_permission(self, request):
         return is_admin_user(request)
@@ -62,29 +79,136 @@ class ProfileAdmin(admin.ModelAdmin):
 # ----------------------------
 # Member Admin
 # ----------------------------
+class MemberImportForm(forms.Form):
+    department = forms.ModelChoiceField(queryset=Department.objects.all())
+    owner = forms.ModelChoiceField(
+        queryset=User.objects.filter(profile__role="head").order_by("username"),
+        help_text="Department head the members are created for; heads only "
+                  "see and send to their own members"
+    )
+    roster = forms.FileField(help_text="CSV or .xlsx with name, email and sheet_name columns")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        department = cleaned_data.get("department")
+        owner = cleaned_data.get("owner")
+        if department and owner and owner.profile.department_id != department.pk:
+            self.add_error("owner", f"{owner.username} is not a head of {department}")
+        return cleaned_data
+
+
 @admin.register(Member)
 class MemberAdmin(admin.ModelAdmin):
+    change_list_template = "admin/myapp/member/change_list.html"
+
     list_display = ('name', 'email', 'sheet_name', 'department', 'created_by')
     list_filter = ('department', 'sheet_name')
     search_fields = ('name', 'email')
+    list_select_related = ('department', 'created_by')
+    # Skip the unfiltered COUNT(*) on large member tables
+    show_full_result_count = False
 
     def has_module_permission(self, request):
         return is_admin_user(request)
 
+    def get_urls(self):
+        return [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_view),
+                name="myapp_member_import"
+            ),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        report = None
+        form = MemberImportForm(request.POST or None, request.FILES or None)
+
+        if request.method == "POST" and form.is_valid():
+            roster = form.cleaned_data["roster"]
+            try:
+                report = import_members(
+                    roster,
+                    roster.name,
+                    department=form.cleaned_data["department"],
+                    created_by=form.cleaned_data["owner"]
+                )
+            except MemberImportError as e:
+                self.message_user(request, str(e), messages.ERROR)
+            else:
+                self.message_user(
+                    request,
+                    f"Imported {report.created} member(s), skipped {report.skipped} row(s)",
+                    messages.SUCCESS if not report.errors else messages.WARNING
+                )
+
+        return render(request, "admin/myapp/member/import.html", {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Import members",
+            "form": form,
+            "report": report,
+        })
+
 
 # ----------------------------
 # ExcelFile Admin
 # ----------------------------
 @admin.register(ExcelFile)
 class ExcelFileAdmin(admin.ModelAdmin):
-    list_display = ('file', 'department', 'uploaded_by', 'upload_time')
+    list_display = ('display_name', 'department', 'uploaded_by', 'upload_time')
     list_filter = ('department', 'upload_time')
+    list_select_related = ('department', 'uploaded_by')
+    search_fields = ('original_name',)
+    readonly_fields = ('original_name', 'content_hash', 'manifest_error')
 
     actions = [
         process_pdf_and_send_emails,
-        process_sheet_and_send_emails
+        process_sheet_and_send_emails,
+        # Only offered when PROFILING_ENABLED (see get_actions)
+        "send_pdf_profiled",
+        "send_excel_profiled",
     ]
 
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if not settings.PROFILING_ENABLED:
+            actions.pop("send_pdf_profiled", None)
+            actions.pop("send_excel_profiled", None)
+        return actions
+
+    @admin.action(description="Send PDF emails (profiled)")
+    def send_pdf_profiled(self, request, queryset):
+        process_pdf_and_send_emails(self, request, queryset, profile=True)
+
+    @admin.action(description="Send Excel emails (profiled)")
+    def send_excel_profiled(self, request, queryset):
+        process_sheet_and_send_emails(self, request, queryset, profile=True)
+
+    def save_model(self, request, obj, form, change):
+        content_hash = None
+        if "file" in form.changed_data:
+            # Store through the content-addressed blob store, like uploads
+            upload = obj.file.file
+            name, content_hash = store_workbook_blob(upload)
+            obj.original_name = os.path.basename(upload.name)
+            obj.file = name
+            obj.content_hash = ""
+
+        super().save_model(request, obj, form, change)
+
+        if content_hash and try_record_sheet_manifest(obj, content_hash) is None:
+            self.message_user(
+                request, "The workbook's sheets could not be read", messages.WARNING
+            )
+
+    @admin.display(description="File", ordering="original_name")
+    def display_name(self, obj):
+        return obj.display_name
+
     def has_module_permission(self, request):
         return is_admin_user(request)
 
@@ -115,6 +239,8 @@ class EmailLogAdmin(admin.ModelAdmin):
     )
 
     ordering = ("-sent_at",)
+    list_select_related = ("sent_by",)
+    show_full_result_count = False
 
     readonly_fields = (
         "sent_by",
@@ -124,6 +250,10 @@ class EmailLogAdmin(admin.ModelAdmin):
         "status",
         "error_message",
         "sent_at",
+        "excel_file",
+        "key_column",
+        "attempt_count",
+        "next_attempt_at",
     )
 
     fieldsets = (
@@ -141,6 +271,9 @@ class EmailLogAdmin(admin.ModelAdmin):
         ("Error Details", {
             "fields": ("error_message",)
         }),
+        ("Retry", {
+            "fields": ("excel_file", "key_column", "attempt_count", "next_attempt_at")
+        }),
         ("Timestamp", {
             "fields": ("sent_at",)
         }),
@@ -157,3 +290,165 @@ class EmailLogAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         # Optional: allow only superadmin to delete logs
         return request.user.is_superuser
+
+
+# ----------------------------
+# Send Job Admin
+# ----------------------------
+@admin.register(SendJob)
+class SendJobAdmin(admin.ModelAdmin):
+    change_list_template = "admin/myapp/sendjob/change_list.html"
+
+    list_display = (
+        "excel_file",
+        "send_type",
+        "status",
+        "requested_by",
+        "worker",
+        "created_at",
+        "finished_at",
+    )
+    list_filter = ("status", "send_type")
+    ordering = ("-created_at",)
+    actions = ("resume_selected_jobs",)
+    # ExcelFile.__str__ reads the department name
+    list_select_related = ("excel_file__department", "requested_by")
+
+    readonly_fields = (
+        "task_summary",
+        "excel_file",
+        "send_type",
+        "key_column",
+        "requested_by",
+        "status",
+        "worker",
+        "error_message",
+        "created_at",
+        "started_at",
+        "heartbeat_at",
+        "finished_at",
+        "profile",
+    )
+
+    def has_module_permission(self, request):
+        return is_admin_user(request)
+
+    def has_add_permission(self, request):
+        # Jobs are queued from the send actions only
+        return False
+
+    @admin.display(description="Deliveries")
+    def task_summary(self, obj):
+        """
+        Status counts in one aggregate query, instead of rendering every
+        task of a large job inline; the link lists them page by page.
+        """
+        counts = dict(
+            obj.tasks.order_by().values_list("status").annotate(Count("id"))
+        )
+        url = reverse("admin:myapp_sendtask_changelist") + f"?job__id__exact={obj.pk}"
+        return format_html(
+            "{} &middot; <a href=\"{}\">View deliveries</a>",
+            ", ".join(
+                f"{label}: {counts.get(status, 0)}"
+                for status, label in SendTask.STATUS_CHOICES
+            ),
+            url,
+        )
+
+    def get_urls(self):
+        return [
+            path(
+                "profiles/",
+                self.admin_site.admin_view(self.profiles_view),
+                name="myapp_sendjob_profiles"
+            ),
+            path(
+                "profiles/<str:name>/",
+                self.admin_site.admin_view(self.profile_detail_view),
+                name="myapp_sendjob_profile"
+            ),
+        ] + super().get_urls()
+
+    def profiles_view(self, request):
+        """
+        Saved profiles (see myapp.profiling), newest first.
+        """
+        if not is_admin_user(request):
+            raise PermissionDenied
+
+        return render(request, "admin/myapp/sendjob/profiles.html", {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Profiles",
+            "profiles": list_profiles(),
+            "keep": settings.PROFILE_KEEP,
+        })
+
+    def profile_detail_view(self, request, name):
+        """
+        The text summary of one profile; ?download=1 returns the raw
+        .prof file for pstats or snakeviz.
+        """
+        if not is_admin_user(request):
+            raise PermissionDenied
+
+        download = request.GET.get("download") == "1"
+        try:
+            path = profile_path(name, PROFILE_EXTENSION if download else SUMMARY_EXTENSION)
+        except FileNotFoundError:
+            raise Http404("Profile not found")
+
+        if download:
+            return FileResponse(open(path, "rb"), as_attachment=True)
+
+        with open(path) as fh:
+            summary = fh.read()
+
+        return render(request, "admin/myapp/sendjob/profile_detail.html", {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": name,
+            "name": name,
+            "summary": summary,
+        })
+
+    @admin.action(description="Resume selected jobs (unsent deliveries only)")
+    def resume_selected_jobs(self, request, queryset):
+        resumed = resume_jobs(queryset)
+        self.message_user(request, f"{resumed} job(s) queued to resume.")
+
+
+# ----------------------------
+# Send Task Admin
+# ----------------------------
+@admin.register(SendTask)
+class SendTaskAdmin(admin.ModelAdmin):
+    """
+    Read-only list of deliveries, reached from a job's "View deliveries"
+    link (filtered on that job).
+    """
+    list_display = ("recipient_email", "sheet_name", "status", "attempt", "job")
+    list_filter = ("status",)
+    search_fields = ("recipient_email", "sheet_name")
+    # SendJob.__str__ reads the file name
+    list_select_related = ("job__excel_file",)
+    # Skip the unfiltered COUNT(*) on large task tables
+    show_full_result_count = False
+    readonly_fields = (
+        "job", "recipient_email", "sheet_name", "status",
+        "error_message", "attempt", "idempotency_key",
+    )
+
+    def has_module_permission(self, request):
+        return is_admin_user(request)
+
+    def has_add_permission(self, request):
+        # Tasks are planned by the send worker
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,471 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from itertools import islice
+
+from django.conf import settings
+
+from openpyxl import Workbook, load_workbook
+from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib.utils import simpleSplit
+from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+from .metrics import ATTACHMENT_CACHE, mark_process_dead, stage_timer
+from .sheet_extract import SheetExtractError, extract_sheet_xlsx
+
+
+PDF_CONTENT_TYPE = "application/pdf"
+EXCEL_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Bumped whenever rendered output changes, so cached attachments from an
+# older renderer are not reused
+RENDER_VERSION = 3
+
+# PDF table layout
+PDF_FONT = "Helvetica"
+PDF_HEADER_FONT = PDF_FONT + "-Bold"
+PDF_FONT_SIZE = 8
+PDF_CELL_PADDING = 6
+PDF_MIN_COLUMN_WIDTH = 24
+PDF_MAX_COLUMN_WIDTH = 216
+
+
+# ==========================================================
+# SHEET RENDERERS
+# ==========================================================
+# Row renderers take an iterable of row value tuples, typically
+# WorkbookReader.iter_rows(), and return the attachment bytes.
+
+def render_sheet_pdf(rows, chunk_rows=None, columns=None):
+    """
+    Renders sheet rows as a PDF, in memory bounded by the chunk size
+    rather than the sheet size.
+
+    - Rows are pulled lazily from `rows` (e.g. a streaming reader) and
+      laid out as a series of tables of PDF_CHUNK_ROWS rows each
+    - The first row is treated as the header and repeated at the top of
+      every chunk and every page
+    - `columns` is the sheet's column count (see _sheet_columns); it
+      defaults to the widest row of the first chunk, or of `rows` if it
+      is a list
+    - Column widths are computed once from the first chunk and shared by
+      all chunks, so the tables line up; wide sheets switch to landscape
+    - Text wider than its column wraps inside the cell, and a row taller
+      than a page is split across pages
+    """
+    chunk_rows = chunk_rows or settings.PDF_CHUNK_ROWS
+    if isinstance(rows, list):
+        columns = max([columns or 0] + [len(row) for row in rows])
+    rows = iter(rows)
+    first_chunk = [_pdf_row(row) for row in islice(rows, chunk_rows + 1)]
+    if not first_chunk:
+        first_chunk = [[""]]
+
+    columns = max([columns or 0] + [len(row) for row in first_chunk])
+    widths = _column_widths(first_chunk, columns)
+
+    pagesize = letter
+    if sum(widths) > letter[0] - 72 * 2:
+        pagesize = landscape(letter)
+    widths = _fit_widths(widths, pagesize[0] - 72 * 2)
+    header = _wrap_row(_pad(first_chunk[0], columns), widths, PDF_HEADER_FONT)
+
+    style = TableStyle([
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONT', (0, 0), (-1, -1), PDF_FONT, PDF_FONT_SIZE),
+        ('FONT', (0, 0), (-1, 0), PDF_HEADER_FONT, PDF_FONT_SIZE),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ])
+
+    def tables():
+        body = first_chunk[1:]
+        while body:
+            data = [header] + [
+                _wrap_row(_pad(row, columns), widths, PDF_FONT) for row in body
+            ]
+            table = Table(data, colWidths=widths, repeatRows=1, splitInRow=1)
+            table.setStyle(style)
+            yield table
+            body = [_pdf_row(row) for row in islice(rows, chunk_rows)]
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=pagesize, pageCompression=1)
+
+    story = _LazyStory(tables())
+    if not first_chunk[1:]:
+        # Header-only sheet
+        header_table = Table([header], colWidths=widths)
+        header_table.setStyle(style)
+        story.append(header_table)
+
+    doc.build(story)
+    pdf_content = buffer.getvalue()
+    buffer.close()
+    return pdf_content
+
+
+class _LazyStory(list):
+    """
+    Flowable list for doc.build() that is refilled from a generator only
+    when it runs empty, so at most one chunk table is alive at a time.
+    """
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._pending = flowables
+
+    def __len__(self):
+        if not super().__len__():
+            next_flowable = next(self._pending, None)
+            if next_flowable is not None:
+                self.append(next_flowable)
+        return super().__len__()
+
+
+def _pdf_row(row):
+    return ["" if value is None else str(value) for value in row]
+
+
+def _pad(row, columns):
+    if len(row) < columns:
+        return row + [""] * (columns - len(row))
+    return row[:columns]
+
+
+def _text_width(value, font=PDF_FONT):
+    # Width of the longest line of the cell
+    return max(stringWidth(line, font, PDF_FONT_SIZE) for line in value.split("\n"))
+
+
+def _column_widths(sample, columns):
+    widths = [PDF_MIN_COLUMN_WIDTH] * columns
+    for row_index, row in enumerate(sample):
+        # The header row is bold
+        font = PDF_HEADER_FONT if row_index == 0 else PDF_FONT
+        for index, value in enumerate(row[:columns]):
+            # Padding included
+            width = _text_width(value, font) + PDF_CELL_PADDING * 2
+            if width > widths[index]:
+                widths[index] = width
+    return [min(width, PDF_MAX_COLUMN_WIDTH) for width in widths]
+
+
+def _wrap_row(row, widths, font):
+    """
+    Breaks the text of cells wider than their column onto more lines, so
+    it stays inside the cell instead of running into its neighbours.
+    """
+    wrapped = []
+    for value, width in zip(row, widths):
+        width -= PDF_CELL_PADDING * 2
+        if value and _text_width(value, font) > width:
+            value = _wrap_text(value, width, font)
+        wrapped.append(value)
+    return wrapped
+
+
+def _wrap_text(value, width, font):
+    # At spaces where possible, mid-word for words longer than a line
+    lines = []
+    for line in value.split("\n"):
+        for part in simpleSplit(line, font, PDF_FONT_SIZE, width) or [""]:
+            if stringWidth(part, font, PDF_FONT_SIZE) > width:
+                broken, broken_width = "", 0
+                for char in part:
+                    char_width = stringWidth(char, font, PDF_FONT_SIZE)
+                    if broken and broken_width + char_width > width:
+                        lines.append(broken)
+                        broken, broken_width = "", 0
+                    broken += char
+                    broken_width += char_width
+                part = broken
+            lines.append(part)
+    return "\n".join(lines)
+
+
+def _sheet_columns(ws):
+    """
+    Column count of a read-only worksheet, from its <dimension> record.
+    Files written without one cost an extra pass over the sheet.
+    """
+    if ws.max_column is None:
+        return max((len(row) for row in ws.iter_rows(values_only=True)), default=0)
+    return ws.max_column
+
+
+def _fit_widths(widths, available):
+    total = sum(widths)
+    if total <= available:
+        return widths
+    scale = available / total
+    return [width * scale for width in widths]
+
+
+def render_sheet_excel(rows):
+    """
+    Streams sheet rows into a new single-sheet workbook. The write-only
+    workbook keeps memory flat regardless of the number of rows.
+    """
+    buffer = BytesIO()
+    new_wb = Workbook(write_only=True)
+    new_ws = new_wb.create_sheet()
+
+    for row in rows:
+        new_ws.append(row)
+
+    new_wb.save(buffer)
+    excel_content = buffer.getvalue()
+    buffer.close()
+    return excel_content
+
+
+def render_pdf(reader, sheet_name):
+    rows = reader.iter_rows(sheet_name)
+    return render_sheet_pdf(rows, columns=_sheet_columns(reader.workbook[sheet_name]))
+
+
+def render_excel(reader, sheet_name):
+    """
+    Copies the sheet's XML part out of the source package. Falls back to
+    re-writing the rows through openpyxl for files the extractor cannot
+    handle (e.g. legacy .xls).
+    """
+    try:
+        return extract_sheet_xlsx(reader.path, sheet_name)
+    except SheetExtractError:
+        return render_sheet_excel(reader.iter_rows(sheet_name))
+
+
+def render_pdf_file(path, sheet_name):
+    """
+    Process-pool entry point. Takes only a path and a sheet name so
+    nothing heavier than two strings is pickled to the worker.
+    """
+    with stage_timer("load_workbook"):
+        wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name]
+        with stage_timer("render"):
+            return render_sheet_pdf(ws.iter_rows(values_only=True), columns=_sheet_columns(ws))
+    finally:
+        wb.close()
+
+
+def _render_pdf_in_pool(path, sheet_name):
+    """
+    render_pdf_file for pool workers: returns (worker pid, content, error)
+    so the parent knows which processes to mark dead once the pool exits.
+    """
+    try:
+        return os.getpid(), render_pdf_file(path, sheet_name), None
+    except Exception as e:
+        return os.getpid(), None, e
+
+
+# send_type -> render(rows), for attachments built from a subset of rows
+ROW_RENDERERS = {
+    "pdf": render_sheet_pdf,
+    "excel": render_sheet_excel,
+}
+
+# send_type -> (render(reader, sheet_name), file extension, content type)
+RENDERERS = {
+    "pdf": (render_pdf, "pdf", PDF_CONTENT_TYPE),
+    "excel": (render_excel, "xlsx", EXCEL_CONTENT_TYPE),
+}
+
+
+# ==========================================================
+# CONTENT HASH
+# ==========================================================
+def file_content_hash(path, chunk_size=1024 * 1024):
+    """
+    SHA-256 of a file, read in chunks so large workbooks stay cheap on memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ==========================================================
+# RENDERED ATTACHMENT CACHE
+# ==========================================================
+class AttachmentCache:
+    """
+    Disk-backed cache of rendered attachment bytes.
+
+    - Keyed by (sheet name, send type, file content hash) only, so an
+      edited workbook never serves a stale attachment and re-uploads of
+      the same workbook share one set of entries
+    - Survives across send runs and processes
+    - Bounded by ATTACHMENT_CACHE_MAX_BYTES; least recently used
+      entries are evicted first
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = str(directory or settings.ATTACHMENT_CACHE_DIR)
+        self.max_bytes = (
+            max_bytes if max_bytes is not None
+            else settings.ATTACHMENT_CACHE_MAX_BYTES
+        )
+
+    @staticmethod
+    def make_key(sheet_name, send_type, content_hash):
+        raw = f"{RENDER_VERSION}\0{sheet_name}\0{send_type}\0{content_hash}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                content = fh.read()
+        except FileNotFoundError:
+            return None
+
+        # Touch the entry so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return content
+
+    def set(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write to a temp file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(content)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._evict()
+
+    def get_or_render(self, key, render):
+        content = self.get(key)
+        if content is None:
+            content = render()
+            self.set(key, content)
+        return content
+
+    def _evict(self):
+        entries = []
+        total = 0
+
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".bin"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# ==========================================================
+# RENDER STAGE
+# ==========================================================
+def render_sheets(reader, sheet_names, send_type, content_hash,
+                  cache=None, processes=None):
+    """
+    Yields (sheet_name, content, error) for each sheet as soon as its
+    attachment is ready, so the send stage can start on the first one.
+
+    - Cache hits are yielded first, without rendering
+    - PDF cache misses are fanned out to a ProcessPoolExecutor of
+      PDF_RENDER_PROCESSES workers (ReportLab is CPU-bound)
+    - Everything else is rendered inline
+
+    Render time and cache hits/misses are recorded in myapp.metrics; pool
+    workers write their own samples, which /metrics sums, and are marked
+    dead when the pool shuts down.
+    """
+    render = RENDERERS[send_type][0]
+    cache = cache or AttachmentCache()
+    processes = processes or settings.PDF_RENDER_PROCESSES
+
+    misses = []
+    for sheet_name in sheet_names:
+        key = cache.make_key(sheet_name, send_type, content_hash)
+        content = cache.get(key)
+        if content is None:
+            misses.append((sheet_name, key))
+        else:
+            ATTACHMENT_CACHE.labels(send_type, "hit").inc()
+            yield sheet_name, content, None
+
+    if misses:
+        ATTACHMENT_CACHE.labels(send_type, "miss").inc(len(misses))
+
+    if send_type == "pdf" and processes > 1 and len(misses) > 1:
+        worker_pids = set()
+        try:
+            # forkserver, not fork: a forked worker would inherit any
+            # serialized_writes() lock held at that moment (e.g. by the
+            # JobHeartbeat thread) and keep it until the pool shuts down
+            with ProcessPoolExecutor(
+                max_workers=min(processes, len(misses)),
+                mp_context=multiprocessing.get_context("forkserver"),
+            ) as pool:
+                futures = {
+                    pool.submit(_render_pdf_in_pool, reader.path, sheet_name): (sheet_name, key)
+                    for sheet_name, key in misses
+                }
+                for future in as_completed(futures):
+                    sheet_name, key = futures[future]
+                    try:
+                        pid, content, error = future.result()
+                        worker_pids.add(pid)
+                        if error is None:
+                            cache.set(key, content)
+                    except Exception as e:
+                        content, error = None, e
+                    yield sheet_name, content, error
+        finally:
+            # The pool has joined its workers by now
+            for pid in worker_pids:
+                mark_process_dead(pid)
+        return
+
+    for sheet_name, key in misses:
+        try:
+            with stage_timer("render"):
+                content = render(reader, sheet_name)
+            cache.set(key, content)
+        except Exception as e:
+            yield sheet_name, None, e
+        else:
+            yield sheet_name, content, None
@@ -0,0 +1,343 @@
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import override_settings
+
+from openpyxl import Workbook
+
+from . import ratelimit
+from .attachments import AttachmentCache, render_sheets
+from .jobs import enqueue_send_jobs
+from .models import Department, ExcelFile, Member
+from .utils import run_send_job
+from .workbooks import WorkbookReader, record_sheet_manifest, store_workbook_blob
+
+
+# Named workload sizes: sheets, rows per sheet, columns, members per sheet
+PRESETS = {
+    "small": {"sheets": 3, "rows": 200, "columns": 6, "members": 5},
+    "medium": {"sheets": 10, "rows": 2000, "columns": 10, "members": 20},
+    "large": {"sheets": 20, "rows": 20000, "columns": 12, "members": 50},
+}
+
+SEND_TYPES = ("pdf", "excel")
+
+
+# ==========================================================
+# PEAK MEMORY
+# ==========================================================
+def reset_peak_rss():
+    """
+    Resets the kernel's high-water mark for this process (Linux only),
+    so each stage reports its own peak. Returns False where unsupported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process, in MB.
+    """
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux, bytes on macOS; lifetime peak only
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+
+
+def children_peak_rss_mb():
+    """
+    Largest peak RSS among finished child processes (PDF render pool).
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+
+
+class Stage:
+    """
+    Times one benchmark stage and records its peak memory.
+
+    Usage:
+        with Stage("render", send_type="pdf", unit="sheets") as stage:
+            ...
+            stage.items = 10
+        stage.result()
+    """
+
+    def __init__(self, name, send_type=None, unit="items"):
+        self.name = name
+        self.send_type = send_type
+        self.unit = unit
+        self.items = 0
+        self.wall_seconds = None
+        self.peak_rss_mb = None
+
+    def __enter__(self):
+        reset_peak_rss()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_seconds = time.perf_counter() - self._started
+        self.peak_rss_mb = peak_rss_mb()
+
+    def result(self):
+        return {
+            "stage": self.name,
+            "send_type": self.send_type,
+            "items": self.items,
+            "unit": self.unit,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "throughput": (
+                round(self.items / self.wall_seconds, 2) if self.wall_seconds else None
+            ),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+
+
+# ==========================================================
+# SYNTHETIC DATA
+# ==========================================================
+def member_email(sheet_index, member_index):
+    return f"bench-{sheet_index}-{member_index}@example.com"
+
+
+def build_workbook(sheets, rows, columns, members, seed=0):
+    """
+    xlsx bytes with `sheets` sheets of `rows` data rows each. Column A
+    holds member emails (round robin), so the workbook also suits
+    personalised sends; the rest are mixed numbers and short text.
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+
+    for sheet_index in range(sheets):
+        ws = wb.create_sheet(f"Sheet{sheet_index + 1}")
+        ws.append(["Email"] + [f"Column {c}" for c in range(1, columns)])
+        for row_index in range(rows):
+            row = [member_email(sheet_index, row_index % members)]
+            for c in range(1, columns):
+                if c % 3 == 0:
+                    row.append(f"item-{rng.randrange(100000)}")
+                elif c % 3 == 1:
+                    row.append(rng.randrange(1000000))
+                else:
+                    row.append(round(rng.random() * 1000, 2))
+            ws.append(row)
+
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+# ==========================================================
+# RUN
+# ==========================================================
+def run_benchmark(sheets, rows, columns, members, send_types=SEND_TYPES,
+                  processes=None, seed=0, paced=False):
+    """
+    Runs the send pipeline end to end on a synthetic workload and
+    returns the results as a JSON-serialisable dict.
+
+    Rows are written to the default database for real, so it must be a
+    scratch one: benchmark_send runs this in a subprocess against a
+    freshly migrated database and metrics directory, never db.sqlite3.
+    Files go to a temporary MEDIA_ROOT / attachment cache, mail to the
+    locmem backend and the Django cache is local memory. Stages per send
+    type:
+    - render: every sheet rendered with a cold attachment cache
+    - send: a full send job with a warm cache (delivery + logging only)
+    - end_to_end: a full send job with a cold cache
+
+    Unless `paced` is set, the relay rate limit is lifted for the
+    run, so the numbers measure the pipeline rather than
+    EMAIL_RATE_PER_MINUTE.
+    """
+    workdir = tempfile.mkdtemp(prefix="benchmark_send_")
+    overrides = override_settings(
+        MEDIA_ROOT=workdir,
+        ATTACHMENT_CACHE_DIR=os.path.join(workdir, "attachment_cache"),
+        EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+        EMAIL_DELIVERY_ENGINE="pooled",
+        PDF_RENDER_PROCESSES=processes or settings.PDF_RENDER_PROCESSES,
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+
+    saved_limiter = ratelimit._default_limiter
+    if not paced:
+        ratelimit._default_limiter = ratelimit.RateLimiter(
+            per_minute=10 ** 9, burst=10 ** 9, min_per_minute=10 ** 9
+        )
+
+    results = []
+    try:
+        with overrides:
+            results = _run_stages(
+                sheets, rows, columns, members, send_types, seed
+            )
+    finally:
+        ratelimit._default_limiter = saved_limiter
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(dt_timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pdf_render_processes": processes or settings.PDF_RENDER_PROCESSES,
+            "paced": paced,
+            "children_peak_rss_mb": round(children_peak_rss_mb(), 1),
+        },
+        "workload": {
+            "sheets": sheets,
+            "rows": rows,
+            "columns": columns,
+            "members_per_sheet": members,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def _run_stages(sheets, rows, columns, members, send_types, seed):
+    results = []
+    messages_per_job = sheets * members
+
+    with Stage("generate_workbook", unit="rows") as stage:
+        content = build_workbook(sheets, rows, columns, members, seed)
+        stage.items = sheets * rows
+    results.append(stage.result())
+
+    owner = User.objects.create_user(f"benchmark-{os.getpid()}-{time.time_ns()}")
+    department = Department.objects.create(name=owner.username)
+
+    with Stage("ingest", unit="rows") as stage:
+        name, content_hash = store_workbook_blob(
+            SimpleUploadedFile("benchmark.xlsx", content)
+        )
+        excel_file = ExcelFile.objects.create(
+            file=name, uploaded_by=owner, department=department
+        )
+        sheet_names = record_sheet_manifest(excel_file, content_hash)
+        stage.items = sheets * rows
+    results.append(stage.result())
+
+    Member.objects.bulk_create([
+        Member(
+            name=f"Member {m}",
+            email=member_email(s, m),
+            sheet_name=sheet_names[s],
+            department=department,
+            created_by=owner
+        )
+        for s in range(sheets)
+        for m in range(members)
+    ])
+    queryset = ExcelFile.objects.filter(pk=excel_file.pk)
+
+    for send_type in send_types:
+        cache = AttachmentCache()
+
+        _clear_cache(cache)
+        with Stage("render", send_type, unit="sheets") as stage:
+            with WorkbookReader(excel_file.file.path) as reader:
+                for _, _, error in render_sheets(
+                    reader, sheet_names, send_type, content_hash, cache=cache
+                ):
+                    if error is not None:
+                        raise error
+                    stage.items += 1
+        results.append(stage.result())
+
+        # Cache is warm now: this measures delivery and logging only
+        job, = enqueue_send_jobs(queryset, send_type, owner)
+        mail.outbox = []
+        with Stage("send", send_type, unit="messages") as stage:
+            run_send_job(job)
+            stage.items = len(mail.outbox)
+        results.append(stage.result())
+
+        _clear_cache(cache)
+        job, = enqueue_send_jobs(queryset, send_type, owner)
+        mail.outbox = []
+        with Stage("end_to_end", send_type, unit="messages") as stage:
+            run_send_job(job)
+            stage.items = len(mail.outbox)
+        results.append(stage.result())
+
+        if stage.items != messages_per_job:
+            raise RuntimeError(
+                f"Expected {messages_per_job} {send_type} messages, sent {stage.items}"
+            )
+
+    mail.outbox = []
+    return results
+
+
+def _clear_cache(cache):
+    shutil.rmtree(cache.directory, ignore_errors=True)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ==========================================================
+# COMPARE
+# ==========================================================
+def compare_results(current, baseline):
+    """
+    Yields (stage, send_type, baseline throughput, current throughput,
+    change in %) for every stage present in both result sets.
+    """
+    previous = {
+        (row["stage"], row["send_type"]): row for row in baseline["results"]
+    }
+    for row in current["results"]:
+        before = previous.get((row["stage"], row["send_type"]))
+        if not before or not before["throughput"] or not row["throughput"]:
+            continue
+        change = (row["throughput"] / before["throughput"] - 1) * 100
+        yield row["stage"], row["send_type"], before["throughput"], row["throughput"], change
+
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as fh:
+        json.dump(results, fh, indent=2)
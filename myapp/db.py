@@ -0,0 +1,93 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on busy_timeout alone
+    fcntl = None
+
+
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+WRITE_LOCK_SUFFIX = ".writelock"
+
+# A second flock() from the same thread would wait on itself
+_held = threading.local()
+
+
+# ==========================================================
+# CONNECTION PRAGMAS
+# ==========================================================
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created receiver: applies the SQLite pragmas for
+    concurrent gunicorn workers and send workers.
+
+    - journal_mode=WAL lets readers run alongside the single writer
+    - synchronous=NORMAL is safe under WAL and skips an fsync per commit
+    - busy_timeout makes a blocked writer wait instead of failing
+      straight away with "database is locked"
+    """
+    if connection.vendor != "sqlite":
+        return
+
+    journal_mode = settings.SQLITE_JOURNAL_MODE.upper()
+    synchronous = settings.SQLITE_SYNCHRONOUS.upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ImproperlyConfigured(f"SQLITE_JOURNAL_MODE must be one of {JOURNAL_MODES}")
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ImproperlyConfigured(f"SQLITE_SYNCHRONOUS must be one of {SYNCHRONOUS_LEVELS}")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {synchronous}")
+
+
+# ==========================================================
+# WRITE SERIALISATION
+# ==========================================================
+@contextmanager
+def serialized_writes(using="default"):
+    """
+    Queues write transactions on an SQLite database behind an exclusive
+    lock file (<database>.writelock), across threads and processes.
+
+    SQLite allows one writer at a time. A transaction that reads before
+    it writes cannot wait out a competing writer (SQLite returns "database
+    is locked" at once, whatever busy_timeout says), so hot write paths
+    take this lock first and then run one at a time. On other databases,
+    in-memory SQLite, or with SQLITE_SERIALIZE_WRITES off, this does
+    nothing.
+
+    Usage:
+        with serialized_writes(), transaction.atomic():
+            ...
+    """
+    connection = connections[using]
+    if (
+        not settings.SQLITE_SERIALIZE_WRITES
+        or fcntl is None
+        or connection.vendor != "sqlite"
+        or connection.is_in_memory_db()
+        or getattr(_held, using, False)
+    ):
+        yield
+        return
+
+    path = str(connection.settings_dict["NAME"]) + WRITE_LOCK_SUFFIX
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        setattr(_held, using, True)
+        yield
+    finally:
+        setattr(_held, using, False)
+        # Closing the descriptor releases the lock
+        os.close(fd)
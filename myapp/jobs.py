@@ -0,0 +1,260 @@
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .db import serialized_writes
+from .models import EmailLog, SendJob, SendTask
+
+
+class JobLostError(Exception):
+    """
+    The job was reclaimed by another worker while this one was running it.
+    """
+
+
+# ==========================================================
+# ENQUEUE
+# ==========================================================
+def enqueue_send_jobs(queryset, send_type, user, key_column="", profile=False):
+    """
+    Queues one SendJob per Excel file and returns immediately.
+    The actual render-and-send work is done by `manage.py send_worker`.
+    A key_column makes the jobs personalised (see SendJob.key_column);
+    profile=True runs them under the profiler.
+    """
+    return SendJob.objects.bulk_create([
+        SendJob(
+            excel_file=excel_file,
+            send_type=send_type,
+            key_column=key_column,
+            requested_by=user,
+            profile=profile
+        )
+        for excel_file in queryset
+    ])
+
+
+# ==========================================================
+# CLAIM
+# ==========================================================
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claimable_jobs():
+    """
+    Queued jobs, plus running jobs whose worker has gone quiet for
+    SEND_JOB_STALE_SECONDS (it most likely died mid-run).
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.SEND_JOB_STALE_SECONDS)
+    return SendJob.objects.filter(
+        Q(status="queued")
+        | Q(status="running", heartbeat_at__lt=stale_before)
+        # Claimed before heartbeats were recorded
+        | Q(status="running", heartbeat_at__isnull=True, started_at__lt=stale_before)
+    )
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically moves the oldest claimable job to "running" for this
+    worker. A reclaimed job resumes where it stopped: its tasks were
+    planned up front, so only the unfinished ones are sent.
+
+    - On databases with row locking, SKIP LOCKED keeps workers from
+      contending for the same row
+    - The conditional UPDATE is the actual claim, so the same job can
+      never be picked up twice (this also covers SQLite, which has no
+      SELECT ... FOR UPDATE)
+
+    Returns None when the queue is empty.
+    """
+    while True:
+        # Read-then-write: on SQLite this must not race another writer
+        with serialized_writes(), transaction.atomic():
+            job = (
+                claimable_jobs()
+                .select_for_update(skip_locked=True)
+                .order_by("created_at", "id")
+                .first()
+            )
+            if job is None:
+                return None
+
+            now = timezone.now()
+            claimed = claimable_jobs().filter(
+                pk=job.pk
+            ).update(
+                status="running",
+                worker=worker_id,
+                started_at=now,
+                heartbeat_at=now
+            )
+
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+        # Another worker won the race for this row; try the next one
+
+
+# ==========================================================
+# HEARTBEAT
+# ==========================================================
+class JobHeartbeat:
+    """
+    Refreshes a running job's heartbeat_at every SEND_JOB_HEARTBEAT_SECONDS
+    from a background thread, for as long as the worker is alive. Long
+    steps that log nothing (a big PDF render, a slow SMTP connect, an
+    async batch) therefore never make the job look abandoned.
+
+    Only the claiming worker's row is touched: if the job was reclaimed
+    elsewhere, `lost` becomes True and the beats stop. run_send_job checks
+    it before every chunk and stops with JobLostError.
+
+    Usage:
+        with JobHeartbeat(job) as heartbeat:
+            run_send_job(job, heartbeat)
+    """
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or settings.SEND_JOB_HEARTBEAT_SECONDS
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    beaten = self.beat()
+                except Exception:
+                    # e.g. database busy: try again on the next beat
+                    continue
+                if not beaten:
+                    self.lost = True
+                    return
+        finally:
+            # Connections are per thread; do not leak this one
+            connection.close()
+
+    def beat(self):
+        with serialized_writes():
+            return SendJob.objects.filter(
+                pk=self.job.pk,
+                status="running",
+                worker=self.job.worker
+            ).update(heartbeat_at=timezone.now())
+
+
+def resume_jobs(queryset):
+    """
+    Queues finished or failed jobs that still have undelivered tasks
+    again. Only the pending tasks are sent when they run. Returns the
+    number of jobs queued.
+    """
+    unfinished = SendTask.objects.filter(job=OuterRef("pk"), status="pending")
+    return queryset.exclude(
+        status__in=["queued", "running"]
+    ).filter(
+        Exists(unfinished)
+    ).update(status="queued", finished_at=None)
+
+
+# ==========================================================
+# AUTOMATIC RETRIES
+# ==========================================================
+def enqueue_due_retries(limit=500):
+    """
+    Turns failed EmailLog entries whose next_attempt_at has passed into
+    SendJobs that contain only those (recipient, sheet) pairs, grouped by
+    (excel file, send type, key column, sender). The jobs run like any other, so
+    attachments come from the AttachmentCache instead of the workbook.
+
+    - Each entry is claimed with a conditional UPDATE (next_attempt_at
+      is cleared), so concurrent callers never retry it twice
+    - Entries already superseded by a later successful send of the same
+      sheet to the same recipient are cleared without a retry
+
+    Returns the number of deliveries queued.
+    """
+    later_success = EmailLog.objects.filter(
+        excel_file=OuterRef("excel_file"),
+        recipient_email=OuterRef("recipient_email"),
+        sheet_name=OuterRef("sheet_name"),
+        send_type=OuterRef("send_type"),
+        status="success",
+        sent_at__gt=OuterRef("sent_at")
+    )
+    due = (
+        EmailLog.objects
+        .filter(
+            status="failed",
+            next_attempt_at__lte=timezone.now(),
+            excel_file__isnull=False
+        )
+        .annotate(superseded=Exists(later_success))
+        .order_by("next_attempt_at")
+        .values_list(
+            "id", "excel_file_id", "send_type", "key_column", "sent_by_id",
+            "recipient_email", "sheet_name", "attempt_count", "superseded"
+        )[:limit]
+    )
+
+    queued = 0
+    # Read-then-write, like claim_next_job
+    with serialized_writes(), transaction.atomic():
+        groups = {}
+        for (log_id, excel_file_id, send_type, key_column, sent_by_id,
+             recipient_email, sheet_name, attempt_count, superseded) in due:
+            claimed = EmailLog.objects.filter(
+                pk=log_id,
+                next_attempt_at__isnull=False
+            ).update(next_attempt_at=None)
+
+            if not claimed or superseded:
+                continue
+
+            pairs = groups.setdefault(
+                (excel_file_id, send_type, key_column, sent_by_id), {}
+            )
+            key = (recipient_email, sheet_name)
+            pairs[key] = max(pairs.get(key, 0), attempt_count + 1)
+
+        for (excel_file_id, send_type, key_column, sent_by_id), pairs in groups.items():
+            job = SendJob.objects.create(
+                excel_file_id=excel_file_id,
+                send_type=send_type,
+                key_column=key_column,
+                requested_by_id=sent_by_id
+            )
+            SendTask.objects.bulk_create([
+                SendTask(
+                    job=job,
+                    recipient_email=recipient_email,
+                    sheet_name=sheet_name,
+                    attempt=attempt,
+                    idempotency_key=SendTask.make_idempotency_key(
+                        job.pk, recipient_email, sheet_name, send_type
+                    )
+                )
+                for (recipient_email, sheet_name), attempt in pairs.items()
+            ])
+            queued += len(pairs)
+
+    return queued
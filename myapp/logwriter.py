@@ -0,0 +1,117 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .db import serialized_writes
+from .metrics import EMAILS, stage_timer
+from .models import EmailLog, SendJob, SendTask
+from .ratelimit import is_permanent
+from .stats import invalidate_dashboard_stats
+
+
+def retry_delay(attempt):
+    """
+    Exponential backoff before retrying a delivery that failed on `attempt`.
+    """
+    return timedelta(seconds=settings.EMAIL_RETRY_BACKOFF * (2 ** (attempt - 1)))
+
+
+# ==========================================================
+# BUFFERED EMAIL LOG WRITER
+# ==========================================================
+class EmailLogWriter:
+    """
+    Buffers EmailLog rows (and the matching SendTask status changes)
+    and writes them with bulk_create / bulk_update in one transaction.
+
+    - Flushes every EMAIL_LOG_FLUSH_ROWS rows or EMAIL_LOG_FLUSH_SECONDS
+      seconds, whichever comes first
+    - Always flushes on exit, including when the send loop raises,
+      so no outcome is lost
+    - Failures get a next_attempt_at for the automatic retry pipeline
+      until EMAIL_RETRY_MAX_ATTEMPTS is reached; permanent SMTP
+      rejections (5xx) never do
+    - On SQLite, flushes from all processes take turns (serialized_writes)
+
+    Usage:
+        with EmailLogWriter() as writer:
+            writer.log(job, task, error)
+    """
+
+    def __init__(self, flush_rows=None, flush_seconds=None):
+        self.flush_rows = flush_rows or settings.EMAIL_LOG_FLUSH_ROWS
+        self.flush_seconds = (
+            flush_seconds if flush_seconds is not None
+            else settings.EMAIL_LOG_FLUSH_SECONDS
+        )
+        self._logs = []
+        self._tasks = []
+        self._job_ids = set()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def log(self, job, task, error=None, retry=True):
+        """
+        Records the outcome of one delivery; error is None on success.
+        Pass retry=False for failures a retry cannot fix (5xx SMTP
+        replies are detected here).
+        """
+        task.status = "success" if error is None else "failed"
+        task.error_message = "" if error is None else str(error)
+
+        next_attempt_at = None
+        if (
+            error is not None and retry
+            and not is_permanent(error)
+            and task.attempt < settings.EMAIL_RETRY_MAX_ATTEMPTS
+        ):
+            next_attempt_at = timezone.now() + retry_delay(task.attempt)
+
+        EMAILS.labels(job.send_type, task.status).inc()
+
+        self._tasks.append(task)
+        self._job_ids.add(job.pk)
+        self._logs.append(EmailLog(
+            sent_by_id=job.requested_by_id,
+            excel_file_id=job.excel_file_id,
+            recipient_email=task.recipient_email,
+            sheet_name=task.sheet_name,
+            send_type=job.send_type,
+            key_column=job.key_column,
+            status=task.status,
+            error_message=task.error_message,
+            attempt_count=task.attempt,
+            next_attempt_at=next_attempt_at
+        ))
+
+        if (
+            len(self._logs) >= self.flush_rows
+            or time.monotonic() - self._last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+
+        if not self._logs:
+            return
+
+        # Buffers are only cleared once the transaction has committed
+        with stage_timer("log_write"), serialized_writes(), transaction.atomic():
+            EmailLog.objects.bulk_create(self._logs)
+            SendTask.objects.bulk_update(self._tasks, ["status", "error_message"])
+            # Progress doubles as the job heartbeat (see claimable_jobs)
+            SendJob.objects.filter(pk__in=self._job_ids).update(
+                heartbeat_at=timezone.now()
+            )
+
+        invalidate_dashboard_stats(*(log.sent_by_id for log in self._logs))
+        self._logs, self._tasks, self._job_ids = [], [], set()
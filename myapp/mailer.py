@@ -0,0 +1,311 @@
+import asyncio
+import smtplib
+import time
+
+import aiosmtplib
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.message import sanitize_address
+
+from .metrics import stage_timer
+from .ratelimit import get_rate_limiter, is_transient, relay_key, smtp_error_codes
+
+
+# ==========================================================
+# POOLED MAIL CONNECTION
+# ==========================================================
+class PooledMailer:
+    """
+    Sends every message of a run over one shared backend connection.
+
+    - The connection (TLS handshake + AUTH) is opened once, not per email,
+      on the first send. If it cannot be opened, every message of the
+      run is reported as failed with that error (so it is logged and
+      retried) instead of the whole run raising
+    - It is recycled after EMAIL_BATCH_SIZE messages, since most relays
+      cap the number of messages accepted per session
+    - If the server drops the session mid-batch, the connection is
+      reopened and the interrupted message is retried once
+    - Sends are paced by the RateLimiter bucket of the relay account
+      (host, port, user); transient replies (421/45x) slow the bucket
+      down and the message is retried with backoff instead of being failed
+
+    Messages are handed to send_messages one at a time so a failure can
+    be attributed to its recipient without re-sending the rest.
+
+    Usage:
+        with PooledMailer() as mailer:
+            for message, error in mailer.send(messages):
+                ...
+    """
+
+    def __init__(self, connection=None, batch_size=None, limiter=None):
+        self.connection = connection or get_connection()
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.limiter = limiter or get_rate_limiter()
+        self.relay = relay_key(
+            getattr(self.connection, "host", ""),
+            getattr(self.connection, "port", ""),
+            getattr(self.connection, "username", ""),
+        )
+        self._sent_in_session = 0
+        self._opened = False
+        self._connect_error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._close()
+
+    def send(self, messages):
+        """
+        Yields (message, error) for each message; error is None on success.
+        """
+        for message in messages:
+            yield message, self._send_one(message)
+
+    def _send_one(self, message):
+        bucket = self.limiter.bucket(self.relay)
+
+        for attempt in range(self.limiter.max_retries + 1):
+            time.sleep(bucket.reserve())
+            with stage_timer("smtp"):
+                error = self._attempt(message)
+
+            if error is None:
+                bucket.succeeded()
+                return None
+            if not is_transient(error) or attempt == self.limiter.max_retries:
+                return error
+
+            bucket.throttled()
+            if 421 in smtp_error_codes(error):
+                # 421 means the server is closing the channel
+                try:
+                    self._reconnect()
+                except Exception:
+                    pass
+            time.sleep(self.limiter.backoff(attempt))
+
+    def _attempt(self, message):
+        if not self._opened:
+            if self._connect_error is not None:
+                # Do not wait out another connect timeout per recipient
+                return self._connect_error
+            try:
+                self.connection.open()
+            except Exception as e:
+                self._connect_error = e
+                return e
+            self._opened = True
+
+        try:
+            if self._sent_in_session >= self.batch_size:
+                self._reconnect()
+
+            try:
+                self.connection.send_messages([message])
+            except smtplib.SMTPServerDisconnected:
+                self._reconnect()
+                self.connection.send_messages([message])
+        except Exception as e:
+            return e
+
+        self._sent_in_session += 1
+        return None
+
+    def _reconnect(self):
+        self._close()
+        self.connection.open()
+        self._sent_in_session = 0
+
+    def _close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            # A dead session can fail on QUIT; the socket is gone either way
+            pass
+
+
+# ==========================================================
+# ASYNCIO DELIVERY ENGINE
+# ==========================================================
+class AsyncMailer:
+    """
+    Alternative delivery engine: up to EMAIL_CONCURRENCY SMTP sessions
+    run concurrently on one asyncio event loop.
+
+    - Talks SMTP directly using the EMAIL_HOST / EMAIL_PORT / EMAIL_USE_TLS
+      settings (EMAIL_BACKEND is not used)
+    - Sessions are opened on demand, kept for the whole run and reused
+      across send() calls; each is recycled after EMAIL_BATCH_SIZE messages
+    - A session dropped by the server is reopened and the message
+      retried once
+    - Pacing and transient-failure retries follow the RateLimiter,
+      exactly as in PooledMailer
+
+    Same interface as PooledMailer, so the send pipeline can use either,
+    except that results come back in completion order.
+    """
+
+    def __init__(self, concurrency=None, batch_size=None,
+                 host=None, port=None, username=None, password=None,
+                 use_tls=None, use_ssl=None, timeout=None, limiter=None):
+        self.limiter = limiter or get_rate_limiter()
+        self.concurrency = concurrency or settings.EMAIL_CONCURRENCY
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.use_tls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.use_ssl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.timeout = settings.EMAIL_TIMEOUT if timeout is None else timeout
+        self.relay = relay_key(self.host, self.port, self.username)
+
+        self._loop = None
+        self._idle = None
+        self._slots = None
+
+    def __enter__(self):
+        self._loop = asyncio.new_event_loop()
+        self._idle = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._loop.run_until_complete(self._close_all())
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    def send(self, messages):
+        """
+        Yields (message, error) for each message as soon as it finishes,
+        in completion order rather than input order; error is None on
+        success. The caller can log (and heartbeat) while the rest of the
+        batch is still in flight.
+        """
+        futures = {
+            self._loop.create_task(self._send_one(message)): message
+            for message in messages
+        }
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = self._loop.run_until_complete(
+                    asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                )
+                for future in done:
+                    try:
+                        error = future.result()
+                    except Exception as e:
+                        error = e
+                    yield futures[future], error
+        finally:
+            # The caller stopped early: do not leave deliveries running
+            for future in pending:
+                future.cancel()
+            if pending:
+                self._loop.run_until_complete(
+                    asyncio.gather(*pending, return_exceptions=True)
+                )
+
+    # ---------- sessions ----------
+    async def _connect(self):
+        client = aiosmtplib.SMTP(
+            hostname=self.host,
+            port=self.port,
+            username=self.username or None,
+            password=self.password or None,
+            use_tls=self.use_ssl,
+            start_tls=self.use_tls,
+            timeout=self.timeout,
+        )
+        await client.connect()
+        return [client, 0]
+
+    async def _acquire(self):
+        # At most `concurrency` messages hold a session at once (see
+        # _send_one), so this never opens more sessions than that
+        if not self._idle.empty():
+            return self._idle.get_nowait()
+        return await self._connect()
+
+    async def _discard(self, session):
+        try:
+            await session[0].quit()
+        except Exception:
+            session[0].close()
+
+    async def _close_all(self):
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait())
+
+    # ---------- delivery ----------
+    async def _deliver(self, session, message):
+        encoding = message.encoding or settings.DEFAULT_CHARSET
+        await session[0].sendmail(
+            sanitize_address(message.from_email, encoding),
+            [sanitize_address(addr, encoding) for addr in message.recipients()],
+            message.message().as_bytes(linesep="\r\n"),
+        )
+        session[1] += 1
+
+    async def _send_one(self, message):
+        bucket = self.limiter.bucket(self.relay)
+
+        for attempt in range(self.limiter.max_retries + 1):
+            await asyncio.sleep(bucket.reserve())
+            async with self._slots:
+                with stage_timer("smtp"):
+                    error = await self._send_with_session(message)
+
+            if error is None:
+                bucket.succeeded()
+                return None
+            if not is_transient(error) or attempt == self.limiter.max_retries:
+                return error
+
+            bucket.throttled()
+            await asyncio.sleep(self.limiter.backoff(attempt))
+
+    async def _send_with_session(self, message):
+        session = None
+        try:
+            session = await self._acquire()
+            try:
+                await self._deliver(session, message)
+            except aiosmtplib.SMTPServerDisconnected:
+                await self._discard(session)
+                session = None
+                session = await self._acquire()
+                await self._deliver(session, message)
+        except Exception as e:
+            # A refused message leaves the session usable (the envelope
+            # is reset); anything that dropped the connection does not
+            if session is not None:
+                await self._release(session)
+            return e
+
+        await self._release(session)
+        return None
+
+    async def _release(self, session):
+        if not session[0].is_connected or session[1] >= self.batch_size:
+            await self._discard(session)
+        else:
+            self._idle.put_nowait(session)
+
+
+def get_mailer():
+    """
+    Returns the delivery engine selected by EMAIL_DELIVERY_ENGINE
+    ("pooled" or "async").
+    """
+    if settings.EMAIL_DELIVERY_ENGINE == "async":
+        return AsyncMailer()
+    return PooledMailer()
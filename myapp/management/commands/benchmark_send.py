@@ -0,0 +1,183 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.benchmark import (
+    PRESETS, SEND_TYPES, compare_results, run_benchmark, write_results
+)
+
+# Set by run_in_scratch to the scratch database's path; --scratch refuses
+# to run against any other database
+SCRATCH_ENV = "BENCHMARK_SCRATCH_DB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the send pipeline on a synthetic workbook: render, "
+        "send and end-to-end stages for PDF and Excel, with wall time, "
+        "throughput and peak RSS per stage. Runs in a subprocess against a "
+        "freshly migrated scratch database and metrics directory (never "
+        "db.sqlite3) with the locmem email backend, and writes the results "
+        "as JSON so runs can be compared between commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--preset",
+            choices=sorted(PRESETS),
+            default="small",
+            help="Workload size; --sheets/--rows/--columns/--members override it",
+        )
+        parser.add_argument("--sheets", type=int, help="Sheets in the workbook")
+        parser.add_argument("--rows", type=int, help="Data rows per sheet")
+        parser.add_argument("--columns", type=int, help="Columns per sheet")
+        parser.add_argument("--members", type=int, help="Members mapped to each sheet")
+        parser.add_argument(
+            "--send-type",
+            action="append",
+            choices=SEND_TYPES,
+            dest="send_types",
+            help="Send path to benchmark; repeat for both (default: both)",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            help="PDF render processes (default: PDF_RENDER_PROCESSES)",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Synthetic data seed")
+        parser.add_argument(
+            "--paced",
+            action="store_true",
+            help="Keep the EMAIL_RATE_PER_MINUTE pacing (lifted by default)",
+        )
+        parser.add_argument(
+            "--output",
+            help="JSON results file (default: benchmark_results/<timestamp>.json)",
+        )
+        parser.add_argument(
+            "--compare",
+            help="Earlier results file to report throughput changes against",
+        )
+        # Internal: run the stages in this process, against its database
+        parser.add_argument("--scratch", action="store_true", help="(internal)")
+
+    def handle(self, *args, **options):
+        workload = dict(PRESETS[options["preset"]])
+        for key in workload:
+            if options[key] is not None:
+                workload[key] = options[key]
+        if min(workload.values()) < 1:
+            raise CommandError("sheets, rows, columns and members must be at least 1")
+
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        if options["scratch"]:
+            database = str(settings.DATABASES["default"]["NAME"])
+            if os.environ.get(SCRATCH_ENV) != database:
+                raise CommandError(
+                    "--scratch is internal: run benchmark_send without it"
+                )
+            if not options["output"]:
+                raise CommandError("--scratch needs --output")
+            results = run_benchmark(
+                send_types=options["send_types"] or SEND_TYPES,
+                processes=options["processes"],
+                seed=options["seed"],
+                paced=options["paced"],
+                **workload
+            )
+            write_results(results, options["output"])
+            return
+
+        self.stdout.write(
+            "Benchmarking {sheets} sheets x {rows} rows x {columns} columns, "
+            "{members} members per sheet".format(**workload)
+        )
+        workdir = tempfile.mkdtemp(prefix="benchmark_send_")
+        try:
+            results = self.run_in_scratch(workdir, workload, options)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self.stdout.write(
+            f"\n{'stage':<20}{'type':<8}{'items':>9}{'seconds':>11}"
+            f"{'per second':>14}{'peak MB':>10}"
+        )
+        for row in results["results"]:
+            self.stdout.write(
+                f"{row['stage']:<20}{row['send_type'] or '-':<8}{row['items']:>9}"
+                f"{row['wall_seconds']:>11.3f}{row['throughput'] or 0:>14.1f}"
+                f"{row['peak_rss_mb']:>10.1f}"
+            )
+
+        if baseline is not None:
+            self.stdout.write(f"\nThroughput vs {options['compare']}:")
+            for stage, send_type, before, after, change in compare_results(results, baseline):
+                style = self.style.SUCCESS if change >= 0 else self.style.WARNING
+                self.stdout.write(style(
+                    f"  {stage:<20}{send_type or '-':<8}{before:>10.1f} -> {after:<10.1f}"
+                    f"({change:+.1f}%)"
+                ))
+
+        output = options["output"] or os.path.join(
+            settings.BASE_DIR,
+            "benchmark_results",
+            f"{datetime.now():%Y%m%d-%H%M%S}.json",
+        )
+        write_results(results, output)
+        self.stdout.write(self.style.SUCCESS(f"\nResults written to {output}"))
+
+    # ---------- scratch run ----------
+    def run_in_scratch(self, workdir, workload, options):
+        """
+        Migrates a scratch database in `workdir` and runs the stages in a
+        subprocess pointed at it, so the benchmark neither holds the live
+        database's write lock nor adds to the live /metrics.
+        """
+        database = os.path.join(workdir, "benchmark.sqlite3")
+        env = {
+            **os.environ,
+            "SQLITE_PATH": database,
+            SCRATCH_ENV: database,
+            "DJANGO_CACHE_DIR": os.path.join(workdir, "cache"),
+            "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "metrics"),
+        }
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, "manage.py")]
+
+        migrate = subprocess.run(
+            manage + ["migrate", "--noinput"], env=env, capture_output=True, text=True
+        )
+        if migrate.returncode:
+            raise CommandError(f"Could not migrate the scratch database:\n{migrate.stderr}")
+
+        output = os.path.join(workdir, "results.json")
+        command = manage + ["benchmark_send", "--scratch", "--output", output]
+        for key, value in workload.items():
+            command += [f"--{key}", str(value)]
+        for send_type in options["send_types"] or ():
+            command += ["--send-type", send_type]
+        if options["processes"]:
+            command += ["--processes", str(options["processes"])]
+        command += ["--seed", str(options["seed"])]
+        if options["paced"]:
+            command.append("--paced")
+
+        run = subprocess.run(command, env=env, capture_output=True, text=True)
+        if run.returncode:
+            raise CommandError(f"Benchmark run failed:\n{run.stderr}")
+
+        with open(output) as fh:
+            return json.load(fh)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from myapp.jobs import enqueue_due_retries
+
+
+class Command(BaseCommand):
+    help = (
+        "Queues failed deliveries whose retry time has passed. The "
+        "send_worker does this on its own when idle; use this command "
+        "from cron if workers are always busy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=500,
+            help="Maximum number of failed deliveries to queue",
+        )
+
+    def handle(self, *args, **options):
+        queued = enqueue_due_retries(limit=options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} deliveries for retry"))
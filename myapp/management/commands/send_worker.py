@@ -0,0 +1,111 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from myapp.db import serialized_writes
+from myapp.jobs import (
+    JobHeartbeat, JobLostError, claim_next_job, default_worker_id, enqueue_due_retries
+)
+from myapp.metrics import mark_process_dead
+from myapp.models import SendJob
+from myapp.profiling import profiled_if
+from myapp.stats import invalidate_dashboard_stats
+from myapp.utils import run_send_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Processes queued send jobs. Any number of workers can run in "
+        "parallel; each job is claimed by exactly one of them. When the "
+        "queue is empty, failed deliveries that are due for a retry are "
+        "queued again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty instead of polling",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+        parser.add_argument(
+            "--worker-id",
+            default=default_worker_id(),
+            help="Name recorded on claimed jobs (default: host:pid)",
+        )
+
+    def handle(self, *args, **options):
+        worker_id = options["worker_id"]
+        self.stdout.write(f"Send worker {worker_id} started")
+        try:
+            self.work(worker_id, options)
+        finally:
+            mark_process_dead()
+
+    def work(self, worker_id, options):
+        while True:
+            close_old_connections()
+            try:
+                job = claim_next_job(worker_id)
+            except Exception as e:
+                self.stderr.write(f"Could not claim a job: {e}")
+                time.sleep(options["poll_interval"])
+                continue
+
+            if job is None:
+                try:
+                    retries = enqueue_due_retries()
+                except Exception as e:
+                    # e.g. the database is busy; the entries stay due
+                    self.stderr.write(f"Could not queue retries: {e}")
+                    retries = 0
+                if retries:
+                    self.stdout.write(f"Queued {retries} failed deliveries for retry")
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(f"Running job {job.pk} ({job})")
+            try:
+                with JobHeartbeat(job) as heartbeat, \
+                        profiled_if(job.profile or settings.PROFILE_SEND_JOBS, f"send-job-{job.pk}"):
+                    run_send_job(job, heartbeat)
+            except JobLostError as e:
+                self.stderr.write(str(e))
+            except Exception as e:
+                self.finish(job, worker_id, status="failed", error_message=str(e))
+                self.stderr.write(f"Job {job.pk} failed: {e}")
+            else:
+                self.finish(job, worker_id, status="done")
+                self.stdout.write(self.style.SUCCESS(f"Job {job.pk} done"))
+
+            # Job status is written with update(), which sends no signals
+            invalidate_dashboard_stats(job.requested_by_id)
+
+    def finish(self, job, worker_id, **fields):
+        """
+        Records the job's outcome behind the write lock.
+
+        - Only this worker's claim is finished: a job reclaimed by another
+          worker is left to that worker
+        - If the database is still busy the job stays "running"; once its
+          heartbeat goes stale another worker reclaims it, finds nothing
+          left to send and finishes it
+        """
+        try:
+            with serialized_writes():
+                SendJob.objects.filter(pk=job.pk, worker=worker_id).update(
+                    finished_at=timezone.now(), **fields
+                )
+        except Exception as e:
+            self.stderr.write(f"Could not record the outcome of job {job.pk}: {e}")
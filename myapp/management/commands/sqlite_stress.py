@@ -0,0 +1,135 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+
+from myapp.logwriter import EmailLogWriter
+from myapp.metrics import mark_process_dead
+from myapp.models import Department, ExcelFile, SendJob, SendTask
+
+
+class Command(BaseCommand):
+    help = (
+        "Stress-tests the SQLite configuration: starts --writers processes "
+        "that each log --rows deliveries through EmailLogWriter at the same "
+        "time, against a freshly migrated scratch database (never "
+        "db.sqlite3). Fails if any writer hits 'database is locked' or rows "
+        "go missing. Set SQLITE_* environment variables to compare "
+        "configurations."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8, help="Concurrent writer processes")
+        parser.add_argument("--rows", type=int, default=500, help="EmailLog rows per writer")
+        parser.add_argument(
+            "--flush-rows",
+            type=int,
+            default=20,
+            help="EmailLogWriter batch size; small batches mean more write transactions",
+        )
+        # Internal: run as one of the writer processes
+        parser.add_argument("--writer", action="store_true", help="(internal)")
+
+    def handle(self, *args, **options):
+        if options["writers"] < 1 or options["rows"] < 1 or options["flush_rows"] < 1:
+            raise CommandError("--writers, --rows and --flush-rows must be at least 1")
+
+        if options["writer"]:
+            return self.write_logs(options["rows"], options["flush_rows"])
+
+        workdir = tempfile.mkdtemp(prefix="sqlite_stress_")
+        try:
+            self.run_stress(workdir, options["writers"], options["rows"], options["flush_rows"])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # ---------- coordinator ----------
+    def run_stress(self, workdir, writers, rows, flush_rows):
+        database = os.path.join(workdir, "stress.sqlite3")
+        env = {
+            **os.environ,
+            "SQLITE_PATH": database,
+            "DJANGO_CACHE_DIR": os.path.join(workdir, "cache"),
+            # Writer samples must not end up in the live /metrics
+            "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "metrics"),
+        }
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, "manage.py")]
+
+        migrate = subprocess.run(
+            manage + ["migrate", "--noinput"], env=env, capture_output=True, text=True
+        )
+        if migrate.returncode:
+            raise CommandError(f"Could not migrate the scratch database:\n{migrate.stderr}")
+
+        self.stdout.write(f"Starting {writers} writers x {rows} rows ({flush_rows} per flush)")
+        started = time.perf_counter()
+        processes = [
+            subprocess.Popen(
+                manage + [
+                    "sqlite_stress", "--writer",
+                    "--rows", str(rows), "--flush-rows", str(flush_rows)
+                ],
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for _ in range(writers)
+        ]
+        failures = []
+        for process in processes:
+            _, stderr = process.communicate()
+            if process.returncode:
+                failures.append(stderr.strip().splitlines()[-1] if stderr.strip() else "exit code")
+        elapsed = time.perf_counter() - started
+
+        with sqlite3.connect(database) as conn:
+            logged = conn.execute("SELECT COUNT(*) FROM myapp_emaillog").fetchone()[0]
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+        expected = writers * rows
+        self.stdout.write(
+            f"journal_mode={journal_mode}: {logged}/{expected} rows in {elapsed:.2f}s "
+            f"({logged / elapsed:.0f} rows/s)"
+        )
+        if failures or logged != expected:
+            raise CommandError(
+                f"{len(failures)} writer(s) failed, {expected - logged} row(s) missing: "
+                + "; ".join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS("All writers completed without lock errors"))
+
+    # ---------- writer process ----------
+    def write_logs(self, rows, flush_rows):
+        try:
+            user = User.objects.create_user(f"stress-{os.getpid()}")
+            department = Department.objects.create(name=user.username)
+            excel_file = ExcelFile.objects.create(
+                file="stress.xlsx", uploaded_by=user, department=department
+            )
+            job = SendJob.objects.create(
+                excel_file=excel_file, send_type="excel", requested_by=user
+            )
+            tasks = SendTask.objects.bulk_create([
+                SendTask(job=job, recipient_email=f"r{i}@example.com", sheet_name="Sheet1")
+                for i in range(rows)
+            ])
+            # bulk_create on SQLite does not set primary keys before 3.35
+            if tasks and tasks[0].pk is None:
+                tasks = list(job.tasks.order_by("id"))
+
+            with EmailLogWriter(flush_rows=flush_rows, flush_seconds=3600) as writer:
+                for task in tasks:
+                    writer.log(job, task)
+        except OperationalError as e:
+            raise CommandError(f"Writer {os.getpid()}: {e}")
+        finally:
+            mark_process_dead()
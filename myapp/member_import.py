@@ -0,0 +1,211 @@
+import codecs
+import csv
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from openpyxl import load_workbook
+
+from .models import Member
+from .stats import invalidate_dashboard_stats
+
+
+# Accepted header spellings -> Member field
+COLUMN_ALIASES = {
+    "name": "name",
+    "full name": "name",
+    "email": "email",
+    "email address": "email",
+    "sheet_name": "sheet_name",
+    "sheet name": "sheet_name",
+    "sheet": "sheet_name",
+}
+REQUIRED_COLUMNS = ("name", "email", "sheet_name")
+
+NAME_MAX_LENGTH = Member._meta.get_field("name").max_length
+SHEET_NAME_MAX_LENGTH = Member._meta.get_field("sheet_name").max_length
+
+
+class MemberImportError(Exception):
+    """
+    The roster as a whole cannot be read (bad format, missing columns).
+    """
+
+
+class MemberImportReport:
+    """
+    Outcome of one import: how many members were created and why each
+    rejected row was skipped, as (row number, message) pairs. Row numbers
+    match what the user sees in their spreadsheet (header is row 1).
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.errors.append((row_number, message))
+
+    @property
+    def skipped(self):
+        return len(self.errors)
+
+
+# ==========================================================
+# ROSTER READERS
+# ==========================================================
+def _iter_csv_rows(fileobj):
+    # Decode line by line so the upload is never read into memory at once
+    yield from csv.reader(codecs.iterdecode(fileobj, "utf-8-sig"))
+
+
+def _iter_xlsx_rows(fileobj):
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for row in wb.worksheets[0].iter_rows(values_only=True):
+            yield ["" if value is None else str(value) for value in row]
+    finally:
+        wb.close()
+
+
+def iter_roster_rows(fileobj, filename):
+    """
+    Yields each roster row as a list of strings, header included.
+    """
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return _iter_csv_rows(fileobj)
+    if name.endswith(".xlsx"):
+        return _iter_xlsx_rows(fileobj)
+    raise MemberImportError("Only .csv and .xlsx rosters are supported")
+
+
+def _column_positions(header):
+    positions = {}
+    for index, title in enumerate(header):
+        field = COLUMN_ALIASES.get(str(title).strip().lower())
+        if field and field not in positions:
+            positions[field] = index
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in positions]
+    if missing:
+        raise MemberImportError(
+            f"Missing required column(s): {', '.join(missing)}"
+        )
+    return positions
+
+
+# ==========================================================
+# IMPORT
+# ==========================================================
+def import_members(fileobj, filename, department, created_by, batch_size=None):
+    """
+    Streams a CSV or xlsx roster into Member rows for one department.
+
+    - Existing (email, department) pairs are loaded once into a set, and
+      the file is de-duplicated against it and against itself, so there
+      are no per-row existence queries
+    - Emails are compared case-insensitively
+    - Valid rows are inserted with bulk_create in batches of
+      MEMBER_IMPORT_BATCH_SIZE, all inside one transaction
+    - Invalid rows are skipped and reported; they never abort the import
+
+    Raises MemberImportError when the file itself cannot be used.
+    """
+    batch_size = batch_size or settings.MEMBER_IMPORT_BATCH_SIZE
+    report = MemberImportReport()
+
+    rows = iter_roster_rows(fileobj, filename)
+    try:
+        header = next(rows)
+    except StopIteration:
+        raise MemberImportError("The roster is empty")
+    except MemberImportError:
+        raise
+    except Exception as e:
+        raise MemberImportError(f"Could not read the roster: {e}")
+
+    positions = _column_positions(header)
+
+    try:
+        _insert_rows(rows, positions, department, created_by, batch_size, report)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Nothing was committed; the whole file is rejected
+        raise MemberImportError(f"Could not read the roster: {e}")
+    except IntegrityError:
+        # Another import added some of these members since they were loaded
+        raise MemberImportError(
+            "Members were added to this department while importing; "
+            "nothing was imported, please try again"
+        )
+
+    invalidate_dashboard_stats(created_by.pk)
+    return report
+
+
+def _insert_rows(rows, positions, department, created_by, batch_size, report):
+    with transaction.atomic():
+        # Loaded in the same transaction as the inserts
+        seen = {
+            email.lower(): None
+            for email in Member.objects.filter(
+                department=department
+            ).values_list("email", flat=True)
+        }
+
+        batch = []
+        for row_number, row in enumerate(rows, start=2):
+            values = {
+                field: (row[index].strip() if index < len(row) else "")
+                for field, index in positions.items()
+            }
+            if not any(values.values()):
+                continue
+
+            error = _validate(values)
+            if error is None:
+                key = values["email"].lower()
+                if key in seen:
+                    first_row = seen[key]
+                    error = (
+                        f"Duplicate of row {first_row}" if first_row
+                        else "Member already exists in this department"
+                    )
+                else:
+                    seen[key] = row_number
+
+            if error:
+                report.add_error(row_number, error)
+                continue
+
+            batch.append(Member(
+                department=department,
+                created_by=created_by,
+                **values
+            ))
+            if len(batch) >= batch_size:
+                Member.objects.bulk_create(batch)
+                report.created += len(batch)
+                batch = []
+
+        if batch:
+            Member.objects.bulk_create(batch)
+            report.created += len(batch)
+
+
+def _validate(values):
+    if not values["name"]:
+        return "Name is required"
+    if len(values["name"]) > NAME_MAX_LENGTH:
+        return f"Name is longer than {NAME_MAX_LENGTH} characters"
+    if not values["sheet_name"]:
+        return "Sheet name is required"
+    if len(values["sheet_name"]) > SHEET_NAME_MAX_LENGTH:
+        return f"Sheet name is longer than {SHEET_NAME_MAX_LENGTH} characters"
+    try:
+        validate_email(values["email"])
+    except ValidationError:
+        return f"Invalid email address: {values['email'] or '(blank)'}"
+    return None
@@ -0,0 +1,106 @@
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+# Each process writes its samples to PROMETHEUS_MULTIPROC_DIR (set in
+# settings) so /metrics can sum them across gunicorn and send workers.
+# The directory must exist before the first metric is created.
+os.makedirs(settings.METRICS_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+)
+from prometheus_client import multiprocess  # noqa: E402
+
+
+# Buckets from 5ms to 5 minutes: covers a single SMTP round trip as
+# well as rendering a very large sheet
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+
+
+# ==========================================================
+# METRICS
+# ==========================================================
+STAGE_SECONDS = Histogram(
+    "excelmailer_stage_seconds",
+    "Time spent in each stage of the send pipeline",
+    ["stage"],
+    buckets=DURATION_BUCKETS,
+)
+VIEW_SECONDS = Histogram(
+    "excelmailer_view_seconds",
+    "Time spent handling the instrumented views",
+    ["view"],
+    buckets=DURATION_BUCKETS,
+)
+EMAILS = Counter(
+    "excelmailer_emails",
+    "Deliveries by outcome",
+    ["send_type", "status"],
+)
+ATTACHMENT_BYTES = Counter(
+    "excelmailer_attachment_bytes",
+    "Bytes attached to outgoing emails",
+    ["send_type"],
+)
+ATTACHMENT_CACHE = Counter(
+    "excelmailer_attachment_cache",
+    "Rendered attachment cache lookups",
+    ["send_type", "result"],
+)
+
+
+# ==========================================================
+# HELPERS
+# ==========================================================
+@contextmanager
+def stage_timer(stage):
+    """
+    Records the duration of the enclosed block as one pipeline stage:
+    load_workbook, plan, partition, render, smtp or log_write.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def timed_view(name):
+    """
+    View decorator recording the response time under `name`.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                VIEW_SECONDS.labels(name).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def mark_process_dead(pid=None):
+    """
+    Bookkeeping for a process (default: this one) that has exited: its
+    live-gauge files are removed. Counter and histogram files are kept so
+    totals never go backwards; they are cleared with the directory on
+    deploy.
+    """
+    multiprocess.mark_process_dead(pid or os.getpid(), settings.METRICS_DIR)
+
+
+def render_metrics():
+    """
+    Prometheus text exposition of the samples of every process.
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=settings.METRICS_DIR)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_sendjob_sendtask'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['department', 'created_by', 'sheet_name'], name='member_dept_owner_sheet_idx'),
+        ),
+    ]
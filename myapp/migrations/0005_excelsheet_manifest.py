@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_member_dept_owner_sheet_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='excelfile',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of the file, set when the sheet manifest is extracted', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='ExcelSheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('position', models.PositiveIntegerField()),
+                ('max_row', models.PositiveIntegerField(default=0)),
+                ('max_column', models.PositiveIntegerField(default=0)),
+                ('excel_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sheets', to='myapp.excelfile')),
+            ],
+            options={
+                'ordering': ('position',),
+                'unique_together': {('excel_file', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_excelsheet_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillog',
+            name='attempt_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='excel_file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='email_logs', to='myapp.excelfile'),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When this failure is due for an automatic retry; empty once retried or out of attempts', null=True),
+        ),
+        migrations.AddField(
+            model_name='sendtask',
+            name='attempt',
+            field=models.PositiveIntegerField(default=1, help_text='Delivery attempt number; above 1 for automatic retries'),
+        ),
+    ]
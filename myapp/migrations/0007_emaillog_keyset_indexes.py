@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_emaillog_retry_state'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['sent_by', '-sent_at', '-id'], name='emaillog_sender_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['sent_by', 'status', '-sent_at'], name='emaillog_sender_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['sent_by', 'sheet_name', '-sent_at'], name='emaillog_sender_sheet_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_emaillog_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillog',
+            name='key_column',
+            field=models.CharField(blank=True, help_text="Personalised sends: column the recipient's rows were selected by", max_length=100),
+        ),
+        migrations.AddField(
+            model_name='sendjob',
+            name='key_column',
+            field=models.CharField(blank=True, help_text='Personalised mode: header of the column matched against member emails; each member only gets their own rows. Empty sends the whole sheet.', max_length=100),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:44
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_idempotency_keys(apps, schema_editor):
+    SendTask = apps.get_model("myapp", "SendTask")
+    tasks = SendTask.objects.filter(idempotency_key__isnull=True).select_related("job")
+    batch = []
+    for task in tasks.iterator(chunk_size=2000):
+        raw = f"{task.job_id}\0{task.recipient_email}\0{task.sheet_name}\0{task.job.send_type}"
+        task.idempotency_key = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        batch.append(task)
+        if len(batch) >= 2000:
+            SendTask.objects.bulk_update(batch, ["idempotency_key"])
+            batch = []
+    if batch:
+        SendTask.objects.bulk_update(batch, ["idempotency_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_personalised_sends'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, help_text='Last progress from the worker; running jobs that go quiet for SEND_JOB_STALE_SECONDS are resumed by another worker', null=True),
+        ),
+        migrations.AddField(
+            model_name='sendtask',
+            name='idempotency_key',
+            field=models.CharField(editable=False, help_text='Identifies this delivery; also sent as the Message-ID, so a message re-sent after a crash can be deduplicated', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='sendtask',
+            index=models.Index(fields=['job', 'status'], name='sendtask_job_status_idx'),
+        ),
+        migrations.RunPython(backfill_idempotency_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_resumable_send_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='profile',
+            field=models.BooleanField(default=False, help_text='Run under the profiler; the result is listed under Send jobs > Profiles'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_sendjob_profile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sendtask',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('success', 'Success'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+    ]
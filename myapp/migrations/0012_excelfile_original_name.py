@@ -0,0 +1,35 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:08
+
+import os
+
+from django.db import migrations, models
+
+
+def backfill_original_names(apps, schema_editor):
+    # Files saved before the blob store kept their upload name on disk;
+    # blobs are named by hash, so their original name is not recoverable
+    ExcelFile = apps.get_model("myapp", "ExcelFile")
+    files = ExcelFile.objects.filter(original_name="").exclude(
+        file__startswith="excel_files/blobs/"
+    )
+    batch = []
+    for excel in files.iterator(chunk_size=2000):
+        excel.original_name = os.path.basename(excel.file.name)[:255]
+        batch.append(excel)
+    ExcelFile.objects.bulk_update(batch, ["original_name"], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_sendtask_sending_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='excelfile',
+            name='original_name',
+            field=models.CharField(blank=True, help_text='File name as uploaded; the stored file is named after its content hash', max_length=255),
+        ),
+        migrations.RunPython(backfill_original_names, migrations.RunPython.noop),
+    ]
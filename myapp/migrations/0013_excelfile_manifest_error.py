@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_excelfile_original_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='excelfile',
+            name='manifest_error',
+            field=models.TextField(blank=True, help_text='Why the sheet list could not be read; such files are not parsed again on every page view'),
+        ),
+    ]
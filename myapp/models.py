@@ -1,3 +1,6 @@
+import hashlib
+import os
+
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -57,6 +60,13 @@ class Member(models.Model):
 
     class Meta:
         unique_together = ('email', 'department')
+        indexes = [
+            # Covers the per-workbook member lookup in the send pipeline
+            models.Index(
+                fields=['department', 'created_by', 'sheet_name'],
+                name='member_dept_owner_sheet_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.department.name})"
@@ -76,9 +86,53 @@ class ExcelFile(models.Model):
         on_delete=models.CASCADE
     )
     upload_time = models.DateTimeField(auto_now_add=True)
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text="SHA-256 of the file, set when the sheet manifest is extracted"
+    )
+    manifest_error = models.TextField(
+        blank=True,
+        help_text="Why the sheet list could not be read; such files "
+                  "are not parsed again on every page view"
+    )
+    original_name = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="File name as uploaded; the stored file is named after its content hash"
+    )
+
+    @property
+    def display_name(self):
+        # Rows from before original_name was recorded fall back to the stored name
+        return self.original_name or os.path.basename(self.file.name)
+
+    def __str__(self):
+        return f"{self.display_name} - {self.department.name}"
+
+
+class ExcelSheet(models.Model):
+    """
+    Sheet manifest extracted once at upload time, so pages listing
+    sheets never have to open the workbook.
+    """
+    excel_file = models.ForeignKey(
+        ExcelFile,
+        on_delete=models.CASCADE,
+        related_name="sheets"
+    )
+    name = models.CharField(max_length=100)
+    position = models.PositiveIntegerField()
+    max_row = models.PositiveIntegerField(default=0)
+    max_column = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("position",)
+        unique_together = ("excel_file", "name")
 
     def __str__(self):
-        return f"{self.file.name} - {self.department.name}"
+        return f"{self.excel_file.display_name} | {self.name}"
 
 
 class EmailLog(models.Model):
@@ -97,12 +151,157 @@ class EmailLog(models.Model):
         on_delete=models.CASCADE,
         related_name="email_logs"
     )
+    excel_file = models.ForeignKey(
+        ExcelFile,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="email_logs"
+    )
     recipient_email = models.EmailField()
     sheet_name = models.CharField(max_length=100)
     send_type = models.CharField(max_length=10, choices=SEND_TYPE_CHOICES)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES)
     error_message = models.TextField(blank=True)
     sent_at = models.DateTimeField(auto_now_add=True)
+    key_column = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text="Personalised sends: column the recipient's rows were selected by"
+    )
+
+    # Retry state (failed entries only)
+    attempt_count = models.PositiveIntegerField(default=1)
+    next_attempt_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="When this failure is due for an automatic retry; "
+                  "empty once retried or out of attempts"
+    )
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the log page: newest first per sender
+            models.Index(
+                fields=["sent_by", "-sent_at", "-id"],
+                name="emaillog_sender_time_idx"
+            ),
+            # Same ordering, narrowed by the most common filters
+            models.Index(
+                fields=["sent_by", "status", "-sent_at"],
+                name="emaillog_sender_status_idx"
+            ),
+            models.Index(
+                fields=["sent_by", "sheet_name", "-sent_at"],
+                name="emaillog_sender_sheet_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient_email} | {self.sheet_name} | {self.send_type}"
+
+# ----------------------------
+# Background Send Queue
+# ----------------------------
+class SendJob(models.Model):
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    excel_file = models.ForeignKey(
+        ExcelFile,
+        on_delete=models.CASCADE,
+        related_name="send_jobs"
+    )
+    send_type = models.CharField(max_length=10, choices=EmailLog.SEND_TYPE_CHOICES)
+    key_column = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text="Personalised mode: header of the column matched against "
+                  "member emails; each member only gets their own rows. "
+                  "Empty sends the whole sheet."
+    )
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="send_jobs"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    worker = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text="Worker process that claimed this job"
+    )
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Last progress from the worker; running jobs that go "
+                  "quiet for SEND_JOB_STALE_SECONDS are resumed by another worker"
+    )
+    finished_at = models.DateTimeField(null=True, blank=True)
+    profile = models.BooleanField(
+        default=False,
+        help_text="Run under the profiler; the result is listed under Send jobs > Profiles"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.excel_file.display_name} | {self.send_type} | {self.status}"
+
+
+class SendTask(models.Model):
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        # Handed to the mail server; the outcome is not recorded yet
+        ("sending", "Sending"),
+        ("success", "Success"),
+        ("failed", "Failed"),
+    )
+
+    job = models.ForeignKey(
+        SendJob,
+        on_delete=models.CASCADE,
+        related_name="tasks"
+    )
+    recipient_email = models.EmailField()
+    sheet_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    error_message = models.TextField(blank=True)
+    attempt = models.PositiveIntegerField(
+        default=1,
+        help_text="Delivery attempt number; above 1 for automatic retries"
+    )
+    idempotency_key = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        editable=False,
+        help_text="Identifies this delivery; also sent as the Message-ID, "
+                  "so a message re-sent after a crash can be deduplicated"
+    )
+
+    class Meta:
+        unique_together = ("job", "recipient_email", "sheet_name")
+        indexes = [
+            # Resuming a job reads only its unfinished tasks
+            models.Index(fields=["job", "status"], name="sendtask_job_status_idx"),
+        ]
+
+    @staticmethod
+    def make_idempotency_key(job_id, recipient_email, sheet_name, send_type):
+        raw = f"{job_id}\0{recipient_email}\0{sheet_name}\0{send_type}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
     def __str__(self):
-        return f"{self.recipient_email} | {self.sheet_name} | {self.send_type}"
\ No newline at end of file
+        return f"{self.recipient_email} | {self.sheet_name} | {self.status}"
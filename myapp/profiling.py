@@ -0,0 +1,213 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+
+PROFILE_EXTENSION = ".prof"
+SUMMARY_EXTENSION = ".txt"
+
+# Lines of the text summary
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+_NAME_RE = re.compile(r"^[\w.-]+$")
+
+# cProfile cannot nest: an inner profiled() block (a profiled view that
+# runs a profiled send) is simply part of the outer profile
+_state = threading.local()
+
+
+# ==========================================================
+# WHO / WHEN
+# ==========================================================
+def can_profile(user):
+    return user.is_authenticated and (user.is_superuser or (
+        hasattr(user, "profile") and user.profile.role == "manager"
+    ))
+
+
+def profiling_requested(request):
+    """
+    True when a superuser or manager asked for this request, or the send
+    it queues, to be profiled (?profile=1 or a `profile` form field) and
+    PROFILING_ENABLED allows per-request profiling.
+    """
+    if not settings.PROFILING_ENABLED:
+        return False
+    flag = request.GET.get("profile") or request.POST.get("profile")
+    return flag in ("1", "on") and can_profile(request.user)
+
+
+# ==========================================================
+# PROFILE A BLOCK
+# ==========================================================
+@contextmanager
+def profiled(label):
+    """
+    Runs the block under cProfile, and tracemalloc when
+    PROFILE_ALLOCATIONS is set, then writes to PROFILE_DIR:
+    - <name>.prof: raw pstats data (pstats, snakeviz, ...)
+    - <name>.txt: wall time, top functions by cumulative time and the
+      lines that allocated the most memory
+
+    Only the newest PROFILE_KEEP profiles are kept.
+    """
+    if getattr(_state, "active", False):
+        yield
+        return
+
+    tracing = settings.PROFILE_ALLOCATIONS and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+
+    _state.active = True
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        _state.active = False
+
+        snapshot = peak = None
+        if tracing:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        _write_profile(label, profiler, elapsed, snapshot, peak)
+        prune_profiles()
+
+
+def profiled_if(enabled, label):
+    return profiled(label) if enabled else nullcontext()
+
+
+def _write_profile(label, profiler, elapsed, snapshot, peak):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r"[^\w.-]+", "-", label).strip("-")[:80] or "profile"
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{slug}"
+    base = os.path.join(settings.PROFILE_DIR, name)
+
+    profiler.dump_stats(base + PROFILE_EXTENSION)
+
+    out = io.StringIO()
+    out.write(f"{label}\nWall time: {elapsed:.3f}s\n\n")
+    out.write("Top functions by cumulative time\n")
+    out.write("--------------------------------\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+    if snapshot is not None:
+        out.write("Allocations\n")
+        out.write("-----------\n")
+        out.write(f"Peak traced memory: {peak / (1024 * 1024):.1f} MB\n\n")
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            out.write(f"{stat}\n")
+
+    with open(base + SUMMARY_EXTENSION, "w") as fh:
+        fh.write(out.getvalue())
+
+
+# ==========================================================
+# PROFILES DIRECTORY
+# ==========================================================
+def list_profiles():
+    """
+    Saved profiles, newest first, as dicts with name, recorded (datetime)
+    and size (bytes of the .prof file).
+    """
+    try:
+        files = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for filename in files:
+        name, extension = os.path.splitext(filename)
+        if extension != PROFILE_EXTENSION:
+            continue
+        stat = os.stat(os.path.join(settings.PROFILE_DIR, filename))
+        profiles.append({
+            "name": name,
+            "recorded": datetime.fromtimestamp(stat.st_mtime),
+            "size": stat.st_size,
+        })
+
+    # Names start with a sortable timestamp
+    return sorted(profiles, key=lambda profile: profile["name"], reverse=True)
+
+
+def profile_path(name, extension):
+    """
+    Path of one saved profile file. Raises FileNotFoundError for unknown
+    or malformed names, so user input can never leave PROFILE_DIR.
+    """
+    if not _NAME_RE.match(name) or extension not in (PROFILE_EXTENSION, SUMMARY_EXTENSION):
+        raise FileNotFoundError(name)
+    path = os.path.join(settings.PROFILE_DIR, name + extension)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(name)
+    return path
+
+
+def prune_profiles(keep=None):
+    keep = settings.PROFILE_KEEP if keep is None else keep
+    for profile in list_profiles()[keep:]:
+        for extension in (PROFILE_EXTENSION, SUMMARY_EXTENSION):
+            try:
+                os.remove(os.path.join(settings.PROFILE_DIR, profile["name"] + extension))
+            except FileNotFoundError:
+                pass
+
+
+# ==========================================================
+# VIEW PROFILING MIDDLEWARE
+# ==========================================================
+class ProfilingMiddleware:
+    """
+    Profiles a request when its URL name is listed in PROFILE_VIEWS, or
+    when profiling_requested() (admin user + ?profile=1). Must come after
+    AuthenticationMiddleware. Costs nothing for other requests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        label = self._label(request)
+        if label is None:
+            return self.get_response(request)
+
+        with profiled(label):
+            return self.get_response(request)
+
+    def _label(self, request):
+        if not settings.PROFILE_VIEWS and "profile" not in request.GET:
+            return None
+
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+
+        if match.url_name in settings.PROFILE_VIEWS or (
+            request.GET.get("profile") == "1" and profiling_requested(request)
+        ):
+            return f"view-{match.view_name}"
+        return None
@@ -0,0 +1,170 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+# SMTP replies that mean "slow down / try later" rather than "never"
+TRANSIENT_SMTP_CODES = {421, 450, 451, 452}
+
+# Additive recovery per successful send, as a fraction of the max rate
+RECOVERY_STEP = 0.02
+# Multiplicative decrease applied when the relay throttles us
+THROTTLE_FACTOR = 0.5
+
+
+# ==========================================================
+# SMTP ERROR CLASSIFICATION
+# ==========================================================
+def smtp_error_codes(error):
+    """
+    Reply codes carried by an smtplib or aiosmtplib exception.
+    """
+    codes = []
+
+    # smtplib: smtp_code, aiosmtplib: code
+    for attr in ("smtp_code", "code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            codes.append(code)
+
+    # Refused recipients carry one reply per address
+    recipients = getattr(error, "recipients", None)
+    if isinstance(recipients, dict):
+        codes.extend(reply[0] for reply in recipients.values())
+    elif isinstance(recipients, (list, tuple)):
+        codes.extend(
+            r.code for r in recipients if isinstance(getattr(r, "code", None), int)
+        )
+
+    return codes
+
+
+def is_transient(error):
+    codes = smtp_error_codes(error)
+    return bool(codes) and all(code in TRANSIENT_SMTP_CODES for code in codes)
+
+
+def is_permanent(error):
+    """
+    True for 5xx replies (e.g. 550 user unknown): sending again later
+    cannot succeed and only hurts the sender's reputation.
+    """
+    codes = smtp_error_codes(error)
+    return bool(codes) and all(500 <= code < 600 for code in codes)
+
+
+# ==========================================================
+# TOKEN BUCKET
+# ==========================================================
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to the relay (AIMD):
+    - throttled() halves the rate, down to min_rate
+    - succeeded() adds back a small step, up to max_rate
+
+    reserve() never blocks; it takes a token and returns how long the
+    caller must wait before using it, so both threads and coroutines
+    can share the same bucket.
+    """
+
+    def __init__(self, max_rate, burst, min_rate, clock=time.monotonic):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.burst = burst
+        self.clock = clock
+
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * THROTTLE_FACTOR)
+            # Drop any saved-up burst so the lower rate applies immediately
+            self._tokens = min(self._tokens, 0)
+
+    def succeeded(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+
+# ==========================================================
+# PER-RELAY RATE LIMITER
+# ==========================================================
+def relay_key(host, port, username=""):
+    """
+    Bucket key for one SMTP relay account. Relays meter the account that
+    authenticates, not the From header (always DEFAULT_FROM_EMAIL here).
+    Backends without a relay (locmem, console) all map to one key.
+    """
+    return f"{username or ''}@{host or ''}:{port or ''}"
+
+
+class RateLimiter:
+    """
+    One adaptive TokenBucket per SMTP relay account (see relay_key), plus
+    the retry policy for transient SMTP failures.
+
+    Rates are per process: with several send workers, divide the relay's
+    quota between them via EMAIL_RATE_PER_MINUTE.
+    """
+
+    def __init__(self, per_minute=None, burst=None, min_per_minute=None,
+                 max_retries=None, backoff_base=None):
+        self.per_minute = per_minute or settings.EMAIL_RATE_PER_MINUTE
+        self.burst = burst or settings.EMAIL_RATE_BURST
+        self.min_per_minute = min_per_minute or settings.EMAIL_RATE_MIN_PER_MINUTE
+        self.max_retries = (
+            settings.EMAIL_TRANSIENT_RETRIES if max_retries is None else max_retries
+        )
+        self.backoff_base = (
+            settings.EMAIL_BACKOFF_BASE if backoff_base is None else backoff_base
+        )
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, relay):
+        with self._lock:
+            if relay not in self._buckets:
+                self._buckets[relay] = TokenBucket(
+                    max_rate=self.per_minute / 60,
+                    burst=self.burst,
+                    min_rate=self.min_per_minute / 60,
+                )
+            return self._buckets[relay]
+
+    def backoff(self, attempt):
+        """
+        Extra delay before retry number `attempt` (0-based).
+        """
+        return self.backoff_base * (2 ** attempt)
+
+
+_default_limiter = None
+
+
+def get_rate_limiter():
+    """
+    Process-wide limiter, so buckets keep their learned rate between jobs.
+    """
+    global _default_limiter
+    if _default_limiter is None:
+        _default_limiter = RateLimiter()
+    return _default_limiter
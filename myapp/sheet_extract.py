@@ -0,0 +1,330 @@
+"""
+Single-sheet .xlsx extraction straight from the source zip package.
+
+Instead of loading cells into openpyxl and writing them back out, the
+sheet's XML part is copied as-is, together with the styles and theme it
+points at. Styles, merged cells, number formats, column widths and row
+heights therefore come through unchanged.
+
+Two things are rewritten on the way:
+- Shared strings are pruned to the ones the sheet references and
+  re-indexed, so other sheets' text never ends up in the attachment
+- Formulas are dropped in favour of their cached values, matching the
+  data_only behaviour of the rest of the send pipeline
+"""
+import posixpath
+import re
+import zipfile
+from io import BytesIO
+from xml.etree import ElementTree
+
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+REL_OFFICE_DOCUMENT = NS_REL + "/officeDocument"
+REL_WORKSHEET = NS_REL + "/worksheet"
+REL_STYLES = NS_REL + "/styles"
+REL_SHARED_STRINGS = NS_REL + "/sharedStrings"
+REL_THEME = NS_REL + "/theme"
+
+CT_WORKBOOK = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"
+CT_WORKSHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+CT_STYLES = "application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"
+CT_SHARED_STRINGS = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+CT_THEME = "application/vnd.openxmlformats-officedocument.theme+xml"
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# Shared-string cells: <c ... t="s" ...><v>12</v>
+SHARED_STRING_CELL_RE = re.compile(
+    rb'(<(?:\w+:)?c\b[^>]*?\st="s"[^>]*>\s*<((?:\w+:)?)v>)(\d+)(</\2v>)'
+)
+FORMULA_RE = re.compile(rb'<((?:\w+:)?)f\b[^>]*?(?:/>|>.*?</\1f>)', re.S)
+SHARED_STRING_ITEM_RE = re.compile(rb'<((?:\w+:)?)si\b[^>]*?(?:/>|>.*?</\1si>)', re.S)
+SST_OPEN_RE = re.compile(rb'<((?:\w+:)?)sst\b[^>]*>')
+SST_COUNT_ATTR_RE = re.compile(rb'\s(?:count|uniqueCount)="[^"]*"')
+SHEET_DATA_START_RE = re.compile(rb'<(?:\w+:)?sheetData\b')
+SHEET_DATA_END_RE = re.compile(rb'</(?:\w+:)?sheetData>|<(?:\w+:)?sheetData\s*/>')
+
+# Elements after <sheetData> that point at package parts we do not copy
+# (drawings, comments, tables, embedded objects, ...)
+DROPPED_TAIL_ELEMENTS = (
+    "drawing", "legacyDrawing", "legacyDrawingHF", "picture",
+    "oleObjects", "controls", "tableParts", "webPublishItems",
+)
+DROPPED_TAIL_RE = re.compile(
+    rb'<((?:\w+:)?)(?:' + "|".join(DROPPED_TAIL_ELEMENTS).encode() +
+    rb')\b[^>]*?(?:/>|>.*?</\1(?:' + "|".join(DROPPED_TAIL_ELEMENTS).encode() + rb')>)',
+    re.S
+)
+REL_ID_ATTR_RE = re.compile(rb'\s[\w.]+:id="([^"]*)"')
+
+
+class SheetExtractError(Exception):
+    """
+    The package cannot be extracted part-by-part (e.g. not an OOXML zip).
+    """
+
+
+# ==========================================================
+# PACKAGE HELPERS
+# ==========================================================
+def _rels_path(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, "_rels", f"{name}.rels")
+
+
+def _read_rels(package, part):
+    """
+    Returns [(id, type, target_part_or_url, is_external), ...] for a part.
+    """
+    try:
+        data = package.read(_rels_path(part))
+    except KeyError:
+        return []
+
+    base = posixpath.dirname(part)
+    rels = []
+    for rel in ElementTree.fromstring(data).iter(f"{{{NS_PKG_REL}}}Relationship"):
+        target = rel.get("Target")
+        external = rel.get("TargetMode") == "External"
+        if not external:
+            if target.startswith("/"):
+                target = target.lstrip("/")
+            else:
+                target = posixpath.normpath(posixpath.join(base, target))
+        rels.append((rel.get("Id"), rel.get("Type"), target, external))
+    return rels
+
+
+def _first_target(rels, rel_type):
+    for _, type_, target, external in rels:
+        if type_ == rel_type and not external:
+            return target
+    return None
+
+
+# ==========================================================
+# PART REWRITES
+# ==========================================================
+def _rewrite_sheet_data(sheet_data, shared_strings):
+    """
+    Drops formulas and re-indexes shared-string references.
+    Returns (new_sheet_data, [old_index, ...] in new index order).
+    """
+    sheet_data = FORMULA_RE.sub(b"", sheet_data)
+
+    remap = {}
+
+    def replace(match):
+        old = int(match.group(3))
+        if old >= len(shared_strings):
+            raise SheetExtractError(f"Shared string index {old} out of range")
+        new = remap.setdefault(old, len(remap))
+        return match.group(1) + str(new).encode() + match.group(4)
+
+    sheet_data = SHARED_STRING_CELL_RE.sub(replace, sheet_data)
+    return sheet_data, list(remap)
+
+
+def _rewrite_tail(tail, kept_rel_ids):
+    tail = DROPPED_TAIL_RE.sub(b"", tail)
+
+    def strip_dangling(match):
+        if match.group(1).decode() in kept_rel_ids:
+            return match.group(0)
+        return b""
+
+    return REL_ID_ATTR_RE.sub(strip_dangling, tail)
+
+
+def _build_shared_strings(sst_xml, items, used):
+    open_tag = SST_OPEN_RE.search(sst_xml)
+    prefix = open_tag.group(1)
+    root = SST_COUNT_ATTR_RE.sub(b"", open_tag.group(0))[:-1]
+    root += f' count="{len(used)}" uniqueCount="{len(used)}">'.encode()
+
+    return b"".join([
+        XML_DECLARATION,
+        root,
+        b"".join(items[i] for i in used),
+        b"</" + prefix + b"sst>",
+    ])
+
+
+def _escape_attr(value):
+    return (
+        value.replace("&", "&amp;").replace('"', "&quot;")
+        .replace("<", "&lt;").replace(">", "&gt;")
+    )
+
+
+def _workbook_pr(workbook_xml):
+    # Keep the date system (date1904) and similar workbook-wide flags
+    match = re.search(rb'<(?:\w+:)?workbookPr\b[^>]*/>', workbook_xml)
+    if not match:
+        return b""
+    return re.sub(rb'^<\w+:', b"<", match.group(0))
+
+
+# ==========================================================
+# EXTRACT
+# ==========================================================
+def extract_sheet_xlsx(path, sheet_name):
+    """
+    Builds a single-sheet .xlsx containing `sheet_name` from the workbook
+    at `path` and returns the bytes.
+
+    Raises KeyError if the sheet does not exist and SheetExtractError if
+    the file is not a package this extractor understands.
+    """
+    try:
+        package = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise SheetExtractError(str(e))
+
+    with package:
+        try:
+            workbook_part = _first_target(_read_rels(package, ""), REL_OFFICE_DOCUMENT)
+            if workbook_part is None:
+                raise SheetExtractError("No workbook part in package")
+
+            workbook_xml = package.read(workbook_part)
+            workbook_rels = _read_rels(package, workbook_part)
+        except KeyError as e:
+            raise SheetExtractError(str(e))
+
+        rel_id = None
+        for sheet in ElementTree.fromstring(workbook_xml).iter(f"{{{NS_MAIN}}}sheet"):
+            if sheet.get("name") == sheet_name:
+                rel_id = sheet.get(f"{{{NS_REL}}}id")
+                break
+        if rel_id is None:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+
+        sheet_part = next(
+            (target for id_, type_, target, _ in workbook_rels
+             if id_ == rel_id and type_ == REL_WORKSHEET),
+            None
+        )
+        if sheet_part is None:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+
+        styles_part = _first_target(workbook_rels, REL_STYLES)
+        theme_part = _first_target(workbook_rels, REL_THEME)
+        sst_part = _first_target(workbook_rels, REL_SHARED_STRINGS)
+
+        sheet_xml = package.read(sheet_part)
+
+        # External hyperlinks are the only sheet relationships carried over
+        sheet_rels = [
+            (id_, type_, target) for id_, type_, target, external
+            in _read_rels(package, sheet_part) if external
+        ]
+
+        # Split the sheet so only the <sheetData> section is rewritten
+        # cell-by-cell; the head (views, cols, formats) is copied verbatim
+        start = SHEET_DATA_START_RE.search(sheet_xml)
+        end = SHEET_DATA_END_RE.search(sheet_xml)
+        if start is None or end is None:
+            raise SheetExtractError("Worksheet has no sheetData")
+        head, sheet_data, tail = (
+            sheet_xml[:start.start()],
+            sheet_xml[start.start():end.end()],
+            sheet_xml[end.end():]
+        )
+
+        shared_strings = []
+        sst_xml = None
+        if sst_part is not None and sst_part in package.namelist():
+            sst_xml = package.read(sst_part)
+            shared_strings = [m.group(0) for m in SHARED_STRING_ITEM_RE.finditer(sst_xml)]
+
+        sheet_data, used_strings = _rewrite_sheet_data(sheet_data, shared_strings)
+        tail = _rewrite_tail(tail, {id_ for id_, _, _ in sheet_rels})
+
+        output = BytesIO()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as out:
+            overrides = [
+                ("/xl/workbook.xml", CT_WORKBOOK),
+                ("/xl/worksheets/sheet1.xml", CT_WORKSHEET),
+            ]
+            workbook_rel_entries = [
+                ("rId1", REL_WORKSHEET, "worksheets/sheet1.xml"),
+            ]
+
+            out.writestr("xl/worksheets/sheet1.xml", head + sheet_data + tail)
+
+            if sheet_rels:
+                out.writestr(
+                    "xl/worksheets/_rels/sheet1.xml.rels",
+                    _relationships_xml(sheet_rels, external=True)
+                )
+
+            if styles_part is not None:
+                out.writestr("xl/styles.xml", package.read(styles_part))
+                overrides.append(("/xl/styles.xml", CT_STYLES))
+                workbook_rel_entries.append(("rId2", REL_STYLES, "styles.xml"))
+
+            if theme_part is not None:
+                out.writestr("xl/theme/theme1.xml", package.read(theme_part))
+                overrides.append(("/xl/theme/theme1.xml", CT_THEME))
+                workbook_rel_entries.append(("rId3", REL_THEME, "theme/theme1.xml"))
+
+            if used_strings:
+                out.writestr(
+                    "xl/sharedStrings.xml",
+                    _build_shared_strings(sst_xml, shared_strings, used_strings)
+                )
+                overrides.append(("/xl/sharedStrings.xml", CT_SHARED_STRINGS))
+                workbook_rel_entries.append(
+                    ("rId4", REL_SHARED_STRINGS, "sharedStrings.xml")
+                )
+
+            out.writestr("xl/workbook.xml", b"".join([
+                XML_DECLARATION,
+                f'<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'.encode(),
+                _workbook_pr(workbook_xml),
+                b"<sheets>",
+                f'<sheet name="{_escape_attr(sheet_name)}" sheetId="1" r:id="rId1"/>'.encode(),
+                b"</sheets></workbook>",
+            ]))
+            out.writestr(
+                "xl/_rels/workbook.xml.rels",
+                _relationships_xml(workbook_rel_entries)
+            )
+            out.writestr(
+                "_rels/.rels",
+                _relationships_xml([("rId1", REL_OFFICE_DOCUMENT, "xl/workbook.xml")])
+            )
+            out.writestr("[Content_Types].xml", _content_types_xml(overrides))
+
+    return output.getvalue()
+
+
+def _relationships_xml(entries, external=False):
+    mode = ' TargetMode="External"' if external else ""
+    body = "".join(
+        f'<Relationship Id="{_escape_attr(id_)}" Type="{type_}" '
+        f'Target="{_escape_attr(target)}"{mode}/>'
+        for id_, type_, target in entries
+    )
+    return XML_DECLARATION + (
+        f'<Relationships xmlns="{NS_PKG_REL}">{body}</Relationships>'
+    ).encode()
+
+
+def _content_types_xml(overrides):
+    body = "".join(
+        f'<Override PartName="{part}" ContentType="{content_type}"/>'
+        for part, content_type in overrides
+    )
+    return XML_DECLARATION + (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" '
+        'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'{body}</Types>'
+    ).encode()
@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import EmailLog, ExcelFile, Member, SendJob
+from .stats import invalidate_dashboard_stats
+
+
+# ==========================================================
+# DASHBOARD CACHE INVALIDATION
+# ==========================================================
+# Bulk writes (bulk_create / update) do not send these signals; the code
+# paths that use them call invalidate_dashboard_stats() themselves.
+
+# model -> field holding the user whose dashboard the row counts towards
+DASHBOARD_OWNER_FIELDS = {
+    Member: "created_by_id",
+    ExcelFile: "uploaded_by_id",
+    EmailLog: "sent_by_id",
+    SendJob: "requested_by_id",
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_owner_dashboard(sender, instance, **kwargs):
+    field = DASHBOARD_OWNER_FIELDS.get(sender)
+    if field:
+        invalidate_dashboard_stats(getattr(instance, field))
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import EmailLog, ExcelFile, Member, SendJob
+
+
+# ==========================================================
+# DASHBOARD SUMMARY
+# ==========================================================
+def dashboard_cache_key(user_id):
+    return f"dashboard-stats:{user_id}"
+
+
+def compute_dashboard_stats(user_id):
+    """
+    Builds the dashboard summary for one user from the database:
+    - member and Excel file counts
+    - sent / failed deliveries over the last 24 hours and 7 days,
+      in a single aggregate over the user's recent EmailLog rows
+    - when the user's last send job finished
+    """
+    now = timezone.now()
+    day_ago = now - timedelta(days=1)
+
+    deliveries = EmailLog.objects.filter(
+        sent_by_id=user_id,
+        sent_at__gte=now - timedelta(days=7)
+    ).aggregate(
+        sent_7d=Count("id", filter=Q(status="success")),
+        failed_7d=Count("id", filter=Q(status="failed")),
+        sent_24h=Count("id", filter=Q(status="success", sent_at__gte=day_ago)),
+        failed_24h=Count("id", filter=Q(status="failed", sent_at__gte=day_ago)),
+    )
+
+    last_run = SendJob.objects.filter(
+        requested_by_id=user_id,
+        finished_at__isnull=False
+    ).aggregate(last_run=Max("finished_at"))["last_run"]
+
+    return {
+        "members_count": Member.objects.filter(created_by_id=user_id).count(),
+        "excel_count": ExcelFile.objects.filter(uploaded_by_id=user_id).count(),
+        "last_run": last_run,
+        **deliveries,
+    }
+
+
+def get_dashboard_stats(user):
+    """
+    Cached dashboard summary. Entries are dropped by
+    invalidate_dashboard_stats() whenever the underlying rows change, and
+    expire after DASHBOARD_STATS_TTL seconds so the 24h / 7d windows keep
+    moving even when nothing is written.
+    """
+    key = dashboard_cache_key(user.pk)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_dashboard_stats(user.pk)
+        cache.set(key, stats, settings.DASHBOARD_STATS_TTL)
+    return stats
+
+
+def invalidate_dashboard_stats(*user_ids):
+    keys = [dashboard_cache_key(user_id) for user_id in set(user_ids) if user_id]
+    if keys:
+        cache.delete_many(keys)
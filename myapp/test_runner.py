@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the suite against a throwaway PROMETHEUS_MULTIPROC_DIR, so test
+    runs (and the processes they spawn) never add samples to the
+    directory the live /metrics reads.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        self.metrics_dir = tempfile.mkdtemp(prefix="test_metrics_")
+        self.saved_multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = self.metrics_dir
+        self.metrics_override = override_settings(METRICS_DIR=self.metrics_dir)
+        self.metrics_override.enable()
+        super().setup_test_environment(**kwargs)
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        self.metrics_override.disable()
+        if self.saved_multiproc_dir is None:
+            os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        else:
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = self.saved_multiproc_dir
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
@@ -1,3 +1,2169 @@
-from django.test import TestCase
+import asyncio
+import csv
+import fcntl
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.mail.backends.smtp import EmailBackend
+from django.core.mail.utils import DNS_NAME
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode
+from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from prometheus_client.parser import text_string_to_metric_families
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Table
+
+from . import attachments, jobs
+from .attachments import AttachmentCache, render_excel, render_sheet_pdf, render_sheets
+from .benchmark import compare_results
+from .db import WRITE_LOCK_SUFFIX, serialized_writes
+from .jobs import (
+    JobHeartbeat, JobLostError, claim_next_job, enqueue_due_retries, enqueue_send_jobs, resume_jobs,
+)
+from .mailer import AsyncMailer, PooledMailer
+from .logwriter import EmailLogWriter, retry_delay
+from .member_import import MemberImportError, import_members
+from .profiling import SUMMARY_EXTENSION, list_profiles, profile_path, profiled
+from .sheet_extract import SheetExtractError, extract_sheet_xlsx
+from .stats import get_dashboard_stats
+from .models import Department, EmailLog, ExcelFile, Member, Profile, SendJob, SendTask
+from .ratelimit import RateLimiter, TokenBucket
+from .utils import INTERRUPTED_ERROR, _plan_tasks, members_for_excel_file, run_send_job
+from .workbooks import WorkbookReader, partition_rows, record_sheet_manifest, store_workbook_blob
+
+# ==========================================================
+# IN-PROCESS SMTP STAND-IN
+# ==========================================================
+class StandInSMTPServer:
+    """
+    Minimal SMTP server on 127.0.0.1 running on its own event loop thread.
+
+    - Accepts every recipient except addresses starting with "reject"
+    - Answers the first `throttle` RCPT commands with 451
+    - Records delivered messages and the peak number of open sessions
+    """
+
+    def __init__(self, data_delay=0.05, throttle=0):
+        self.data_delay = data_delay
+        self.throttle = throttle
+        self.messages = []
+        self.sessions = 0
+        self.peak_sessions = 0
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        server.close()
+        self._loop.close()
+
+    async def _handle(self, reader, writer):
+        self.sessions += 1
+        self.peak_sessions = max(self.peak_sessions, self.sessions)
+
+        def reply(line):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 stand-in ready")
+        recipients = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode().strip()
+                verb = command.split(" ", 1)[0].upper()
+
+                if verb in ("EHLO", "HELO"):
+                    reply("250 stand-in")
+                elif verb == "MAIL":
+                    recipients = []
+                    reply("250 OK")
+                elif verb == "RCPT":
+                    address = command.split(":", 1)[1].strip(" <>")
+                    if self.throttle > 0:
+                        self.throttle -= 1
+                        reply("451 Rate limit exceeded, try again later")
+                    elif address.startswith("reject"):
+                        reply("550 No such user")
+                    else:
+                        recipients.append(address)
+                        reply("250 OK")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    data = await reader.readuntil(b"\r\n.\r\n")
+                    await asyncio.sleep(self.data_delay)
+                    self.messages.append((recipients, data))
+                    reply("250 Queued")
+                elif verb == "RSET":
+                    recipients = []
+                    reply("250 OK")
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("502 Not implemented")
+                await writer.drain()
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+
+def _messages(*recipients):
+    return [
+        EmailMessage(subject="Sheet", body="Attached.", to=[recipient])
+        for recipient in recipients
+    ]
+
+
+# ==========================================================
+# ASYNC DELIVERY ENGINE
+# ==========================================================
+class AsyncMailerTests(SimpleTestCase):
+
+    def _mailer(self, server, **kwargs):
+        kwargs.setdefault("concurrency", 4)
+        kwargs.setdefault("limiter", RateLimiter(
+            per_minute=60000, burst=100, min_per_minute=600,
+            max_retries=3, backoff_base=0
+        ))
+        return AsyncMailer(
+            host="127.0.0.1", port=server.port, username="", password="",
+            use_tls=False, use_ssl=False, timeout=5, **kwargs
+        )
+
+    def test_delivers_every_message_over_concurrent_sessions(self):
+        with StandInSMTPServer() as server:
+            with self._mailer(server) as mailer:
+                outbox = _messages(*[f"member{i}@example.com" for i in range(20)])
+                results = list(mailer.send(outbox))
+
+        self.assertEqual([error for _, error in results], [None] * 20)
+        self.assertEqual(len(server.messages), 20)
+        self.assertGreater(server.peak_sessions, 1)
+        self.assertLessEqual(server.peak_sessions, 4)
+
+    def test_refused_recipient_is_reported_per_message(self):
+        with StandInSMTPServer() as server:
+            with self._mailer(server) as mailer:
+                outbox = _messages("a@example.com", "reject@example.com", "b@example.com")
+                results = dict(
+                    (message.to[0], error) for message, error in mailer.send(outbox)
+                )
+
+        self.assertIsNone(results["a@example.com"])
+        self.assertIsNone(results["b@example.com"])
+        self.assertIsNotNone(results["reject@example.com"])
+        self.assertEqual(len(server.messages), 2)
+
+    def test_sessions_are_reused_across_send_calls(self):
+        with StandInSMTPServer(data_delay=0) as server:
+            with self._mailer(server, concurrency=1) as mailer:
+                list(mailer.send(_messages("a@example.com")))
+                list(mailer.send(_messages("b@example.com")))
+                self.assertEqual(server.sessions, 1)
+
+        self.assertEqual(len(server.messages), 2)
+
+    def test_transient_reply_is_retried_and_slows_the_sender(self):
+        limiter = RateLimiter(
+            per_minute=60000, burst=100, min_per_minute=600,
+            max_retries=3, backoff_base=0
+        )
+        with StandInSMTPServer(data_delay=0, throttle=2) as server:
+            with self._mailer(server, concurrency=1, limiter=limiter) as mailer:
+                results = list(mailer.send(_messages("a@example.com")))
+
+        self.assertIsNone(results[0][1])
+        self.assertEqual(len(server.messages), 1)
+        bucket = limiter.bucket(mailer.relay)
+        self.assertLess(bucket.rate, bucket.max_rate)
+
+
+    def test_results_are_yielded_as_deliveries_finish(self):
+        with StandInSMTPServer(data_delay=0.05) as server:
+            with self._mailer(server, concurrency=1) as mailer:
+                outbox = _messages(*[f"member{i}@example.com" for i in range(5)])
+                results = mailer.send(outbox)
+                next(results)
+                # The rest of the batch is still queued behind the first
+                self.assertLess(len(server.messages), 5)
+                rest = list(results)
+
+        self.assertEqual(len(rest), 4)
+        self.assertEqual(len(server.messages), 5)
+
+
+# ==========================================================
+# POOLED DELIVERY ENGINE
+# ==========================================================
+class PooledMailerTests(TestCase):
+
+    def _limiter(self):
+        return RateLimiter(
+            per_minute=60000, burst=100, min_per_minute=600,
+            max_retries=1, backoff_base=0
+        )
+
+    def test_connection_is_opened_on_first_send_only(self):
+        connection = mock.Mock()
+        with PooledMailer(connection=connection, limiter=self._limiter()) as mailer:
+            connection.open.assert_not_called()
+            results = list(mailer.send(_messages("a@example.com", "b@example.com")))
+
+        self.assertEqual([error for _, error in results], [None, None])
+        connection.open.assert_called_once()
+
+    @override_settings(
+        EMAIL_DELIVERY_ENGINE="pooled",
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    def test_failed_connect_is_logged_per_recipient_for_retry(self):
+        head = User.objects.create_user("head")
+        excel = _stored_workbook(self, head, {"Sheet1": [["Name"], ["Row"]]})
+        _members(excel, "Sheet1", "a@example.com", "b@example.com")
+        job, = enqueue_send_jobs(ExcelFile.objects.filter(pk=excel.pk), "excel", head)
+
+        connection = mock.Mock()
+        connection.open.side_effect = OSError("Connection refused")
+        with mock.patch("myapp.mailer.get_connection", return_value=connection):
+            run_send_job(job)
+
+        logs = EmailLog.objects.filter(excel_file=excel)
+        self.assertEqual(logs.count(), 2)
+        for log in logs:
+            self.assertEqual((log.status, log.error_message), ("failed", "Connection refused"))
+            self.assertIsNotNone(log.next_attempt_at)
+        # The refused connect is not retried once per recipient
+        connection.open.assert_called_once()
+
+
+# ==========================================================
+# TOKEN BUCKET
+# ==========================================================
+class TokenBucketTests(SimpleTestCase):
+
+    def test_reserve_spaces_sends_at_the_current_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(max_rate=10, burst=2, min_rate=1, clock=lambda: now[0])
+
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+
+        now[0] += 1.0
+        self.assertEqual(bucket.reserve(), 0)
+
+    def test_throttle_halves_rate_and_success_recovers_it(self):
+        bucket = TokenBucket(max_rate=10, burst=1, min_rate=1)
+
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        for _ in range(5):
+            bucket.throttled()
+        self.assertEqual(bucket.rate, 1)
+
+        for _ in range(100):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 10)
+
+    def test_buckets_follow_the_relay_account_not_the_from_address(self):
+        limiter = RateLimiter(per_minute=60, burst=1, min_per_minute=1)
+
+        def pooled(host, username):
+            return PooledMailer(
+                connection=EmailBackend(host=host, port=587, username=username),
+                limiter=limiter
+            )
+
+        shared = pooled("smtp.example.com", "school")
+        self.assertEqual(shared.relay, pooled("smtp.example.com", "school").relay)
+        self.assertEqual(
+            shared.relay,
+            AsyncMailer(host="smtp.example.com", port=587, username="school").relay
+        )
+        self.assertNotEqual(shared.relay, pooled("smtp.example.com", "office").relay)
+        self.assertNotEqual(shared.relay, pooled("smtp.other.com", "school").relay)
+        self.assertIsNot(
+            limiter.bucket(shared.relay),
+            limiter.bucket(pooled("smtp.example.com", "office").relay)
+        )
+
+
+# ==========================================================
+# QUERY COUNTS
+# ==========================================================
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class ListQueryCountTests(TestCase):
+    """
+    Every list surface must cost a fixed number of queries per page,
+    however many rows (and related departments / users) it shows.
+    """
+
+    ROWS = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="pw")
+        senders = [User.objects.create_user(f"user{i}") for i in range(5)]
+        departments = [Department.objects.create(name=f"Dept {i}") for i in range(5)]
+        Profile.objects.bulk_create([
+            Profile(user=sender, department=departments[i])
+            for i, sender in enumerate(senders)
+        ])
+
+        Member.objects.bulk_create([
+            Member(
+                name=f"Member {i}",
+                email=f"member{i}@example.com",
+                sheet_name="Sheet1",
+                department=departments[i % 5],
+                created_by=cls.admin,
+            )
+            for i in range(cls.ROWS)
+        ])
+        files = ExcelFile.objects.bulk_create([
+            ExcelFile(
+                file=f"excel_files/book{i}.xlsx",
+                uploaded_by=senders[i % 5],
+                department=departments[i % 5],
+            )
+            for i in range(cls.ROWS)
+        ])
+        EmailLog.objects.bulk_create([
+            EmailLog(
+                sent_by=senders[i % 5],
+                recipient_email=f"member{i}@example.com",
+                sheet_name="Sheet1",
+                send_type="pdf",
+                status="success",
+                excel_file=files[i],
+            )
+            for i in range(cls.ROWS)
+        ])
+        SendJob.objects.bulk_create([
+            SendJob(excel_file=files[i], send_type="pdf", requested_by=senders[i % 5])
+            for i in range(cls.ROWS)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertPageQueries(self, num, url):
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_changelist(self):
+        self.assertPageQueries(6, reverse("admin:myapp_profile_changelist"))
+
+    def test_member_changelist(self):
+        self.assertPageQueries(6, reverse("admin:myapp_member_changelist"))
+
+    def test_excel_file_changelist(self):
+        self.assertPageQueries(6, reverse("admin:myapp_excelfile_changelist"))
+
+    def test_email_log_changelist(self):
+        self.assertPageQueries(4, reverse("admin:myapp_emaillog_changelist"))
+
+    def test_send_job_changelist(self):
+        self.assertPageQueries(5, reverse("admin:myapp_sendjob_changelist"))
+
+    def test_member_list_is_paginated(self):
+        self.assertPageQueries(4, reverse("member_list"))
+        response = self.client.get(reverse("member_list"), {"page": 2})
+        self.assertEqual(len(response.context["members"]), self.ROWS - 50)
+
+
+class MemberLookupTests(TestCase):
+
+    def test_members_for_all_sheets_in_one_query(self):
+        head = User.objects.create_user("head")
+        other_head = User.objects.create_user("other")
+        science = Department.objects.create(name="Science")
+        maths = Department.objects.create(name="Maths")
+        excel = ExcelFile.objects.create(file="book.xlsx", uploaded_by=head, department=science)
+
+        def member(email, sheet_name, department=science, created_by=head):
+            Member.objects.create(
+                name=email, email=email, sheet_name=sheet_name,
+                department=department, created_by=created_by
+            )
+
+        member("a@example.com", "Sheet1")
+        member("b@example.com", "Sheet1")
+        member("c@example.com", "Sheet2")
+        member("d@example.com", "Sheet3")
+        member("archive@example.com", "Archive")
+        member("maths@example.com", "Sheet1", department=maths)
+        member("other@example.com", "Sheet2", created_by=other_head)
+
+        with self.assertNumQueries(1):
+            members = members_for_excel_file(excel, ["Sheet1", "Sheet2", "Sheet3", "Empty"])
+
+        self.assertEqual({sheet: sorted(emails) for sheet, emails in members.items()}, {
+            "Sheet1": ["a@example.com", "b@example.com"],
+            "Sheet2": ["c@example.com"],
+            "Sheet3": ["d@example.com"],
+        })
+
+
+# ==========================================================
+# EMAIL LOG PAGE AND EXPORT
+# ==========================================================
+def _log_at(sender, recipient, when, **fields):
+    """
+    EmailLog with a fixed sent_at (auto_now_add ignores the field on create).
+    """
+    fields = {"sheet_name": "Sheet1", "send_type": "pdf", "status": "success", **fields}
+    log = EmailLog.objects.create(sent_by=sender, recipient_email=recipient, **fields)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    EmailLog.objects.filter(pk=log.pk).update(sent_at=when)
+    log.refresh_from_db()
+    return log
+
+
+class EmailLogExportTests(TestCase):
+
+    def setUp(self):
+        self.head = User.objects.create_user("head")
+        other = User.objects.create_user("other")
+        _log_at(self.head, "a@example.com", datetime(2026, 3, 1, 12))
+        _log_at(self.head, "b@example.com", datetime(2026, 3, 2, 12),
+                status="failed", error_message='Refused, "550"')
+        _log_at(self.head, "c@example.com", datetime(2026, 3, 3, 12),
+                send_type="excel", sheet_name="Sheet2")
+        _log_at(other, "x@example.com", datetime(2026, 3, 2, 12))
+        self.client.force_login(self.head)
+
+    def _export(self, **params):
+        response = self.client.get(reverse("export_email_logs"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        content = b"".join(response.streaming_content).decode()
+        return list(csv.reader(content.splitlines()))
+
+    def test_streams_own_logs_newest_first(self):
+        rows = self._export()
+
+        self.assertEqual(rows[0], [
+            "Recipient Email", "Sheet Name", "Send Type", "Status", "Error Message", "Sent At"
+        ])
+        self.assertEqual([row[0] for row in rows[1:]], [
+            "c@example.com", "b@example.com", "a@example.com"
+        ])
+        # Quoting survives the round trip
+        self.assertEqual(rows[2][4], 'Refused, "550"')
+
+    def test_filters_match_the_log_page(self):
+        def recipients(**params):
+            return [row[0] for row in self._export(**params)[1:]]
+
+        self.assertEqual(recipients(status="failed"), ["b@example.com"])
+        self.assertEqual(recipients(send_type="excel"), ["c@example.com"])
+        self.assertEqual(recipients(sheet="Sheet1"), ["b@example.com", "a@example.com"])
+        self.assertEqual(
+            recipients(date_from="2026-03-02", date_to="2026-03-02"), ["b@example.com"]
+        )
+        # Unknown values are ignored rather than matching nothing
+        self.assertEqual(len(recipients(status="bogus", date_from="not-a-date")), 3)
+
+    def test_header_is_sent_before_the_query_runs(self):
+        response = self.client.get(reverse("export_email_logs"))
+        content = iter(response.streaming_content)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(next(content).startswith(b"Recipient Email,"))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(content)), 3)
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class EmailLogPaginationTests(TestCase):
+
+    def setUp(self):
+        self.head = User.objects.create_user("head")
+        # Three entries share one timestamp, so only the id breaks the tie
+        times = [
+            datetime(2026, 3, 1, 12), datetime(2026, 3, 2, 12), datetime(2026, 3, 2, 12),
+            datetime(2026, 3, 2, 12), datetime(2026, 3, 3, 12),
+        ]
+        logs = [
+            _log_at(self.head, f"r{i}@example.com", when) for i, when in enumerate(times)
+        ]
+        self.newest_first = [
+            log.pk for log in sorted(logs, key=lambda log: (log.sent_at, log.pk), reverse=True)
+        ]
+        _log_at(User.objects.create_user("other"), "x@example.com", times[2])
+        self.client.force_login(self.head)
+
+        page_size = mock.patch("myapp.views.EMAIL_LOGS_PAGE_SIZE", 2)
+        page_size.start()
+        self.addCleanup(page_size.stop)
+
+    def _page(self, **params):
+        response = self.client.get(reverse("email_logs"), params)
+        self.assertEqual(response.status_code, 200)
+        context = response.context
+        return [log.pk for log in context["logs"]], context["older_cursor"], context["newer_cursor"]
+
+    def test_walking_older_then_newer_visits_every_entry_once(self):
+        pages = []
+        page, older, newer = self._page()
+        self.assertIsNone(newer)
+        pages.append(page)
+        while older:
+            page, older, newer = self._page(after=older)
+            self.assertIsNotNone(newer)
+            pages.append(page)
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), self.newest_first)
+
+        # And back again from the last page
+        back = [pages[-1]]
+        while newer:
+            page, older, newer = self._page(before=newer)
+            self.assertIsNotNone(older)
+            back.append(page)
+        self.assertEqual(back[::-1], pages)
+
+    def test_filters_are_kept_in_the_links(self):
+        response = self.client.get(reverse("email_logs"), {"status": "success"})
+        self.assertEqual(response.context["filters"], "status=success")
+
+        cursor = response.context["older_cursor"]
+        response = self.client.get(reverse("email_logs"), {"status": "success", "after": cursor})
+        self.assertEqual(response.context["filters"], "status=success")
+
+    def test_bad_cursors_fall_back_to_the_first_page(self):
+        first_page, _, _ = self._page()
+        for cursor in (
+            "not base64!",
+            urlsafe_base64_encode(b"yesterday|1"),
+            urlsafe_base64_encode(b"2026-03-02T12:00:00+00:00|abc"),
+            urlsafe_base64_encode(b"\xff\xfe"),
+        ):
+            self.assertEqual(self._page(after=cursor)[0], first_page, cursor)
+            self.assertEqual(self._page(before=cursor)[0], first_page, cursor)
+
+
+# ==========================================================
+# BULK MEMBER IMPORT
+# ==========================================================
+def _roster(text, name="roster.csv"):
+    return SimpleUploadedFile(name, text.encode("utf-8"))
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class MemberImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.head = User.objects.create_user("head", password="pw")
+        cls.department = Department.objects.create(name="Science")
+        Profile.objects.create(user=cls.head, role="head", department=cls.department)
+        Member.objects.create(
+            name="Existing", email="existing@example.com", sheet_name="Sheet1",
+            department=cls.department, created_by=cls.head
+        )
+
+    def _import(self, text, name="roster.csv", **kwargs):
+        roster = _roster(text, name)
+        return import_members(roster, roster.name, self.department, self.head, **kwargs)
+
+    def test_rows_are_validated_and_deduplicated(self):
+        report = self._import(
+            "Name,Email,Sheet\n"
+            "Ada,ada@example.com,Sheet1\n"
+            "Existing Again,EXISTING@example.com,Sheet1\n"
+            "Bad,not-an-email,Sheet1\n"
+            "Ada Twice,ada@example.com,Sheet2\n"
+            ",,\n"
+            "No Sheet,nosheet@example.com,\n"
+            "Grace,grace@example.com,Sheet2\n"
+        )
+
+        self.assertEqual(report.created, 2)
+        self.assertEqual([row for row, _ in report.errors], [3, 4, 5, 7])
+        self.assertIn("already exists", report.errors[0][1])
+        self.assertIn("Duplicate of row 2", report.errors[2][1])
+        self.assertEqual(
+            set(Member.objects.values_list("email", flat=True)),
+            {"existing@example.com", "ada@example.com", "grace@example.com"}
+        )
+
+    def test_existing_members_are_loaded_in_one_query(self):
+        text = "name,email,sheet_name\n" + "".join(
+            f"Member {i},member{i}@example.com,Sheet1\n" for i in range(250)
+        )
+        # savepoint + existing emails + 3 batches + release savepoint
+        with self.assertNumQueries(6):
+            report = self._import(text, batch_size=100)
+        self.assertEqual(report.created, 250)
+
+    def test_member_added_during_the_import_rejects_the_file(self):
+        def rows(fileobj, filename):
+            yield ["name", "email", "sheet_name"]
+            # Another import commits the same member meanwhile
+            Member.objects.create(
+                name="Late", email="late@example.com", sheet_name="Sheet1",
+                department=self.department, created_by=self.head
+            )
+            yield ["Ada", "ada@example.com", "Sheet1"]
+            yield ["Late", "late@example.com", "Sheet1"]
+
+        with mock.patch("myapp.member_import.iter_roster_rows", rows), \
+                self.assertRaises(MemberImportError):
+            self._import("")
+        self.assertFalse(Member.objects.filter(email="ada@example.com").exists())
+
+    def test_xlsx_roster(self):
+        wb = Workbook()
+        wb.active.append(["name", "email", "sheet_name"])
+        wb.active.append(["Ada", "ada@example.com", "Sheet1"])
+        buffer = BytesIO()
+        wb.save(buffer)
+
+        roster = SimpleUploadedFile("roster.xlsx", buffer.getvalue())
+        report = import_members(roster, roster.name, self.department, self.head)
+        self.assertEqual(report.created, 1)
+
+    def test_missing_columns_reject_the_file(self):
+        with self.assertRaises(MemberImportError):
+            self._import("name,email\nAda,ada@example.com\n")
+        with self.assertRaises(MemberImportError):
+            self._import("name,email,sheet_name\n", name="roster.txt")
+
+    def test_import_view_reports_row_errors(self):
+        self.client.force_login(self.head)
+        response = self.client.post(reverse("member_import"), {
+            "roster": _roster("name,email,sheet_name\nAda,ada@example.com,S1\nBad,bad,S1\n")
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["report"].created, 1)
+        self.assertContains(response, "Invalid email address: bad")
+
+    def test_admin_import_view(self):
+        admin = User.objects.create_superuser("admin", password="pw")
+        self.client.force_login(admin)
+        response = self.client.post(reverse("admin:myapp_member_import"), {
+            "department": self.department.pk,
+            "owner": self.head.pk,
+            "roster": _roster("name,email,sheet_name\nAda,ada@example.com,S1\n"),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        # Owned by the chosen head, so they see the members, not the admin
+        self.assertTrue(
+            Member.objects.filter(email="ada@example.com", created_by=self.head).exists()
+        )
+
+    def test_admin_import_owner_must_head_the_department(self):
+        admin = User.objects.create_superuser("admin", password="pw")
+        other = Department.objects.create(name="Maths")
+        self.client.force_login(admin)
+        response = self.client.post(reverse("admin:myapp_member_import"), {
+            "department": other.pk,
+            "owner": self.head.pk,
+            "roster": _roster("name,email,sheet_name\nAda,ada@example.com,S1\n"),
+        })
+
+        self.assertContains(response, "head is not a head of Maths")
+        self.assertFalse(Member.objects.filter(email="ada@example.com").exists())
+
+
+# ==========================================================
+# DASHBOARD STATS CACHE
+# ==========================================================
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class DashboardStatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.head = User.objects.create_user("head", password="pw")
+        cls.department = Department.objects.create(name="Science")
+        cls.excel = ExcelFile.objects.create(
+            file="excel_files/Book1.xlsx", uploaded_by=cls.head, department=cls.department
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _stats(self):
+        return get_dashboard_stats(self.head)
+
+    def test_dashboard_is_served_from_cache(self):
+        self.client.force_login(self.head)
+        self.client.get(reverse("dashboard"))
+
+        # Session and user only; the summary itself costs nothing
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("dashboard"))
+        self.assertEqual(response.context["excel_count"], 1)
+
+    def test_saving_and_deleting_members_invalidates(self):
+        self.assertEqual(self._stats()["members_count"], 0)
+
+        member = Member.objects.create(
+            name="Ada", email="ada@example.com", sheet_name="Sheet1",
+            department=self.department, created_by=self.head
+        )
+        self.assertEqual(self._stats()["members_count"], 1)
+
+        member.delete()
+        self.assertEqual(self._stats()["members_count"], 0)
+
+    def test_bulk_log_writes_invalidate(self):
+        self.assertEqual(self._stats()["sent_24h"], 0)
+
+        job = SendJob.objects.create(
+            excel_file=self.excel, send_type="pdf", requested_by=self.head
+        )
+        tasks = SendTask.objects.bulk_create([
+            SendTask(job=job, recipient_email=f"m{i}@example.com", sheet_name="Sheet1")
+            for i in range(3)
+        ])
+        with EmailLogWriter() as writer:
+            writer.log(job, tasks[0])
+            writer.log(job, tasks[1])
+            writer.log(job, tasks[2], error="550 No such user")
+
+        stats = self._stats()
+        self.assertEqual((stats["sent_24h"], stats["failed_24h"]), (2, 1))
+        self.assertEqual((stats["sent_7d"], stats["failed_7d"]), (2, 1))
+
+
+# ==========================================================
+# CONTENT-ADDRESSED UPLOADS
+# ==========================================================
+class DedupedUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.head = User.objects.create_user("head", password="pw")
+        cls.department = Department.objects.create(name="Science")
+        Profile.objects.create(user=cls.head, role="head", department=cls.department)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.head)
+
+    def _workbook(self, content):
+        wb = Workbook()
+        wb.active.title = "Sheet1"
+        wb.active.append([content])
+        wb.create_sheet("Sheet2")
+        buffer = BytesIO()
+        wb.save(buffer)
+        return buffer.getvalue()
+
+    def _post(self, data, name="Report.xlsx"):
+        return self.client.post(reverse("excel_upload"), {
+            "excel_file": SimpleUploadedFile(name, data)
+        })
+
+    def test_identical_uploads_share_blob_and_manifest(self):
+        data = self._workbook("weekly")
+        self._post(data)
+        with mock.patch("myapp.workbooks.read_sheet_manifest") as parse:
+            self._post(data, name="Report (1).xlsx")
+        parse.assert_not_called()
+
+        first, second = ExcelFile.objects.order_by("pk")
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(
+            list(second.sheets.values_list("name", flat=True)), ["Sheet1", "Sheet2"]
+        )
+
+        blobs = [
+            name for _, _, files in os.walk(self.media_root) for name in files
+        ]
+        self.assertEqual(blobs, [f"{first.content_hash}.xlsx"])
+
+    def test_different_content_gets_its_own_blob(self):
+        self._post(self._workbook("week 1"))
+        self._post(self._workbook("week 2"))
+
+        first, second = ExcelFile.objects.order_by("pk")
+        self.assertNotEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.content_hash, second.content_hash)
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_upload_name_is_kept_for_display(self):
+        data = self._workbook("weekly")
+        self._post(data)
+        self._post(data, name="Report (1).xlsx")
+
+        first, second = ExcelFile.objects.order_by("pk")
+        self.assertEqual(first.original_name, "Report.xlsx")
+        self.assertEqual(second.original_name, "Report (1).xlsx")
+
+        for url in ("excel_upload", "excel_send"):
+            page = self.client.get(reverse(url)).content.decode()
+            self.assertIn("Report (1).xlsx", page)
+            self.assertNotIn(first.content_hash, page)
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_unreadable_workbook_is_logged_and_not_parsed_again(self):
+        with self.assertLogs("myapp.workbooks", "ERROR"):
+            response = self._post(b"not a workbook", name="Broken.xlsx")
+        excel = ExcelFile.objects.get()
+        self.assertTrue(excel.manifest_error)
+        self.assertEqual(excel.content_hash, "")
+        notice, = get_messages(response.wsgi_request)
+        self.assertIn("could not be read", str(notice))
+
+        with mock.patch("myapp.workbooks.read_sheet_manifest") as parse:
+            page = self.client.get(reverse("excel_send"))
+            self.client.get(reverse("excel_send"))
+        parse.assert_not_called()
+        self.assertContains(page, "could not be read")
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_legacy_files_are_parsed_once_and_listed_in_sheet_order(self):
+        excel = ExcelFile(uploaded_by=self.head, department=self.department)
+        excel.file.save("legacy.xlsx", ContentFile(self._workbook("old")), save=False)
+        excel.save()
+
+        response = self.client.get(reverse("excel_send"))
+        item, = response.context["excel_with_sheets"]
+        self.assertEqual([sheet.name for sheet in item["sheets"]], ["Sheet1", "Sheet2"])
+
+        with mock.patch("myapp.workbooks.read_sheet_manifest") as parse:
+            response = self.client.get(reverse("excel_send"))
+        parse.assert_not_called()
+        item, = response.context["excel_with_sheets"]
+        self.assertEqual([sheet.name for sheet in item["sheets"]], ["Sheet1", "Sheet2"])
+
+    def test_cache_key_depends_on_content_only(self):
+        key = AttachmentCache.make_key("Sheet1", "pdf", "abc")
+        self.assertEqual(key, AttachmentCache.make_key("Sheet1", "pdf", "abc"))
+        self.assertNotEqual(key, AttachmentCache.make_key("Sheet1", "pdf", "abd"))
+
+
+# ==========================================================
+# SHEET PREVIEW
+# ==========================================================
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class ExcelPreviewTests(TestCase):
+
+    def setUp(self):
+        self.head = User.objects.create_user("head")
+        self.excel = _stored_workbook(self, self.head, {
+            "Sheet1": [["Name"]] + [[f"Member {i:02d}"] for i in range(1, 30)],
+        })
+        self.client.force_login(self.head)
+
+    def _preview(self, sheet_name):
+        return self.client.get(reverse("excel_preview", args=[self.excel.pk, sheet_name]))
+
+    def test_only_the_first_ten_rows_are_read_and_rendered(self):
+        read_only_iter_rows = ReadOnlyWorksheet.iter_rows
+        pulled = []
+
+        def iter_rows(ws, *args, **kwargs):
+            for row in read_only_iter_rows(ws, *args, **kwargs):
+                pulled.append(row)
+                yield row
+
+        with mock.patch.object(ReadOnlyWorksheet, "iter_rows", iter_rows):
+            response = self._preview("Sheet1")
+
+        self.assertEqual(len(pulled), 10)
+        self.assertEqual(len(response.context["preview_data"]), 10)
+        self.assertContains(response, "Member 09")
+        self.assertNotContains(response, "Member 10")
+
+    def test_unknown_sheet_or_file_is_not_found(self):
+        self.assertEqual(self._preview("Missing").status_code, 404)
+
+        self.client.force_login(User.objects.create_user("other"))
+        self.assertEqual(self._preview("Sheet1").status_code, 404)
+
+
+# ==========================================================
+# ATTACHMENT CACHE
+# ==========================================================
+class AttachmentCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = AttachmentCache(self.directory, max_bytes=30)
+
+    def _age(self, key, seconds_ago):
+        past = time.time() - seconds_ago
+        os.utime(os.path.join(self.directory, f"{key}.bin"), (past, past))
+
+    def test_miss_then_hit(self):
+        rendered = []
+
+        def render():
+            rendered.append(1)
+            return b"pdf bytes"
+
+        self.assertIsNone(self.cache.get("k"))
+        self.assertEqual(self.cache.get_or_render("k", render), b"pdf bytes")
+        self.assertEqual(self.cache.get_or_render("k", render), b"pdf bytes")
+        self.assertEqual(len(rendered), 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for key, age in (("a", 300), ("b", 200), ("c", 100)):
+            self.cache.set(key, b"x" * 10)
+            self._age(key, age)
+
+        # Reading "a" makes it the most recently used entry
+        self.assertIsNotNone(self.cache.get("a"))
+        self.cache.set("d", b"x" * 10)
+
+        self.assertIsNone(self.cache.get("b"))
+        for key in ("a", "c", "d"):
+            self.assertIsNotNone(self.cache.get(key), key)
+
+    def test_oversized_entries_are_not_stored(self):
+        self.cache.set("big", b"x" * 31)
+        self.assertIsNone(self.cache.get("big"))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_key_changes_with_render_version(self):
+        key = self.cache.make_key("Sheet1", "pdf", "abc")
+        self.assertNotEqual(key, self.cache.make_key("Sheet1", "excel", "abc"))
+        self.assertNotEqual(key, self.cache.make_key("Sheet2", "pdf", "abc"))
+        with mock.patch.object(attachments, "RENDER_VERSION", attachments.RENDER_VERSION + 1):
+            self.assertNotEqual(key, self.cache.make_key("Sheet1", "pdf", "abc"))
+
+
+# ==========================================================
+# CHUNKED PDF RENDERING
+# ==========================================================
+class ChunkedPdfTests(SimpleTestCase):
+
+    def _rows(self, count, columns=4):
+        yield [f"Column {c}" for c in range(columns)]
+        for i in range(count):
+            yield [i] + [f"value {i}.{c}" for c in range(1, columns)]
+
+    def test_rows_are_pulled_lazily_in_chunks(self):
+        pulled = []
+
+        def rows():
+            for row in self._rows(1000):
+                pulled.append(row)
+                yield row
+
+        # Rows read from the source by the time each chunk table is built
+        pulled_at_table = []
+
+        def table(data, **kwargs):
+            pulled_at_table.append(len(pulled))
+            return Table(data, **kwargs)
+
+        with mock.patch.object(attachments, "Table", side_effect=table):
+            pdf = render_sheet_pdf(rows(), chunk_rows=100)
+
+        self.assertTrue(pdf.startswith(b"%PDF"))
+        self.assertEqual(pulled_at_table[:3], [101, 201, 301])
+        self.assertEqual(len(pulled_at_table), 10)
+        self.assertGreater(pdf.count(b"/Type /Page\n"), 10)
+
+    def test_wide_sheets_switch_to_landscape(self):
+        narrow = render_sheet_pdf(self._rows(5, columns=3))
+        wide = render_sheet_pdf(self._rows(5, columns=12))
+
+        self.assertIn(b"/MediaBox [ 0 0 612 792 ]", narrow)
+        self.assertIn(b"/MediaBox [ 0 0 792 612 ]", wide)
+
+    def test_empty_and_header_only_sheets(self):
+        self.assertTrue(render_sheet_pdf([]).startswith(b"%PDF"))
+        self.assertTrue(render_sheet_pdf([("Name", "Email")]).startswith(b"%PDF"))
+
+    def _tables(self, rows, **kwargs):
+        """
+        Renders `rows` and returns the data of every chunk table built.
+        """
+        tables = []
+
+        def table(data, **table_kwargs):
+            tables.append(data)
+            return Table(data, **table_kwargs)
+
+        with mock.patch.object(attachments, "Table", side_effect=table):
+            pdf = render_sheet_pdf(rows, **kwargs)
+        self.assertTrue(pdf.startswith(b"%PDF"))
+        return tables
+
+    def test_rows_wider_than_the_first_chunk_keep_their_columns(self):
+        rows = [("Name",), ("Ada",), ("Grace", "grace@example.com", "Sheet2")]
+
+        def last_row(tables):
+            # Cells sized from the first chunk may have been wrapped
+            return [cell.replace("\n", "") for cell in tables[-1][-1]]
+
+        # Streamed rows: the sheet's column count is passed in
+        tables = self._tables(iter(rows), chunk_rows=1, columns=3)
+        self.assertEqual(last_row(tables), ["Grace", "grace@example.com", "Sheet2"])
+        self.assertEqual({len(row) for data in tables for row in data}, {3})
+
+        # Rows in memory (personalised attachments) are measured up front
+        tables = self._tables(rows, chunk_rows=1)
+        self.assertEqual(last_row(tables), ["Grace", "grace@example.com", "Sheet2"])
+
+    def test_text_wider_than_its_column_wraps_inside_it(self):
+        notes = "word " * 5000 + "x" * 500
+        tables = self._tables([("Name", "Notes"), ("Ada", notes)])
+
+        header, row = tables[0]
+        self.assertEqual(header, ["Name", "Notes"])
+        self.assertEqual(row[0], "Ada")
+        self.assertEqual("".join(row[1].split()), "".join(notes.split()))
+        inner = attachments.PDF_MAX_COLUMN_WIDTH - attachments.PDF_CELL_PADDING * 2
+        for line in row[1].split("\n"):
+            self.assertLessEqual(
+                stringWidth(line, attachments.PDF_FONT, attachments.PDF_FONT_SIZE), inner
+            )
+
+
+class RenderSheetsTests(TestCase):
+
+    def setUp(self):
+        head = User.objects.create_user("head")
+        self.excel = _stored_workbook(self, head, {
+            "Sheet1": [["Name"], ["Ada"]],
+            "Sheet2": [["Name"], ["Grace"]],
+            "Sheet3": [["Name"], ["Alan"]],
+        })
+        self.cache = AttachmentCache()
+
+    def _render(self, sheet_names, send_type, processes):
+        with WorkbookReader(self.excel.file.path) as reader:
+            return list(render_sheets(
+                reader, sheet_names, send_type, self.excel.content_hash,
+                cache=self.cache, processes=processes
+            ))
+
+    def test_pool_yields_cache_hits_first_and_reports_errors_per_sheet(self):
+        warm = self.cache.make_key("Sheet3", "pdf", self.excel.content_hash)
+        self.cache.set(warm, b"%PDF cached")
+
+        results = self._render(["Sheet1", "Missing", "Sheet2", "Sheet3"], "pdf", processes=2)
+
+        self.assertEqual(results[0], ("Sheet3", b"%PDF cached", None))
+        by_sheet = {name: (content, error) for name, content, error in results}
+        self.assertEqual(sorted(by_sheet), ["Missing", "Sheet1", "Sheet2", "Sheet3"])
+
+        content, error = by_sheet["Missing"]
+        self.assertIsNone(content)
+        self.assertIsInstance(error, KeyError)
+        for name in ("Sheet1", "Sheet2"):
+            content, error = by_sheet[name]
+            self.assertIsNone(error)
+            self.assertTrue(content.startswith(b"%PDF"))
+            # Rendered in a worker, cached by the parent
+            key = self.cache.make_key(name, "pdf", self.excel.content_hash)
+            self.assertEqual(self.cache.get(key), content)
+
+    def test_pool_workers_do_not_inherit_the_write_lock(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir, ignore_errors=True)
+        db_path = os.path.join(lock_dir, "db.sqlite3")
+        lock_path = db_path + WRITE_LOCK_SUFFIX
+
+        with mock.patch.object(connection, "is_in_memory_db", return_value=False), \
+                mock.patch.dict(connection.settings_dict, NAME=db_path), \
+                WorkbookReader(self.excel.file.path) as reader:
+            results = render_sheets(
+                reader, ["Sheet1", "Sheet2"], "pdf", self.excel.content_hash,
+                cache=self.cache, processes=2
+            )
+            # e.g. the heartbeat thread is writing while the pool starts
+            with serialized_writes():
+                first = next(results)
+
+            # The pool is still up; its workers must not hold the lock
+            fd = os.open(lock_path, os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            finally:
+                os.close(fd)
+            rest = list(results)
+
+        self.assertEqual(sorted(name for name, _, _ in [first] + rest), ["Sheet1", "Sheet2"])
+
+    def test_inline_rendering_keeps_input_order(self):
+        results = self._render(["Sheet2", "Missing", "Sheet1"], "excel", processes=1)
+
+        self.assertEqual([name for name, _, _ in results], ["Sheet2", "Missing", "Sheet1"])
+        self.assertIsInstance(results[1][2], KeyError)
+        self.assertIsNone(results[0][2])
+        self.assertIsNone(results[2][2])
+
+
+# ==========================================================
+# SINGLE-SHEET EXTRACTION
+# ==========================================================
+def _workbook_package(path):
+    """
+    Writes a hand-built two-sheet .xlsx, so the exact XML the extractor
+    sees (shared strings, cached formula values, merges) is known.
+    """
+    main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    rel = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    pkg = "http://schemas.openxmlformats.org/package/2006/relationships"
+    ct = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+    parts = {
+        "[Content_Types].xml": (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" '
+            'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{ct}.sheet.main+xml"/>'
+            f'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{ct}.worksheet+xml"/>'
+            f'<Override PartName="/xl/worksheets/sheet2.xml" ContentType="{ct}.worksheet+xml"/>'
+            f'<Override PartName="/xl/styles.xml" ContentType="{ct}.styles+xml"/>'
+            f'<Override PartName="/xl/sharedStrings.xml" ContentType="{ct}.sharedStrings+xml"/>'
+            '</Types>'
+        ),
+        "_rels/.rels": (
+            f'<Relationships xmlns="{pkg}">'
+            f'<Relationship Id="rId1" Type="{rel}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ),
+        "xl/workbook.xml": (
+            f'<workbook xmlns="{main}" xmlns:r="{rel}"><sheets>'
+            '<sheet name="Staff" sheetId="1" r:id="rId1"/>'
+            '<sheet name="R&amp;D" sheetId="2" r:id="rId2"/>'
+            '</sheets></workbook>'
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            f'<Relationships xmlns="{pkg}">'
+            f'<Relationship Id="rId1" Type="{rel}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{rel}/worksheet" Target="worksheets/sheet2.xml"/>'
+            f'<Relationship Id="rId3" Type="{rel}/styles" Target="styles.xml"/>'
+            f'<Relationship Id="rId4" Type="{rel}/sharedStrings" Target="sharedStrings.xml"/>'
+            '</Relationships>'
+        ),
+        "xl/styles.xml": (
+            f'<styleSheet xmlns="{main}">'
+            '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+            '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+            '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            '</styleSheet>'
+        ),
+        # "Secret" is only used by the Staff sheet
+        "xl/sharedStrings.xml": (
+            f'<sst xmlns="{main}" count="4" uniqueCount="4">'
+            '<si><t>Secret</t></si>'
+            '<si><t>Project</t></si>'
+            '<si><t>Budget</t></si>'
+            '<si><t>Tom &amp; Jerry &lt;3&gt;</t></si>'
+            '</sst>'
+        ),
+        "xl/worksheets/sheet1.xml": (
+            f'<worksheet xmlns="{main}"><sheetData>'
+            '<row r="1"><c r="A1" t="s"><v>0</v></c></row>'
+            '</sheetData></worksheet>'
+        ),
+        "xl/worksheets/sheet2.xml": (
+            f'<worksheet xmlns="{main}">'
+            '<cols><col min="1" max="1" width="30" customWidth="1"/></cols>'
+            '<sheetData>'
+            '<row r="1"><c r="A1" s="1" t="s"><v>1</v></c><c r="B1" s="1" t="s"><v>2</v></c></row>'
+            '<row r="2"><c r="A2" t="s"><v>3</v></c><c r="B2"><v>40</v></c></row>'
+            '<row r="3"><c r="B3"><f>B2*2</f><v>80</v></c></row>'
+            '</sheetData>'
+            '<mergeCells count="1"><mergeCell ref="A2:A3"/></mergeCells>'
+            '</worksheet>'
+        ),
+    }
+    with zipfile.ZipFile(path, "w") as package:
+        for name, xml in parts.items():
+            package.writestr(name, xml)
+
+
+class SheetExtractTests(SimpleTestCase):
+
+    def setUp(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.path = os.path.join(workdir, "book.xlsx")
+        _workbook_package(self.path)
+
+    def _extract(self, sheet_name):
+        content = extract_sheet_xlsx(self.path, sheet_name)
+        return content, zipfile.ZipFile(BytesIO(content))
+
+    def test_round_trip_keeps_values_and_formatting(self):
+        content, _ = self._extract("R&D")
+        wb = load_workbook(BytesIO(content))
+        ws = wb.active
+
+        self.assertEqual(wb.sheetnames, ["R&D"])
+        # Formula replaced by its cached value, escaped text decoded intact
+        self.assertEqual(
+            list(ws.iter_rows(values_only=True)),
+            [("Project", "Budget"), ("Tom & Jerry <3>", 40), (None, 80)]
+        )
+        self.assertTrue(ws["A1"].font.b)
+        self.assertFalse(ws["A2"].font.b)
+        self.assertEqual([str(r) for r in ws.merged_cells.ranges], ["A2:A3"])
+        self.assertEqual(ws.column_dimensions["A"].width, 30)
+
+    def test_shared_strings_are_pruned_and_reindexed(self):
+        _, package = self._extract("R&D")
+
+        strings = package.read("xl/sharedStrings.xml")
+        sheet = package.read("xl/worksheets/sheet1.xml")
+
+        self.assertNotIn(b"Secret", strings)
+        self.assertIn(b'count="3" uniqueCount="3"', strings)
+        self.assertIn(b"Tom &amp; Jerry &lt;3&gt;", strings)
+        self.assertIn(b'<c r="A2" t="s"><v>2</v></c>', sheet)
+        self.assertNotIn(b"<f>", sheet)
+
+    def test_missing_sheet_or_package(self):
+        with self.assertRaises(KeyError):
+            extract_sheet_xlsx(self.path, "Nope")
+
+        not_a_zip = os.path.join(os.path.dirname(self.path), "legacy.xls")
+        with open(not_a_zip, "wb") as f:
+            f.write(b"\xd0\xcf\x11\xe0 not a zip")
+        with self.assertRaises(SheetExtractError):
+            extract_sheet_xlsx(not_a_zip, "Sheet1")
+
+    def test_render_excel_falls_back_to_openpyxl(self):
+        legacy = os.path.join(os.path.dirname(self.path), "legacy.xls")
+        with open(legacy, "wb") as f:
+            f.write(b"\xd0\xcf\x11\xe0 not a zip")
+
+        class Reader:
+            path = legacy
+
+            def iter_rows(self, sheet_name):
+                yield ("Name", "Score")
+                yield ("Ada", 9)
+
+        ws = load_workbook(BytesIO(render_excel(Reader(), "Sheet1"))).active
+        self.assertEqual(list(ws.iter_rows(values_only=True)), [("Name", "Score"), ("Ada", 9)])
+
+        # A real package takes the extractor path
+        extracted = render_excel(WorkbookReader(self.path), "Staff")
+        ws = load_workbook(BytesIO(extracted)).active
+        self.assertEqual(ws["A1"].value, "Secret")
+
+
+# ==========================================================
+# PERSONALISED SENDS
+# ==========================================================
+class PartitionRowsTests(SimpleTestCase):
+
+    def test_single_pass_buckets_rows_by_key(self):
+        rows = [
+            ("Name", " EMAIL "),
+            ("Ada", "ada@example.com"),
+            ("Stranger", "nobody@example.com"),
+            ("Ada again", "ADA@example.com "),
+            ("Blank", None),
+            ("Short",),
+        ]
+        header, buckets = partition_rows(
+            iter(rows), "email", ["Ada@example.com", "grace@example.com"]
+        )
+
+        self.assertEqual(header, ("Name", " EMAIL "))
+        self.assertEqual(
+            buckets,
+            {
+                "ada@example.com": [
+                    ("Ada", "ada@example.com"), ("Ada again", "ADA@example.com ")
+                ],
+                "grace@example.com": [],
+            }
+        )
+
+    def test_missing_column_or_empty_sheet(self):
+        with self.assertRaises(KeyError):
+            partition_rows(iter([("Name",)]), "Email", [])
+        with self.assertRaises(KeyError):
+            partition_rows(iter([]), "Email", [])
+
+
+def _stored_workbook(test, owner, sheets):
+    """
+    Saves a workbook built from {sheet name: rows} through the upload
+    blob store, under a temporary MEDIA_ROOT, and records its manifest.
+    """
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    settings_override = override_settings(
+        MEDIA_ROOT=media_root,
+        ATTACHMENT_CACHE_DIR=os.path.join(media_root, "cache"),
+    )
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+
+    name, content_hash = store_workbook_blob(
+        SimpleUploadedFile("book.xlsx", buffer.getvalue())
+    )
+    department, _ = Department.objects.get_or_create(name="Science")
+    excel = ExcelFile.objects.create(file=name, uploaded_by=owner, department=department)
+    record_sheet_manifest(excel, content_hash)
+    return excel
+
+
+def _members(excel, sheet_name, *emails):
+    Member.objects.bulk_create([
+        Member(
+            name=email, email=email, sheet_name=sheet_name,
+            department=excel.department, created_by=excel.uploaded_by
+        )
+        for email in emails
+    ])
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    EMAIL_DELIVERY_ENGINE="pooled",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class PersonalisedSendTests(TestCase):
+
+    def setUp(self):
+        self.head = User.objects.create_user("head")
+        self.excel = _stored_workbook(self, self.head, {
+            "Grades": [
+                ["Student", "Email", "Grade"],
+                ["Ada", "ada@example.com", "A"],
+                ["Grace", "grace@example.com", "B"],
+                ["Ada", "ada@example.com", "A+"],
+            ]
+        })
+        _members(self.excel, "Grades", "ada@example.com", "grace@example.com", "alan@example.com")
+
+    def test_each_member_gets_only_their_rows(self):
+        job, = enqueue_send_jobs(
+            ExcelFile.objects.filter(pk=self.excel.pk), "excel", self.head, "Email"
+        )
+        run_send_job(job)
+
+        received = {}
+        for message in mail.outbox:
+            _, content, _ = message.attachments[0]
+            ws = load_workbook(BytesIO(content)).active
+            received[message.to[0]] = [row[2] for row in ws.iter_rows(values_only=True)]
+
+        self.assertEqual(received, {
+            "ada@example.com": ["Grade", "A", "A+"],
+            "grace@example.com": ["Grade", "B"],
+        })
+
+        unmatched = EmailLog.objects.get(recipient_email="alan@example.com")
+        self.assertEqual(unmatched.status, "failed")
+        self.assertEqual(unmatched.key_column, "Email")
+        self.assertIsNone(unmatched.next_attempt_at)
+
+
+# ==========================================================
+# RESUMABLE SEND JOBS
+# ==========================================================
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    EMAIL_DELIVERY_ENGINE="pooled",
+    SEND_JOB_STALE_SECONDS=60,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ResumableSendJobTests(TestCase):
+
+    def setUp(self):
+        self.head = User.objects.create_user("head")
+        self.excel = _stored_workbook(self, self.head, {
+            "Sheet1": [["Name"], ["Row"]],
+        })
+        _members(self.excel, "Sheet1", "a@example.com", "b@example.com", "c@example.com")
+        self.job, = enqueue_send_jobs(
+            ExcelFile.objects.filter(pk=self.excel.pk), "excel", self.head
+        )
+
+    def _crash_after_first_delivery(self, heartbeat_age):
+        claim_next_job("worker-a")
+        _plan_tasks(self.job, ["Sheet1"])
+        self.job.tasks.filter(recipient_email="a@example.com").update(status="success")
+        SendJob.objects.filter(pk=self.job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=heartbeat_age)
+        )
+
+    def test_stale_job_is_reclaimed_and_only_the_remainder_is_sent(self):
+        self._crash_after_first_delivery(heartbeat_age=120)
+
+        job = claim_next_job("worker-b")
+        self.assertEqual((job.pk, job.worker), (self.job.pk, "worker-b"))
+
+        run_send_job(job)
+
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["b@example.com", "c@example.com"]
+        )
+        # A resend after another crash would reuse the same Message-ID
+        for message in mail.outbox:
+            key = job.tasks.get(recipient_email=message.to[0]).idempotency_key
+            self.assertEqual(message.extra_headers["Message-ID"], f"<{key}@{DNS_NAME}>")
+
+    def test_job_with_recent_heartbeat_is_left_alone(self):
+        self._crash_after_first_delivery(heartbeat_age=5)
+        self.assertIsNone(claim_next_job("worker-b"))
+
+    def test_resume_requeues_jobs_with_unsent_tasks(self):
+        _plan_tasks(self.job, ["Sheet1"])
+        SendJob.objects.filter(pk=self.job.pk).update(status="failed")
+        self.assertEqual(resume_jobs(SendJob.objects.all()), 1)
+
+        self.job.tasks.update(status="success")
+        SendJob.objects.filter(pk=self.job.pk).update(status="done")
+        self.assertEqual(resume_jobs(SendJob.objects.all()), 0)
+
+    def test_deliveries_in_flight_at_a_crash_are_not_resent(self):
+        self._crash_after_first_delivery(heartbeat_age=120)
+        self.job.tasks.filter(recipient_email="b@example.com").update(status="sending")
+
+        run_send_job(self.job)
+
+        self.assertEqual([message.to[0] for message in mail.outbox], ["c@example.com"])
+        log = EmailLog.objects.get(recipient_email="b@example.com")
+        self.assertEqual((log.status, log.error_message), ("failed", INTERRUPTED_ERROR))
+        self.assertIsNone(log.next_attempt_at)
+
+    @override_settings(EMAIL_LOG_FLUSH_ROWS=2)
+    def test_each_chunk_is_recorded_before_the_next_is_sent(self):
+        seen = []
+
+        class RecordingMailer(PooledMailer):
+            def send(self, messages):
+                seen.append(sorted(SendTask.objects.values_list("status", flat=True)))
+                yield from super().send(messages)
+
+        with mock.patch("myapp.utils.get_mailer", RecordingMailer):
+            run_send_job(self.job)
+
+        self.assertEqual(seen, [
+            ["pending", "sending", "sending"],
+            ["sending", "success", "success"],
+        ])
+        self.assertEqual(EmailLog.objects.filter(status="success").count(), 3)
+
+    @override_settings(EMAIL_LOG_FLUSH_ROWS=2)
+    def test_a_lost_heartbeat_stops_the_run_before_the_next_chunk(self):
+        heartbeat = mock.Mock(lost=False)
+
+        class ReclaimedMailer(PooledMailer):
+            def send(self, messages):
+                yield from super().send(messages)
+                heartbeat.lost = True
+
+        with mock.patch("myapp.utils.get_mailer", ReclaimedMailer), \
+                self.assertRaises(JobLostError):
+            run_send_job(self.job, heartbeat)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(self.job.tasks.filter(status="pending").count(), 1)
+
+    @override_settings(EMAIL_LOG_FLUSH_ROWS=2)
+    def test_tasks_taken_by_another_worker_are_not_sent(self):
+        class RacingMailer(PooledMailer):
+            def send(self, messages):
+                # Another worker reclaims the job and takes the last task
+                SendTask.objects.filter(recipient_email="c@example.com").update(status="sending")
+                yield from super().send(messages)
+
+        with mock.patch("myapp.utils.get_mailer", RacingMailer):
+            run_send_job(self.job)
+
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["a@example.com", "b@example.com"]
+        )
+        self.assertFalse(EmailLog.objects.filter(recipient_email="c@example.com").exists())
+
+
+@override_settings(SEND_JOB_STALE_SECONDS=60)
+class JobClaimTests(TestCase):
+
+    def setUp(self):
+        head = User.objects.create_user("head")
+        department = Department.objects.create(name="Science")
+        excel = ExcelFile.objects.create(file="book.xlsx", uploaded_by=head, department=department)
+        self.first, self.second = [
+            SendJob.objects.create(excel_file=excel, send_type="pdf", requested_by=head)
+            for _ in range(2)
+        ]
+
+    def test_each_job_is_claimed_once_oldest_first(self):
+        self.assertEqual(claim_next_job("worker-a").pk, self.first.pk)
+        self.assertEqual(claim_next_job("worker-b").pk, self.second.pk)
+        self.assertIsNone(claim_next_job("worker-c"))
+
+        self.assertEqual(
+            list(SendJob.objects.order_by("pk").values_list("status", "worker")),
+            [("running", "worker-a"), ("running", "worker-b")]
+        )
+
+    def test_a_job_taken_between_select_and_update_is_skipped(self):
+        real_claimable_jobs = jobs.claimable_jobs
+        calls = []
+
+        def claimable_jobs():
+            calls.append(1)
+            if len(calls) == 2:
+                # worker-b wins the first job right before our UPDATE
+                SendJob.objects.filter(pk=self.first.pk).update(
+                    status="running", worker="worker-b", heartbeat_at=timezone.now()
+                )
+            return real_claimable_jobs()
+
+        with mock.patch.object(jobs, "claimable_jobs", side_effect=claimable_jobs):
+            job = jobs.claim_next_job("worker-a")
+
+        self.assertEqual(job.pk, self.second.pk)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.worker, "worker-b")
+
+    def test_stale_running_jobs_are_reclaimed(self):
+        long_ago = timezone.now() - timedelta(seconds=120)
+        SendJob.objects.filter(pk=self.first.pk).update(
+            status="running", worker="dead", heartbeat_at=long_ago
+        )
+        # Claimed before heartbeats existed: only started_at to go by
+        SendJob.objects.filter(pk=self.second.pk).update(
+            status="running", worker="dead", started_at=long_ago
+        )
+
+        self.assertEqual(claim_next_job("worker-a").pk, self.first.pk)
+        self.assertEqual(claim_next_job("worker-a").pk, self.second.pk)
+        self.assertIsNone(claim_next_job("worker-a"))
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class SendJobAdminTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser("admin", password="pw")
+        department = Department.objects.create(name="Science")
+        excel = ExcelFile.objects.create(file="book.xlsx", uploaded_by=admin, department=department)
+        self.job, self.other = [
+            SendJob.objects.create(excel_file=excel, send_type="pdf", requested_by=admin)
+            for _ in range(2)
+        ]
+        SendTask.objects.bulk_create(
+            [
+                SendTask(job=self.job, recipient_email=f"r{i}@example.com",
+                         sheet_name="Sheet1", status=status)
+                for i, status in enumerate(["success"] * 3 + ["failed", "pending"])
+            ] + [SendTask(job=self.other, recipient_email="x@example.com", sheet_name="Sheet1")]
+        )
+        self.client.force_login(admin)
+
+    def test_change_page_summarises_tasks_instead_of_listing_them(self):
+        response = self.client.get(
+            reverse("admin:myapp_sendjob_change", args=[self.job.pk])
+        )
+
+        self.assertContains(response, "Pending: 1, Sending: 0, Success: 3, Failed: 1")
+        self.assertNotContains(response, "r0@example.com")
+        self.assertContains(
+            response,
+            reverse("admin:myapp_sendtask_changelist") + f"?job__id__exact={self.job.pk}"
+        )
+
+    def test_deliveries_link_lists_only_that_job(self):
+        response = self.client.get(
+            reverse("admin:myapp_sendtask_changelist"), {"job__id__exact": self.job.pk}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(task.recipient_email for task in response.context["cl"].result_list),
+            [f"r{i}@example.com" for i in range(5)]
+        )
+
+
+class SendWorkerTests(TestCase):
+
+    def test_database_errors_while_idle_do_not_stop_the_worker(self):
+        err = StringIO()
+        with mock.patch(
+            "myapp.management.commands.send_worker.enqueue_due_retries",
+            side_effect=OperationalError("database is locked")
+        ):
+            call_command("send_worker", once=True, stdout=StringIO(), stderr=err)
+
+        self.assertIn("Could not queue retries: database is locked", err.getvalue())
+
+    def _run_reclaimed_job(self, side_effect):
+        head = User.objects.create_user("head")
+        department = Department.objects.create(name="Science")
+        excel = ExcelFile.objects.create(file="book.xlsx", uploaded_by=head, department=department)
+        job, = enqueue_send_jobs(ExcelFile.objects.filter(pk=excel.pk), "excel", head)
+
+        def reclaim(job, heartbeat):
+            # Another worker takes the job over mid-run
+            SendJob.objects.filter(pk=job.pk).update(worker="worker-b")
+            if side_effect:
+                raise side_effect
+
+        err = StringIO()
+        with mock.patch("myapp.management.commands.send_worker.run_send_job", reclaim):
+            call_command(
+                "send_worker", once=True, worker_id="worker-a", stdout=StringIO(), stderr=err
+            )
+        job.refresh_from_db()
+        return job, err.getvalue()
+
+    def test_a_reclaimed_job_is_not_marked_done_by_the_old_worker(self):
+        job, _ = self._run_reclaimed_job(None)
+        self.assertEqual((job.status, job.worker), ("running", "worker-b"))
+        self.assertIsNone(job.finished_at)
+
+    def test_a_reclaimed_job_is_not_marked_failed_by_the_old_worker(self):
+        job, _ = self._run_reclaimed_job(RuntimeError("SMTP down"))
+        self.assertEqual((job.status, job.error_message), ("running", ""))
+
+    def test_a_lost_job_is_reported_and_left_alone(self):
+        job, err = self._run_reclaimed_job(JobLostError("Job was reclaimed"))
+        self.assertEqual(job.status, "running")
+        self.assertIn("Job was reclaimed", err)
+
+    def test_a_busy_database_when_finishing_a_job_does_not_stop_the_worker(self):
+        head = User.objects.create_user("head")
+        department = Department.objects.create(name="Science")
+        excel = ExcelFile.objects.create(file="book.xlsx", uploaded_by=head, department=department)
+        job, = enqueue_send_jobs(ExcelFile.objects.filter(pk=excel.pk), "excel", head)
+
+        err = StringIO()
+        with mock.patch("myapp.management.commands.send_worker.run_send_job"), \
+                mock.patch(
+                    "myapp.management.commands.send_worker.serialized_writes",
+                    side_effect=OperationalError("database is locked")
+                ):
+            call_command("send_worker", once=True, stdout=StringIO(), stderr=err)
+
+        self.assertIn(f"Could not record the outcome of job {job.pk}", err.getvalue())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "running")
+
+
+class JobHeartbeatTests(TransactionTestCase):
+
+    def test_heartbeat_moves_without_any_logging(self):
+        head = User.objects.create_user("head")
+        department = Department.objects.create(name="Science")
+        excel = ExcelFile.objects.create(file="book.xlsx", uploaded_by=head, department=department)
+        enqueue_send_jobs(ExcelFile.objects.filter(pk=excel.pk), "excel", head)
+        job = claim_next_job("worker-a")
+        first = job.heartbeat_at
+
+        with JobHeartbeat(job, interval=0.05) as heartbeat:
+            time.sleep(0.3)
+        job.refresh_from_db()
+        self.assertGreater(job.heartbeat_at, first)
+        self.assertFalse(heartbeat.lost)
+
+        # Reclaimed by another worker: this one stops beating
+        SendJob.objects.filter(pk=job.pk).update(worker="worker-b")
+        with JobHeartbeat(job, interval=0.05) as heartbeat:
+            time.sleep(0.3)
+        self.assertTrue(heartbeat.lost)
+
+
+# ==========================================================
+# BUFFERED EMAIL LOG WRITER
+# ==========================================================
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class EmailLogWriterTests(TestCase):
+
+    def setUp(self):
+        head = User.objects.create_user("head")
+        department = Department.objects.create(name="Science")
+        excel = ExcelFile.objects.create(file="book.xlsx", uploaded_by=head, department=department)
+        self.job = SendJob.objects.create(excel_file=excel, send_type="pdf", requested_by=head)
+        self.tasks = SendTask.objects.bulk_create([
+            SendTask(job=self.job, recipient_email=f"r{i}@example.com", sheet_name="Sheet1")
+            for i in range(5)
+        ])
+        # bulk_create on SQLite does not set primary keys before 3.35
+        if self.tasks[0].pk is None:
+            self.tasks = list(self.job.tasks.order_by("id"))
+
+    def test_flushes_every_n_rows(self):
+        writer = EmailLogWriter(flush_rows=2, flush_seconds=3600)
+
+        writer.log(self.job, self.tasks[0])
+        self.assertEqual(EmailLog.objects.count(), 0)
+        writer.log(self.job, self.tasks[1])
+        self.assertEqual(EmailLog.objects.count(), 2)
+        writer.log(self.job, self.tasks[2], RuntimeError("refused"))
+        self.assertEqual(EmailLog.objects.count(), 2)
+
+        writer.flush()
+        self.assertEqual(
+            list(self.job.tasks.order_by("id").values_list("status", flat=True)),
+            ["success", "success", "failed", "pending", "pending"]
+        )
+
+    def test_flushes_after_n_seconds(self):
+        clock = [1000.0]
+        with mock.patch("myapp.logwriter.time.monotonic", side_effect=lambda: clock[0]):
+            writer = EmailLogWriter(flush_rows=100, flush_seconds=5)
+
+            writer.log(self.job, self.tasks[0])
+            clock[0] += 4
+            writer.log(self.job, self.tasks[1])
+            self.assertEqual(EmailLog.objects.count(), 0)
+
+            clock[0] += 1
+            writer.log(self.job, self.tasks[2])
+            self.assertEqual(EmailLog.objects.count(), 3)
+
+    def test_buffered_rows_are_written_when_the_send_loop_raises(self):
+        with self.assertRaises(RuntimeError):
+            with EmailLogWriter(flush_rows=100, flush_seconds=3600) as writer:
+                writer.log(self.job, self.tasks[0])
+                writer.log(self.job, self.tasks[1], RuntimeError("refused"))
+                raise RuntimeError("render crashed")
+
+        self.assertEqual(
+            sorted(EmailLog.objects.values_list("recipient_email", "status")),
+            [("r0@example.com", "success"), ("r1@example.com", "failed")]
+        )
+        self.job.refresh_from_db()
+        self.assertIsNotNone(self.job.heartbeat_at)
+
+
+# ==========================================================
+# RETRY PIPELINE
+# ==========================================================
+@override_settings(EMAIL_RETRY_BACKOFF=300, EMAIL_RETRY_MAX_ATTEMPTS=3)
+class RetryPipelineTests(TestCase):
+
+    def setUp(self):
+        self.head = User.objects.create_user("head")
+        self.department = Department.objects.create(name="Science")
+        self.excel = ExcelFile.objects.create(
+            file="book.xlsx", uploaded_by=self.head, department=self.department
+        )
+        self.job = SendJob.objects.create(
+            excel_file=self.excel, send_type="pdf", requested_by=self.head
+        )
+
+    def _log_failure(self, error, attempt=1):
+        task = SendTask.objects.create(
+            job=self.job, recipient_email=f"r{SendTask.objects.count()}@example.com",
+            sheet_name="Sheet1", attempt=attempt
+        )
+        with EmailLogWriter() as writer:
+            writer.log(self.job, task, error)
+        return EmailLog.objects.get(recipient_email=task.recipient_email)
+
+    def _due_failure(self, recipient, sheet="Sheet1", send_type="pdf", attempt=1, excel=None):
+        return EmailLog.objects.create(
+            sent_by=self.head, excel_file=excel or self.excel,
+            recipient_email=recipient, sheet_name=sheet, send_type=send_type,
+            status="failed", attempt_count=attempt,
+            next_attempt_at=timezone.now() - timedelta(minutes=1)
+        )
+
+    def test_retry_delay_doubles_per_attempt(self):
+        self.assertEqual(retry_delay(1), timedelta(seconds=300))
+        self.assertEqual(retry_delay(2), timedelta(seconds=600))
+        self.assertEqual(retry_delay(3), timedelta(seconds=1200))
+
+    def test_only_retryable_failures_are_scheduled(self):
+        refused = smtplib.SMTPRecipientsRefused({"x@example.com": (550, b"No such user")})
+        throttled = smtplib.SMTPRecipientsRefused({"x@example.com": (451, b"Try later")})
+
+        self.assertIsNone(self._log_failure(refused).next_attempt_at)
+        self.assertIsNotNone(self._log_failure(throttled).next_attempt_at)
+        self.assertIsNotNone(self._log_failure(OSError("Connection refused")).next_attempt_at)
+        # Out of attempts
+        self.assertIsNotNone(self._log_failure(OSError("down"), attempt=2).next_attempt_at)
+        self.assertIsNone(self._log_failure(OSError("down"), attempt=3).next_attempt_at)
+
+    def test_due_failures_are_grouped_into_jobs(self):
+        self._due_failure("a@example.com")
+        self._due_failure("b@example.com", sheet="Sheet2", attempt=2)
+        self._due_failure("a@example.com", send_type="excel")
+        not_due = self._due_failure("c@example.com")
+        EmailLog.objects.filter(pk=not_due.pk).update(next_attempt_at=None)
+
+        self.assertEqual(enqueue_due_retries(), 3)
+
+        retry_jobs = SendJob.objects.exclude(pk=self.job.pk)
+        self.assertEqual(
+            sorted(
+                (job.send_type, sorted(job.tasks.values_list("recipient_email", "sheet_name", "attempt")))
+                for job in retry_jobs
+            ),
+            [
+                ("excel", [("a@example.com", "Sheet1", 2)]),
+                ("pdf", [("a@example.com", "Sheet1", 2), ("b@example.com", "Sheet2", 3)]),
+            ]
+        )
+        self.assertFalse(EmailLog.objects.filter(next_attempt_at__isnull=False).exists())
+
+    def test_superseded_failures_are_cleared_without_a_retry(self):
+        failure = self._due_failure("a@example.com")
+        EmailLog.objects.create(
+            sent_by=self.head, excel_file=self.excel, recipient_email="a@example.com",
+            sheet_name="Sheet1", send_type="pdf", status="success"
+        )
+
+        self.assertEqual(enqueue_due_retries(), 0)
+        failure.refresh_from_db()
+        self.assertIsNone(failure.next_attempt_at)
+        self.assertEqual(SendJob.objects.count(), 1)
+
+    def test_an_entry_is_claimed_by_one_caller_only(self):
+        failure = self._due_failure("a@example.com")
+        real_filter = EmailLog.objects.filter
+
+        def claimed_elsewhere(*args, **kwargs):
+            # Another worker claims the entry between our read and our claim
+            if kwargs.get("next_attempt_at__isnull") is False:
+                real_filter(pk=failure.pk).update(next_attempt_at=None)
+            return real_filter(*args, **kwargs)
+
+        with mock.patch.object(EmailLog.objects, "filter", side_effect=claimed_elsewhere):
+            self.assertEqual(enqueue_due_retries(), 0)
+        self.assertEqual(SendJob.objects.count(), 1)
+
+        # Nothing left to claim on a second pass either
+        self.assertEqual(enqueue_due_retries(), 0)
+
+
+# ==========================================================
+# BENCHMARK SUITE
+# ==========================================================
+class BenchmarkSendTests(TestCase):
+
+    def test_tiny_run_reports_every_stage_and_leaves_no_data(self):
+        output = os.path.join(tempfile.mkdtemp(), "results.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        metrics_before = sorted(os.listdir(settings.METRICS_DIR))
+
+        call_command(
+            "benchmark_send", sheets=2, rows=5, columns=3, members=2,
+            processes=1, output=output, stdout=StringIO()
+        )
+
+        with open(output) as fh:
+            results = json.load(fh)
+
+        stages = [(row["stage"], row["send_type"]) for row in results["results"]]
+        self.assertEqual(stages, [
+            ("generate_workbook", None), ("ingest", None),
+            ("render", "pdf"), ("send", "pdf"), ("end_to_end", "pdf"),
+            ("render", "excel"), ("send", "excel"), ("end_to_end", "excel"),
+        ])
+        for row in results["results"]:
+            self.assertGreater(row["peak_rss_mb"], 0)
+        self.assertEqual(results["results"][-1]["items"], 4)
+
+        # Ran against a scratch database and metrics directory
+        self.assertFalse(ExcelFile.objects.exists())
+        self.assertFalse(EmailLog.objects.exists())
+        self.assertEqual(sorted(os.listdir(settings.METRICS_DIR)), metrics_before)
+
+    def test_internal_scratch_flag_only_runs_in_the_scratch_subprocess(self):
+        database = str(settings.DATABASES["default"]["NAME"])
+        with mock.patch("myapp.management.commands.benchmark_send.run_benchmark") as run:
+            with self.assertRaisesMessage(CommandError, "--scratch is internal"):
+                call_command("benchmark_send", scratch=True, output="results.json")
+
+            with mock.patch.dict(os.environ, BENCHMARK_SCRATCH_DB=database), \
+                    self.assertRaisesMessage(CommandError, "--scratch needs --output"):
+                call_command("benchmark_send", scratch=True)
+
+        run.assert_not_called()
+
+    def test_compare_reports_throughput_change(self):
+        baseline = {"results": [{"stage": "send", "send_type": "pdf", "throughput": 100}]}
+        current = {"results": [
+            {"stage": "send", "send_type": "pdf", "throughput": 150},
+            {"stage": "render", "send_type": "pdf", "throughput": 3},
+        ]}
+
+        self.assertEqual(
+            list(compare_results(current, baseline)),
+            [("send", "pdf", 100, 150, 50.0)]
+        )
+
+
+def _scrape(client, **headers):
+    """
+    GETs /metrics and returns {(name, sorted label items): value}.
+    """
+    response = client.get(reverse("metrics"), **headers)
+    if response.status_code != 200:
+        return response, {}
+    samples = {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.content.decode())
+        for sample in family.samples
+    }
+    return response, samples
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    EMAIL_DELIVERY_ENGINE="pooled",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage",
+    METRICS_TOKEN="scrape-me",
+)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def test_endpoint_requires_admin_or_token(self):
+        head = User.objects.create_user("head")
+
+        response, _ = _scrape(self.client)
+        self.assertEqual(response.status_code, 401)
+
+        self.client.force_login(head)
+        response, _ = _scrape(self.client)
+        self.assertEqual(response.status_code, 401)
+        response, _ = _scrape(self.client, HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 401)
+
+        self.client.logout()
+        response, _ = _scrape(self.client, HTTP_AUTHORIZATION="Bearer scrape-me")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+        self.client.force_login(self.admin)
+        response, _ = _scrape(self.client)
+        self.assertEqual(response.status_code, 200)
+
+    def test_send_job_records_stages_outcomes_and_bytes(self):
+        excel = _stored_workbook(self, self.admin, {"Sheet1": [["Name"], ["Row"]]})
+        _members(excel, "Sheet1", "a@example.com", "b@example.com")
+        self.client.force_login(self.admin)
+
+        def stage_count(samples, stage):
+            return samples.get(
+                ("excelmailer_stage_seconds_count", (("stage", stage),)), 0
+            )
+
+        _, before = _scrape(self.client)
+        job, = enqueue_send_jobs(ExcelFile.objects.filter(pk=excel.pk), "pdf", self.admin)
+        run_send_job(job)
+        self.client.get(reverse("excel_send"))
+        _, after = _scrape(self.client)
+
+        def delta(key):
+            return after.get(key, 0) - before.get(key, 0)
+
+        sent = ("excelmailer_emails_total", (("send_type", "pdf"), ("status", "success")))
+        self.assertEqual(delta(sent), 2)
+        attached = sum(len(message.attachments[0][1]) for message in mail.outbox)
+        self.assertEqual(
+            delta(("excelmailer_attachment_bytes_total", (("send_type", "pdf"),))),
+            attached
+        )
+        for stage in ("load_workbook", "plan", "render", "smtp", "log_write"):
+            self.assertGreater(
+                stage_count(after, stage) - stage_count(before, stage), 0, stage
+            )
+        self.assertEqual(
+            delta(("excelmailer_view_seconds_count", (("view", "excel_send"),))), 1
+        )
+
+
+    def test_tests_write_to_a_scratch_metrics_dir(self):
+        self.assertNotEqual(settings.METRICS_DIR, str(settings.BASE_DIR / "metrics"))
+        self.assertEqual(os.environ["PROMETHEUS_MULTIPROC_DIR"], settings.METRICS_DIR)
+
+    def test_render_pool_workers_are_marked_dead(self):
+        excel = _stored_workbook(self, self.admin, {
+            "Sheet1": [["Name"], ["Ada"]],
+            "Sheet2": [["Name"], ["Grace"]],
+        })
+        with mock.patch("myapp.attachments.mark_process_dead") as mark_dead, \
+                WorkbookReader(excel.file.path) as reader:
+            results = list(render_sheets(
+                reader, ["Sheet1", "Sheet2"], "pdf", excel.content_hash,
+                cache=AttachmentCache(), processes=2
+            ))
+
+        self.assertEqual([error for _, _, error in results], [None, None])
+        dead = {call.args[0] for call in mark_dead.call_args_list}
+        self.assertTrue(dead)
+        self.assertNotIn(os.getpid(), dead)
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    EMAIL_DELIVERY_ENGINE="pooled",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage",
+    PROFILING_ENABLED=True,
+)
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        settings_override = override_settings(PROFILE_DIR=profile_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def _names(self):
+        return [profile["name"] for profile in list_profiles()]
+
+    @override_settings(PROFILE_KEEP=2)
+    def test_profiled_block_writes_summary_and_keeps_the_newest(self):
+        for label in ("first", "second", "third"):
+            with profiled(label):
+                sorted(range(1000))
+
+        names = self._names()
+        self.assertEqual([name.rsplit("-", 1)[1] for name in names], ["third", "second"])
+        with open(profile_path(names[0], SUMMARY_EXTENSION)) as fh:
+            summary = fh.read()
+        self.assertIn("Wall time", summary)
+        self.assertIn("Top functions by cumulative time", summary)
+        self.assertIn("Peak traced memory", summary)
+
+    def test_view_flag_is_for_admin_users_and_browsable_in_admin(self):
+        self.client.force_login(User.objects.create_user("head"))
+        self.client.get(reverse("member_list"), {"profile": "1"})
+        self.assertEqual(self._names(), [])
+
+        self.client.force_login(self.admin)
+        self.client.get(reverse("member_list"), {"profile": "1"})
+        name, = self._names()
+        self.assertTrue(name.endswith("view-member_list"))
+
+        response = self.client.get(reverse("admin:myapp_sendjob_profiles"))
+        self.assertContains(response, name)
+        response = self.client.get(reverse("admin:myapp_sendjob_profile", args=[name]))
+        self.assertContains(response, "Top functions by cumulative time")
+        response = self.client.get(
+            reverse("admin:myapp_sendjob_profile", args=[name]), {"download": "1"}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("admin:myapp_sendjob_profile", args=["..evil"]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_profiled_send_is_run_under_the_profiler(self):
+        excel = _stored_workbook(self, self.admin, {"Sheet1": [["Name"], ["Row"]]})
+        _members(excel, "Sheet1", "a@example.com")
+        self.client.force_login(self.admin)
+
+        self.client.post(reverse("excel_send"), {
+            "excel_id": excel.pk, "send_type": "excel", "profile": "1"
+        })
+        job = SendJob.objects.get()
+        self.assertTrue(job.profile)
+
+        call_command("send_worker", once=True, stdout=StringIO())
+
+        name, = self._names()
+        self.assertTrue(name.endswith(f"send-job-{job.pk}"))
+
+
+class SQLiteConcurrencyTests(TestCase):
+
+    def test_pragmas_are_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_concurrent_writers_complete_without_lock_errors(self):
+        out = StringIO()
+        call_command("sqlite_stress", writers=4, rows=50, flush_rows=5, stdout=out)
+
+        self.assertIn("journal_mode=wal: 200/200 rows", out.getvalue())
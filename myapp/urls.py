@@ -33,6 +33,7 @@ urlpatterns = [
     # --------------------
     path('members/', views.member_list, name='member_list'),
     path('members/add/', views.member_add, name='member_add'),
+    path('members/import/', views.member_import, name='member_import'),
     path('members/delete/<int:pk>/', views.member_delete, name='member_delete'),
 
     # --------------------
@@ -60,4 +61,9 @@ urlpatterns = [
     # --------------------
     path("email-logs/export/", views.export_email_logs, name="export_email_logs"),
 
+    # --------------------
+    # Prometheus Metrics
+    # --------------------
+    path("metrics", views.metrics, name="metrics"),
+
 ]
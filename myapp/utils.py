@@ -1,16 +1,17 @@
-import os
-from io import BytesIO
-
+from django.contrib import messages
 from django.core.mail import EmailMessage
-from django.core.exceptions import ValidationError
+from django.core.mail.utils import DNS_NAME
+from django.db import transaction
 
-from openpyxl import load_workbook, Workbook
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+from .attachments import RENDERERS, ROW_RENDERERS, render_sheets
+from .db import serialized_writes
+from .jobs import JobLostError, enqueue_send_jobs
+from .logwriter import EmailLogWriter
+from .mailer import get_mailer
+from .metrics import ATTACHMENT_BYTES, stage_timer
+from .models import Member, SendTask
+from .workbooks import WorkbookReader, normalise_key, partition_rows, sheet_names_for
 
-from .models import Member, EmailLog
-from django.contrib import messages
 
 # ==========================================================
 # INTERNAL HELPER: notify success (admin OR dashboard)
@@ -29,130 +30,268 @@ def _notify_success(admin_instance, request, message):
         messages.success(request, message)
 
 
+# Error recorded for deliveries whose outcome a crashed worker never logged
+INTERRUPTED_ERROR = (
+    "Interrupted mid-delivery; not re-sent automatically to avoid a duplicate"
+)
+
+EMAIL_CONTENT = {
+    "pdf": ("Your PDF File", "Please find attached PDF."),
+    "excel": ("Your Excel Sheet", "Please find attached Excel file."),
+}
+
+
 # ==========================================================
-# SEND PDF VERSION OF EACH SHEET
+# MEMBER RESOLUTION: one query per workbook
+# ==========================================================
+def members_for_excel_file(excel_file, sheet_names):
+    """
+    Returns {sheet_name: [email, ...]} for every member mapped to one of
+    the workbook's sheets, fetched in a single query backed by the
+    (department, created_by, sheet_name) index.
+    """
+    members_by_sheet = {}
+    members = Member.objects.filter(
+        department=excel_file.department_id,
+        created_by=excel_file.uploaded_by_id,
+        sheet_name__in=list(sheet_names)
+    ).values_list("sheet_name", "email")
+
+    for sheet_name, email in members:
+        members_by_sheet.setdefault(sheet_name, []).append(email)
+
+    return members_by_sheet
+
+
 # ==========================================================
-def process_pdf_and_send_emails(admin_instance, request, queryset):
+# INTERNAL HELPER: plan one task per (recipient, sheet)
+# ==========================================================
+def _plan_tasks(job, sheet_names):
+    """
+    Records every delivery the job will make, each with its own
+    idempotency key. Planning happens once per job, so a job resumed
+    after a worker crash only sends what is left.
+    """
+    if job.tasks.exists():
+        return
 
-    for excel_file in queryset:
-        wb = load_workbook(excel_file.file.path, data_only=True)
+    members_by_sheet = members_for_excel_file(job.excel_file, sheet_names)
 
-        for sheet_name in wb.sheetnames:
-            members = Member.objects.filter(
+    tasks = []
+    for sheet_name in sheet_names:
+        for email in members_by_sheet.get(sheet_name, []):
+            tasks.append(SendTask(
+                job=job,
+                recipient_email=email,
                 sheet_name=sheet_name,
-                department=excel_file.department,
-                created_by=excel_file.uploaded_by
-            )
-
-            for member in members:
-                try:
-                    buffer = BytesIO()
-                    doc = SimpleDocTemplate(buffer, pagesize=letter)
-
-                    sheet = wb[sheet_name]
-                    data = [row for row in sheet.iter_rows(values_only=True)]
-
-                    table = Table(data)
-                    table.setStyle(TableStyle([
-                        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                    ]))
-
-                    doc.build([table])
-                    pdf_content = buffer.getvalue()
-                    buffer.close()
-
-                    email = EmailMessage(
-                        subject="Your PDF File",
-                        body="Please find attached PDF.",
-                        # from_email=os.environ.get("EMAIL_FROM"),
-                        from_email=None,
-                        to=[member.email],
-                    )
-                    email.attach(f"{sheet_name}.pdf", pdf_content, "application/pdf")
-                    email.send()
-
-                    EmailLog.objects.create(
-                        sent_by=request.user,
-                        recipient_email=member.email,
-                        sheet_name=sheet_name,
-                        send_type="pdf",
-                        status="success"
-                    )
-
-                except Exception as e:
-                    EmailLog.objects.create(
-                        sent_by=request.user,
-                        recipient_email=member.email,
-                        sheet_name=sheet_name,
-                        send_type="pdf",
-                        status="failed",
-                        error_message=str(e)
-                    )
-
-    _notify_success(admin_instance, request, "PDF emails processed.")
+                idempotency_key=SendTask.make_idempotency_key(
+                    job.pk, email, sheet_name, job.send_type
+                )
+            ))
+
+    # All or nothing, so a crash mid-plan cannot leave a partial plan
+    # that the exists() check above would then treat as complete
+    with transaction.atomic():
+        SendTask.objects.bulk_create(tasks, ignore_conflicts=True)
+
+
+# ==========================================================
+# RUN A QUEUED SEND JOB (called by the send_worker command)
+# ==========================================================
+def run_send_job(job, heartbeat=None):
+    """
+    Each sheet is rendered at most once per run and the same bytes are
+    attached for every pending task of that sheet. Rendered bytes also
+    go through the disk-backed AttachmentCache, so re-sending an
+    unchanged workbook skips rendering entirely. Sheets are sent as
+    soon as their attachment is ready (see render_sheets).
+
+    Personalised jobs (job.key_column set) read each sheet once and send
+    every recipient only their own rows instead; see _send_personalised.
+
+    Delivery goes through the engine chosen by EMAIL_DELIVERY_ENGINE
+    (one pooled connection, or concurrent asyncio sessions), and
+    outcomes are written to EmailLog in buffered bulk inserts, flushed
+    after every chunk of deliveries (see _deliver).
+
+    Each stage (load_workbook, plan, render, smtp, log_write) is timed
+    in myapp.metrics and exposed on /metrics.
+
+    With the worker's JobHeartbeat, the run stops with JobLostError once
+    the job has been reclaimed elsewhere.
+    """
+    send_type = job.send_type
+
+    excel_file = job.excel_file
+    sheet_names = sheet_names_for(excel_file)
+    content_hash = excel_file.content_hash
+
+    with stage_timer("plan"):
+        _plan_tasks(job, sheet_names)
+
+    # Handed to the mail server by a worker that died before recording
+    # the outcome: they may have been delivered, so they are not re-sent
+    interrupted = list(job.tasks.filter(status="sending"))
+
+    pending = job.tasks.filter(status="pending").order_by("sheet_name", "id")
+    tasks_by_sheet = {}
+    for task in pending:
+        tasks_by_sheet.setdefault(task.sheet_name, []).append(task)
+
+    # Tasks for sheets that have since disappeared fail up front
+    missing = [name for name in tasks_by_sheet if name not in sheet_names]
+
+    # The workbook is only opened when a cache miss needs its rows
+    with WorkbookReader(excel_file.file.path) as reader, \
+            get_mailer() as mailer, \
+            EmailLogWriter() as log_writer:
+        for task in interrupted:
+            log_writer.log(job, task, RuntimeError(INTERRUPTED_ERROR), retry=False)
+
+        for sheet_name in missing:
+            error = KeyError(f"Worksheet {sheet_name} does not exist.")
+            for task in tasks_by_sheet.pop(sheet_name):
+                log_writer.log(job, task, error)
+
+        if job.key_column:
+            _send_personalised(job, reader, mailer, log_writer, tasks_by_sheet, heartbeat)
+            return
+
+        rendered = render_sheets(
+            reader, list(tasks_by_sheet), send_type, content_hash
+        )
+        for sheet_name, content, error in rendered:
+            tasks = tasks_by_sheet[sheet_name]
+
+            if error is not None:
+                for task in tasks:
+                    log_writer.log(job, task, error)
+                continue
+
+            outbox = {_build_email(send_type, task, content): task for task in tasks}
+            _deliver(job, mailer, log_writer, outbox, heartbeat)
+
+
+def _send_personalised(job, reader, mailer, log_writer, tasks_by_sheet, heartbeat=None):
+    """
+    Per sheet: one partition pass buckets the rows by job.key_column,
+    then each recipient gets an attachment of the header plus their own
+    rows. Recipients with no rows are failed without a retry.
+    """
+    render = ROW_RENDERERS[job.send_type]
+
+    for sheet_name, tasks in tasks_by_sheet.items():
+        try:
+            with stage_timer("partition"):
+                header, buckets = partition_rows(
+                    reader.iter_rows(sheet_name),
+                    job.key_column,
+                    [task.recipient_email for task in tasks]
+                )
+        except Exception as e:
+            for task in tasks:
+                log_writer.log(job, task, e)
+            continue
+
+        outbox = {}
+        for task in tasks:
+            rows = buckets.get(normalise_key(task.recipient_email))
+            if not rows:
+                error = LookupError(
+                    f"No rows for {task.recipient_email} in column {job.key_column}"
+                )
+                log_writer.log(job, task, error, retry=False)
+                continue
+
+            try:
+                with stage_timer("render"):
+                    content = render([header] + rows)
+            except Exception as e:
+                log_writer.log(job, task, e)
+                continue
+
+            outbox[_build_email(job.send_type, task, content)] = task
+
+        _deliver(job, mailer, log_writer, outbox, heartbeat)
+
+
+def _deliver(job, mailer, log_writer, outbox, heartbeat=None):
+    """
+    Sends {email: task} in chunks of the log writer's flush size. Each
+    chunk is marked "sending" before it goes out and flushed right after,
+    so every finished delivery is on record before the next chunk starts
+    (a resumed job skips it), and a crash leaves at most one chunk whose
+    outcome is unknown.
+
+    - Stops with JobLostError before a chunk if the heartbeat was lost
+    - Only tasks still "pending" are marked and sent, so a worker that
+      reclaimed the job never sends the same task twice
+    """
+    items = list(outbox.items())
+    size = log_writer.flush_rows
+
+    for start in range(0, len(items), size):
+        if heartbeat is not None and heartbeat.lost:
+            raise JobLostError(f"Job {job.pk} was reclaimed by another worker")
+
+        chunk = dict(items[start:start + size])
+        with serialized_writes(), transaction.atomic():
+            claimed = set(SendTask.objects.filter(
+                pk__in=[task.pk for task in chunk.values()],
+                status="pending"
+            ).values_list("pk", flat=True))
+            SendTask.objects.filter(pk__in=claimed).update(status="sending")
+
+        chunk = {email: task for email, task in chunk.items() if task.pk in claimed}
+        if not chunk:
+            continue
+
+        # Engines may report deliveries out of order
+        for email, error in mailer.send(list(chunk)):
+            log_writer.log(job, chunk[email], error)
+        log_writer.flush()
+
+
+def _build_email(send_type, task, content):
+    _, extension, content_type = RENDERERS[send_type]
+    subject, body = EMAIL_CONTENT[send_type]
+
+    headers = {}
+    if task.idempotency_key:
+        # A delivery re-sent after a crash carries the same Message-ID
+        headers["Message-ID"] = f"<{task.idempotency_key}@{DNS_NAME}>"
+
+    email = EmailMessage(
+        subject=subject,
+        body=body,
+        # from_email=os.environ.get("EMAIL_FROM"),
+        from_email=None,
+        to=[task.recipient_email],
+        headers=headers,
+    )
+    email.attach(f"{task.sheet_name}.{extension}", content, content_type)
+    ATTACHMENT_BYTES.labels(send_type).inc(len(content))
+    return email
+
+
+# ==========================================================
+# SEND PDF VERSION OF EACH SHEET
+# ==========================================================
+def process_pdf_and_send_emails(admin_instance, request, queryset, key_column="",
+                                profile=False):
+
+    enqueue_send_jobs(queryset, "pdf", request.user, key_column, profile)
+
+    _notify_success(admin_instance, request, "PDF emails queued for sending.")
 
 
 
 # ==========================================================
 # SEND EXCEL SHEETS
 # ==========================================================
-def process_sheet_and_send_emails(admin_instance, request, queryset):
+def process_sheet_and_send_emails(admin_instance, request, queryset, key_column="",
+                                  profile=False):
 
-    for excel_file in queryset:
-        wb = load_workbook(excel_file.file.path, data_only=True)
+    enqueue_send_jobs(queryset, "excel", request.user, key_column, profile)
 
-        for sheet_name in wb.sheetnames:
-            members = Member.objects.filter(
-                sheet_name=sheet_name,
-                department=excel_file.department,
-                created_by=excel_file.uploaded_by
-            )
-
-            for member in members:
-                try:
-                    buffer = BytesIO()
-                    new_wb = Workbook()
-                    new_ws = new_wb.active
-
-                    source_sheet = wb[sheet_name]
-                    for row in source_sheet.iter_rows():
-                        for cell in row:
-                            new_ws[cell.coordinate] = cell.value
-
-                    new_wb.save(buffer)
-                    excel_content = buffer.getvalue()
-                    buffer.close()
-
-                    email = EmailMessage(
-                        subject="Your Excel Sheet",
-                        body="Please find attached Excel file.",
-                        # from_email=os.environ.get("EMAIL_FROM"),
-                        from_email=None,
-                        to=[member.email],
-                    )
-                    email.attach(
-                        f"{sheet_name}.xlsx",
-                        excel_content,
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-                    email.send()
-
-                    EmailLog.objects.create(
-                        sent_by=request.user,
-                        recipient_email=member.email,
-                        sheet_name=sheet_name,
-                        send_type="excel",
-                        status="success"
-                    )
-
-                except Exception as e:
-                    EmailLog.objects.create(
-                        sent_by=request.user,
-                        recipient_email=member.email,
-                        sheet_name=sheet_name,
-                        send_type="excel",
-                        status="failed",
-                        error_message=str(e)
-                    )
-
-    _notify_success(admin_instance, request, "Excel emails processed.")
+    _notify_success(admin_instance, request, "Excel emails queued for sending.")
@@ -4,14 +4,31 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 
-from .models import Profile, Member, ExcelFile, Member, EmailLog
+from .models import Member, ExcelFile, ExcelSheet, EmailLog
 from .utils import (
     process_pdf_and_send_emails,
     process_sheet_and_send_emails
 )
-from openpyxl import load_workbook
-from django.http import Http404, HttpResponse
+from .workbooks import WorkbookReader, store_workbook_blob, try_record_sheet_manifest
+from .member_import import MemberImportError, import_members
+from .stats import get_dashboard_stats
+from .metrics import render_metrics, timed_view
+from .profiling import can_profile, profiling_requested
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.db.models import Prefetch, Q
+from django.core.paginator import Paginator
+from datetime import datetime, time, timedelta
 import csv
+import os
+import hmac
+
+EXPORT_CHUNK_SIZE = 2000
+EMAIL_LOGS_PAGE_SIZE = 50
+MEMBERS_PAGE_SIZE = 50
 
 
 # --------------------
@@ -67,15 +84,7 @@ def logout_view(request):
 # --------------------
 @login_required
 def dashboard(request):
-    user = request.user
-
-    members_count = Member.objects.filter(created_by=user).count()
-    excel_count = ExcelFile.objects.filter(uploaded_by=user).count()
-
-    context = {
-        "members_count": members_count,
-        "excel_count": excel_count,
-    }
+    context = get_dashboard_stats(request.user)
     return render(request, "dashboard.html", context)
 
 # ----------------------------
@@ -83,10 +92,15 @@ def dashboard(request):
 # ----------------------------
 @login_required
 def member_list(request):
-    members = Member.objects.filter(created_by=request.user)
+    members = Member.objects.filter(
+        created_by=request.user
+    ).order_by("name", "id")
+
+    page = Paginator(members, MEMBERS_PAGE_SIZE).get_page(request.GET.get("page"))
 
     return render(request, "members/member_list.html", {
-        "members": members
+        "members": page,
+        "page": page
     })
 
 
@@ -128,6 +142,41 @@ def member_add(request):
     return render(request, "members/member_add.html")
 
 
+# ----------------------------
+# BULK MEMBER IMPORT
+# ----------------------------
+@login_required
+def member_import(request):
+    report = None
+
+    if request.method == "POST":
+        roster = request.FILES.get("roster")
+
+        if not roster:
+            messages.error(request, "Please select a CSV or Excel roster")
+            return redirect("member_import")
+
+        try:
+            report = import_members(
+                roster,
+                roster.name,
+                department=request.user.profile.department,
+                created_by=request.user
+            )
+        except MemberImportError as e:
+            messages.error(request, str(e))
+            return redirect("member_import")
+
+        messages.success(
+            request,
+            f"Imported {report.created} member(s), skipped {report.skipped} row(s)"
+        )
+
+    return render(request, "members/member_import.html", {
+        "report": report
+    })
+
+
 # ----------------------------
 # DELETE MEMBER
 # ----------------------------
@@ -158,12 +207,21 @@ def excel_upload(request):
             messages.error(request, "Only Excel files are allowed")
             return redirect("excel_upload")
 
-        ExcelFile.objects.create(
-            file=excel_file,
+        # Identical uploads share one stored blob
+        name, content_hash = store_workbook_blob(excel_file)
+
+        excel = ExcelFile.objects.create(
+            file=name,
+            original_name=os.path.basename(excel_file.name),
             uploaded_by=request.user,
             department=request.user.profile.department
         )
 
+        # Parse the sheet list once here so listing pages never reopen the file
+        if try_record_sheet_manifest(excel, content_hash) is None:
+            messages.warning(request, "Excel file uploaded, but its sheets could not be read")
+            return redirect("excel_upload")
+
         messages.success(request, "Excel file uploaded successfully")
         return redirect("excel_upload")
 
@@ -176,29 +234,37 @@ def excel_upload(request):
 
 # Excel send
 @login_required
+@timed_view("excel_send")
 def excel_send(request):
 
-    excel_files = ExcelFile.objects.filter(uploaded_by=request.user)
+    # Files uploaded before manifests existed are parsed once, here;
+    # failures are remembered (manifest_error) and not retried per view
+    for excel in ExcelFile.objects.filter(
+        uploaded_by=request.user, content_hash="", manifest_error=""
+    ):
+        try_record_sheet_manifest(excel)
+
+    excel_files = ExcelFile.objects.filter(
+        uploaded_by=request.user
+    ).prefetch_related(
+        Prefetch("sheets", queryset=ExcelSheet.objects.order_by("position"))
+    )
 
     excel_with_sheets = []
 
     for excel in excel_files:
-        try:
-            wb = load_workbook(excel.file.path, data_only=True)
-            excel_with_sheets.append({
-                "excel": excel,
-                "sheets": wb.sheetnames
-            })
-        except Exception:
-            excel_with_sheets.append({
-                "excel": excel,
-                "sheets": []
-            })
+        excel_with_sheets.append({
+            "excel": excel,
+            "sheets": list(excel.sheets.all())
+        })
 
     # ---------------- SEND LOGIC ----------------
     if request.method == "POST":
         excel_id = request.POST.get("excel_id")
         send_type = request.POST.get("send_type")
+        # Personalised mode: each member only gets their own rows
+        key_column = request.POST.get("key_column", "").strip()
+        profile = profiling_requested(request)
 
         excel_file = ExcelFile.objects.filter(
             id=excel_id,
@@ -212,31 +278,89 @@ def excel_send(request):
         queryset = ExcelFile.objects.filter(id=excel_file.id)
 
         if send_type == "pdf":
-            process_pdf_and_send_emails(None, request, queryset)
+            process_pdf_and_send_emails(None, request, queryset, key_column, profile)
         elif send_type == "excel":
-            process_sheet_and_send_emails(None, request, queryset)
+            process_sheet_and_send_emails(None, request, queryset, key_column, profile)
         else:
             messages.error(request, "Invalid send option")
 
         return redirect("excel_send")
 
     return render(request, "excel/excel_send.html", {
-        "excel_with_sheets": excel_with_sheets
+        "excel_with_sheets": excel_with_sheets,
+        "can_profile": settings.PROFILING_ENABLED and can_profile(request.user),
     })
 
 # ! Email Logging
 @login_required
 def email_logs(request):
-    logs = EmailLog.objects.filter(
-        sent_by=request.user
-    ).order_by("-sent_at")
+    """
+    Keyset-paginated log browser, newest first.
+
+    Pages are addressed by a cursor on (sent_at, id) instead of an
+    OFFSET, so every page costs one index range scan on
+    (sent_by, sent_at, id) no matter how large the log grows.
+    - ?after=<cursor>  → older entries
+    - ?before=<cursor> → newer entries
+    """
+    logs = _filter_email_logs(
+        request,
+        EmailLog.objects.filter(sent_by=request.user)
+    )
+
+    after = _decode_log_cursor(request.GET.get("after"))
+    before = _decode_log_cursor(request.GET.get("before"))
+
+    if before:
+        sent_at, pk = before
+        page = list(
+            logs.filter(Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, id__gt=pk))
+            .order_by("sent_at", "id")[:EMAIL_LOGS_PAGE_SIZE + 1]
+        )
+        has_newer = len(page) > EMAIL_LOGS_PAGE_SIZE
+        page = page[:EMAIL_LOGS_PAGE_SIZE][::-1]
+        has_older = True
+    else:
+        if after:
+            sent_at, pk = after
+            logs = logs.filter(Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, id__lt=pk))
+        page = list(logs.order_by("-sent_at", "-id")[:EMAIL_LOGS_PAGE_SIZE + 1])
+        has_older = len(page) > EMAIL_LOGS_PAGE_SIZE
+        page = page[:EMAIL_LOGS_PAGE_SIZE]
+        has_newer = after is not None
+
+    # Current filters, carried over to pagination and export links
+    filters = request.GET.copy()
+    filters.pop("after", None)
+    filters.pop("before", None)
 
     return render(request, "email_logs.html", {
-        "logs": logs
+        "logs": page,
+        "filters": filters.urlencode(),
+        "status_choices": EmailLog.STATUS_CHOICES,
+        "send_type_choices": EmailLog.SEND_TYPE_CHOICES,
+        "older_cursor": _encode_log_cursor(page[-1]) if page and has_older else None,
+        "newer_cursor": _encode_log_cursor(page[0]) if page and has_newer else None,
     })
 
+
+def _encode_log_cursor(log):
+    raw = f"{log.sent_at.isoformat()}|{log.pk}"
+    return urlsafe_base64_encode(raw.encode())
+
+
+def _decode_log_cursor(value):
+    if not value:
+        return None
+    try:
+        sent_at, pk = urlsafe_base64_decode(value).decode().split("|")
+        return datetime.fromisoformat(sent_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
 # ! Excel file Preview
 @login_required
+@timed_view("excel_preview")
 def excel_preview(request, excel_id, sheet_name):
     excel_file = get_object_or_404(
         ExcelFile,
@@ -244,23 +368,15 @@ def excel_preview(request, excel_id, sheet_name):
         uploaded_by=request.user
     )
 
+    # Read first 10 rows for preview; parsing stops after the 10th row
     try:
-        wb = load_workbook(excel_file.file.path, data_only=True)
+        with WorkbookReader(excel_file.file.path) as reader:
+            preview_data = list(reader.iter_rows(sheet_name, limit=10))
+    except KeyError:
+        raise Http404("Sheet not found")
     except Exception:
         raise Http404("Unable to read Excel file")
 
-    if sheet_name not in wb.sheetnames:
-        raise Http404("Sheet not found")
-
-    sheet = wb[sheet_name]
-
-    # Read first 10 rows for preview
-    preview_data = []
-    for i, row in enumerate(sheet.iter_rows(values_only=True)):
-        preview_data.append(row)
-        if i >= 9:
-            break
-
     context = {
         "excel_file": excel_file,
         "sheet_name": sheet_name,
@@ -270,43 +386,141 @@ def excel_preview(request, excel_id, sheet_name):
     return render(request, "excel/excel_preview.html", context)
 
 
+# ! Email log filters (shared by the log page and the CSV export)
+def _filter_email_logs(request, logs):
+    """
+    Applies the optional GET filters:
+    - status, send_type, sheet → exact match
+    - date_from, date_to → YYYY-MM-DD, inclusive, in the site timezone
+    Invalid values are ignored.
+    """
+    status = request.GET.get("status")
+    if status in dict(EmailLog.STATUS_CHOICES):
+        logs = logs.filter(status=status)
+
+    send_type = request.GET.get("send_type")
+    if send_type in dict(EmailLog.SEND_TYPE_CHOICES):
+        logs = logs.filter(send_type=send_type)
+
+    sheet = request.GET.get("sheet")
+    if sheet:
+        logs = logs.filter(sheet_name=sheet)
+
+    # Compare against datetime bounds (not __date) so the index is usable
+    date_from = _parse_date(request.GET.get("date_from"))
+    if date_from:
+        logs = logs.filter(
+            sent_at__gte=timezone.make_aware(datetime.combine(date_from, time.min))
+        )
+
+    date_to = _parse_date(request.GET.get("date_to"))
+    if date_to:
+        logs = logs.filter(
+            sent_at__lt=timezone.make_aware(
+                datetime.combine(date_to + timedelta(days=1), time.min)
+            )
+        )
+
+    return logs
+
+
+def _parse_date(value):
+    try:
+        return parse_date(value or "")
+    except ValueError:
+        return None
+
+
+class _Echo:
+    """
+    File-like object for csv.writer that hands each row straight back.
+    """
+    def write(self, value):
+        return value
+
+
 @login_required
 def export_email_logs(request):
     """
     Export email logs as CSV.
     Dept Head → only their logs
+
+    Streams rows from a chunked cursor, so memory stays constant and the
+    first bytes go out immediately regardless of the log size.
+    Accepts the same filters as the log page.
     """
 
-    logs = EmailLog.objects.filter(
-        sent_by=request.user
-    ).order_by("-sent_at")
+    logs = _filter_email_logs(
+        request,
+        EmailLog.objects.filter(sent_by=request.user)
+    ).order_by("-sent_at").values_list(
+        "recipient_email",
+        "sheet_name",
+        "send_type",
+        "status",
+        "error_message",
+        "sent_at",
+    )
 
-    response = HttpResponse(
+    writer = csv.writer(_Echo())
+
+    def rows():
+        # Header row
+        yield writer.writerow([
+            "Recipient Email",
+            "Sheet Name",
+            "Send Type",
+            "Status",
+            "Error Message",
+            "Sent At"
+        ])
+
+        # Data rows
+        for recipient_email, sheet_name, send_type, status, error_message, sent_at in \
+                logs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield writer.writerow([
+                recipient_email,
+                sheet_name,
+                send_type,
+                status,
+                error_message,
+                sent_at.strftime("%Y-%m-%d %H:%M:%S"),
+            ])
+
+    response = StreamingHttpResponse(
+        rows(),
         content_type="text/csv"
     )
     response["Content-Disposition"] = 'attachment; filename="email_logs.csv"'
 
-    writer = csv.writer(response)
-
-    # Header row
-    writer.writerow([
-        "Recipient Email",
-        "Sheet Name",
-        "Send Type",
-        "Status",
-        "Error Message",
-        "Sent At"
-    ])
-
-    # Data rows
-    for log in logs:
-        writer.writerow([
-            log.recipient_email,
-            log.sheet_name,
-            log.send_type,
-            log.status,
-            log.error_message,
-            log.sent_at.strftime("%Y-%m-%d %H:%M:%S"),
-        ])
-
     return response
+
+
+# ! Prometheus metrics
+def metrics(request):
+    """
+    Send pipeline metrics in the Prometheus text format, summed over every
+    gunicorn and send_worker process (see myapp.metrics).
+
+    Allowed for superusers and managers, or for a scraper sending
+    `Authorization: Bearer <METRICS_TOKEN>` when METRICS_TOKEN is set.
+    """
+    if not _can_read_metrics(request):
+        response = HttpResponse("Unauthorized", status=401, content_type="text/plain")
+        response["WWW-Authenticate"] = 'Bearer realm="metrics"'
+        return response
+
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+
+def _can_read_metrics(request):
+    user = request.user
+    if user.is_authenticated and (user.is_superuser or (
+        hasattr(user, "profile") and user.profile.role == "manager"
+    )):
+        return True
+
+    token = settings.METRICS_TOKEN
+    header = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(header, f"Bearer {token}")
@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import os
+import tempfile
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from openpyxl import load_workbook
+
+from .attachments import file_content_hash
+from .metrics import stage_timer
+from .models import ExcelFile, ExcelSheet
+
+
+logger = logging.getLogger(__name__)
+
+# Uploaded workbooks are stored once per distinct content, under
+# <BLOB_DIR>/<first 2 hex chars>/<sha256><extension>
+BLOB_DIR = "excel_files/blobs"
+
+
+# ==========================================================
+# CONTENT-ADDRESSED UPLOAD STORAGE
+# ==========================================================
+def store_workbook_blob(uploaded_file):
+    """
+    Streams an upload to disk while hashing it, then files it under its
+    SHA-256. When a blob with the same content already exists the new
+    copy is discarded, so repeated uploads of one workbook share a file.
+
+    Returns (storage name, content hash); the name is meant to be
+    assigned to ExcelFile.file.
+    """
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    directory = default_storage.path(BLOB_DIR)
+    os.makedirs(directory, exist_ok=True)
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            for chunk in uploaded_file.chunks():
+                digest.update(chunk)
+                fh.write(chunk)
+
+        content_hash = digest.hexdigest()
+        name = f"{BLOB_DIR}/{content_hash[:2]}/{content_hash}{extension}"
+        path = default_storage.path(name)
+
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return name, content_hash
+
+
+# ==========================================================
+# STREAMING WORKBOOK READER
+# ==========================================================
+class WorkbookReader:
+    """
+    Shared read-only access to a workbook for the preview and send paths.
+
+    - Uses openpyxl's read-only (streaming) mode, so rows are parsed from
+      the sheet XML as they are iterated instead of being loaded up front
+    - The file is only opened on first use; a reader that is never
+      touched costs no I/O
+    - iter_rows(limit=...) stops parsing as soon as enough rows are read
+
+    Usage:
+        with WorkbookReader(path) as reader:
+            for row in reader.iter_rows("Sheet1", limit=10):
+                ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._wb = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def workbook(self):
+        if self._wb is None:
+            with stage_timer("load_workbook"):
+                self._wb = load_workbook(self.path, read_only=True, data_only=True)
+        return self._wb
+
+    @property
+    def sheet_names(self):
+        return [ws.title for ws in self.workbook.worksheets]
+
+    def iter_rows(self, sheet_name, limit=None):
+        """
+        Lazily yields each row of a sheet as a tuple of cell values.
+        Raises KeyError if the sheet does not exist.
+        """
+        if sheet_name not in self.sheet_names:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+
+        rows = self.workbook[sheet_name].iter_rows(values_only=True)
+        if limit is not None:
+            rows = islice(rows, limit)
+        return rows
+
+    def close(self):
+        if self._wb is not None:
+            self._wb.close()
+            self._wb = None
+
+
+# ==========================================================
+# ROW PARTITIONING
+# ==========================================================
+def partition_rows(rows, key_column, keys):
+    """
+    Splits a sheet's rows by the value in its `key_column` column, in a
+    single pass: each row is looked up in a dict of buckets, so the cost
+    is O(rows) however many keys there are.
+
+    - The first row is the header; key_column is matched against it
+      case-insensitively
+    - Keys are compared stripped and case-insensitively
+    - Rows whose key is not in `keys` are dropped as they are read, so
+      only the rows that will be sent are held in memory
+
+    Returns (header, {normalised key: [row, ...]}). Raises KeyError when
+    the sheet is empty or has no such column.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise KeyError("The sheet is empty")
+
+    wanted = key_column.strip().lower()
+    index = next(
+        (
+            position for position, title in enumerate(header)
+            if title is not None and str(title).strip().lower() == wanted
+        ),
+        None
+    )
+    if index is None:
+        raise KeyError(f"Column {key_column} not found in the header row")
+
+    buckets = {normalise_key(key): [] for key in keys}
+    for row in rows:
+        if index < len(row) and row[index] is not None:
+            bucket = buckets.get(normalise_key(row[index]))
+            if bucket is not None:
+                bucket.append(row)
+
+    return header, buckets
+
+
+def normalise_key(value):
+    return str(value).strip().lower()
+
+
+# ==========================================================
+# SHEET MANIFEST
+# ==========================================================
+def read_sheet_manifest(path):
+    """
+    Returns [(name, max_row, max_column), ...] for every worksheet.
+    Only the dimension headers are parsed unless a sheet is missing them.
+    """
+    manifest = []
+    with WorkbookReader(path) as reader:
+        for ws in reader.workbook.worksheets:
+            max_row, max_column = ws.max_row, ws.max_column
+
+            # Some writers omit the <dimension> tag; count rows instead
+            if max_row is None or max_column is None:
+                max_row = max_column = 0
+                for row in ws.iter_rows(values_only=True):
+                    max_row += 1
+                    max_column = max(max_column, len(row))
+
+            manifest.append((ws.title, max_row, max_column))
+
+    return manifest
+
+
+def record_sheet_manifest(excel_file, content_hash=None):
+    """
+    Extracts the content hash and sheet manifest of an uploaded file
+    and stores them on ExcelFile / ExcelSheet. Returns the sheet names.
+
+    The workbook is only parsed when no other ExcelFile with the same
+    content hash has a manifest yet; otherwise that manifest is copied.
+    Pass content_hash when it is already known (store_workbook_blob).
+    """
+    path = excel_file.file.path
+    content_hash = content_hash or file_content_hash(path)
+    manifest = _known_manifest(excel_file, content_hash) or read_sheet_manifest(path)
+
+    with transaction.atomic():
+        excel_file.sheets.all().delete()
+        ExcelSheet.objects.bulk_create([
+            ExcelSheet(
+                excel_file=excel_file,
+                name=name,
+                position=position,
+                max_row=max_row,
+                max_column=max_column
+            )
+            for position, (name, max_row, max_column) in enumerate(manifest)
+        ])
+        excel_file.content_hash = content_hash
+        excel_file.manifest_error = ""
+        excel_file.save(update_fields=["content_hash", "manifest_error"])
+
+    return [name for name, _, _ in manifest]
+
+
+def try_record_sheet_manifest(excel_file, content_hash=None):
+    """
+    record_sheet_manifest for upload and listing paths: a workbook that
+    cannot be read is logged and the error kept on manifest_error, so
+    the pages listing it do not re-parse it on every request.
+    Returns the sheet names, or None on failure.
+    """
+    try:
+        return record_sheet_manifest(excel_file, content_hash)
+    except Exception as e:
+        logger.exception("Could not read the sheet list of %s", excel_file.file.name)
+        excel_file.manifest_error = str(e) or e.__class__.__name__
+        excel_file.save(update_fields=["manifest_error"])
+        return None
+
+
+def _known_manifest(excel_file, content_hash):
+    source = (
+        ExcelFile.objects
+        .filter(content_hash=content_hash, sheets__isnull=False)
+        .exclude(pk=excel_file.pk)
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if source is None:
+        return None
+    return list(
+        ExcelSheet.objects
+        .filter(excel_file_id=source)
+        .order_by("position")
+        .values_list("name", "max_row", "max_column")
+    )
+
+
+def sheet_names_for(excel_file):
+    """
+    Sheet names from the stored manifest, extracting it first for
+    files uploaded before manifests existed.
+    """
+    if not excel_file.content_hash:
+        return record_sheet_manifest(excel_file)
+    return list(excel_file.sheets.values_list("name", flat=True))
@@ -0,0 +1,26 @@
+#!/bin/bash
+# Container entry point: runs the web server and the send workers side by
+# side. Sends are only queued by the web requests, so without a worker
+# nothing is ever delivered. If any process exits, the others are stopped
+# and the container exits, so the platform restarts all of them.
+
+cd "$(dirname "$0")"
+
+# Samples left by the previous run's processes must not be summed into
+# /metrics (see METRICS_DIR in settings)
+metrics_dir="${PROMETHEUS_MULTIPROC_DIR:-metrics}"
+rm -rf "$metrics_dir" && mkdir -p "$metrics_dir"
+
+for _ in $(seq "${SEND_WORKERS:-1}"); do
+    python manage.py send_worker &
+done
+
+gunicorn --config gunicorn.conf.py TeacherProj.wsgi:application &
+
+trap 'kill -TERM $(jobs -p) 2>/dev/null' TERM INT
+
+wait -n
+status=$?
+kill -TERM $(jobs -p) 2>/dev/null
+wait
+exit $status